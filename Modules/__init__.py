@@ -1,6 +1,28 @@
 from .model_answer import *
 from .prompt_creation import *
-from .querie_exec import *
+from .aggregation import *
 from .statistics import *
+from .significance import *
+from .pretriage import *
 from .table_processing import *
-from .rag import *
+from .result_store import *
+from .response_cache import *
+from .pipeline import *
+from .telemetry import *
+from .progress import *
+from .profiling import span
+
+import importlib
+
+# querie_exec, scheduler and endpoints (ollama/httpx) and rag (sentence-transformers, torch, faiss) are only imported
+# when one of their names is first used, so reporting code does not pay for them
+_LAZY_MODULES = ("querie_exec", "scheduler", "endpoints", "rag")
+
+def __getattr__(name):
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    for module_name in _LAZY_MODULES:
+        module = importlib.import_module(f".{module_name}", __name__)
+        if hasattr(module, name):
+            return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+from typing import NamedTuple
+
+# Cores do MTS, da mais urgente para a menos urgente
+MTS_LABELS = ("Vermelho", "Laranja", "Amarelo", "Verde", "Azul")
+
+# Spellings accepted for each colour (compared after strip + lower)
+LABEL_ALIASES = {
+    "vermelho": "Vermelho", "red": "Vermelho",
+    "laranja": "Laranja", "orange": "Laranja",
+    "amarelo": "Amarelo", "yellow": "Amarelo",
+    "verde": "Verde", "green": "Verde",
+    "azul": "Azul", "blue": "Azul",
+}
+
+TIE_BREAKS = ("alphabetical", "most_urgent", "least_urgent", "first_run")
+
+# Com até 3 execuções a margem da moda só repete a concordância (3-0, 2-1, 1-1-1), então ela só é reportada a partir de 4
+MARGIN_MIN_RUNS = 4
+
+class voteResult(NamedTuple):
+    mode: np.ndarray        # winning label code per cell, -1 when the cell has no vote
+    votes: np.ndarray       # votes of the winning label
+    margin: np.ndarray      # votes of the winner minus votes of the runner-up
+    n_votes: np.ndarray     # valid votes of the cell
+    tied: np.ndarray        # whether the tie-break policy decided the winner
+    counts: np.ndarray      # votes of every label, shape (..., labels)
+
+def normalize_label(label) -> str:
+    """
+        Maps an answer to its MTS colour ("vermelho", " Red" -> "Vermelho"). Anything else
+        (None, "Failed JSON", "Timeout", free text) returns None.
+    """
+
+    if not isinstance(label, str):
+        return None
+    return LABEL_ALIASES.get(label.strip().lower())
+
+def encode_answers(answers) -> np.ndarray:
+    """
+        Encodes answers into codes of MTS_LABELS (0 = Vermelho ... 4 = Azul); answers that are
+        not a colour are encoded as -1. Each distinct answer is normalised only once.
+    """
+
+    answers = np.asarray(answers, dtype=object)
+    codes, uniques = pd.factorize(answers.ravel(), use_na_sentinel=True)
+    index = {label: i for i, label in enumerate(MTS_LABELS)}
+    lookup = np.array([index.get(normalize_label(u), -1) for u in uniques] + [-1], dtype=np.int8)
+    # factorize marks missing values with -1, which picks the extra -1 entry of the lookup
+    return lookup[codes].reshape(answers.shape)
+
+def normalize_answers(answers) -> np.ndarray:
+    """
+        Replaces colour spellings by their MTS_LABELS name; other answers are kept as they are.
+    """
+
+    answers = np.asarray(answers, dtype=object)
+    codes, uniques = pd.factorize(answers.ravel(), use_na_sentinel=True)
+    lookup = np.array([normalize_label(u) or u for u in uniques] + [None], dtype=object)
+    return lookup[codes].reshape(answers.shape)
+
+def tie_break_rank(labels, tie_break: str) -> np.ndarray:
+    """
+        Rank of each label under a static tie-break policy (lower wins). Labels that are not an
+        MTS colour rank last under the urgency policies.
+    """
+
+    labels = list(labels)
+    if tie_break == "alphabetical":
+        # Legacy behaviour of DataFrame.mode
+        order = sorted(range(len(labels)), key=lambda i: str(labels[i]))
+        rank = np.empty(len(labels), dtype=np.int64)
+        rank[order] = np.arange(len(labels))
+        return rank
+
+    severity = {label: i for i, label in enumerate(MTS_LABELS)}
+    rank = np.array([severity.get(normalize_label(label), len(MTS_LABELS)) for label in labels], dtype=np.int64)
+    if tie_break == "most_urgent":
+        return rank
+    if tie_break == "least_urgent":
+        return np.where(rank < len(MTS_LABELS), len(MTS_LABELS) - 1 - rank, len(MTS_LABELS))
+    raise ValueError(f"Unknown tie-break policy: {tie_break}. Choose from {TIE_BREAKS}.")
+
+def majority_vote(codes: np.ndarray, n_labels: int, tie_break: str = "alphabetical", labels=None) -> voteResult:
+    """
+        Majority vote over the last axis of a code array, for every cell at once.
+
+        Votes are counted with a single bincount over the whole array; among the labels sharing
+        the highest count the tie-break policy picks the winner: "alphabetical" (first label name,
+        like DataFrame.mode), "most_urgent" / "least_urgent" (by MTS severity) or "first_run"
+        (the label voted first).
+    Args:
+        codes (np.ndarray): Label codes, shape (..., runs); negative codes are not votes.
+        n_labels (int): Number of label codes.
+        tie_break (str): One of TIE_BREAKS.
+        labels (list, optional): Label of each code, needed by the static policies. Defaults to MTS_LABELS.
+    Returns:
+        voteResult: Arrays of shape codes.shape[:-1].
+    """
+
+    if tie_break not in TIE_BREAKS:
+        raise ValueError(f"Unknown tie-break policy: {tie_break}. Choose from {TIE_BREAKS}.")
+
+    codes = np.asarray(codes)
+    cells_shape, R = codes.shape[:-1], codes.shape[-1]
+    flat = codes.reshape(-1, R)
+    C, K = flat.shape[0], max(n_labels, 1)
+
+    valid = flat >= 0
+    cell = np.broadcast_to(np.arange(C)[:, None], flat.shape)
+    counts = np.bincount((cell * K + flat)[valid], minlength=C * K).reshape(C, K)
+    n_votes = counts.sum(axis=-1)
+
+    top = counts.max(axis=-1)
+    candidates = (counts == top[:, None]) & (top[:, None] > 0)
+    tied = candidates.sum(axis=-1) > 1
+
+    if tie_break == "first_run":
+        # Run of the first vote of each label; assigning the runs backwards leaves the earliest one
+        rank = np.full((C, K), R, dtype=np.int64)
+        rows = np.arange(C)
+        for r in range(R - 1, -1, -1):
+            voted = valid[:, r]
+            rank[rows[voted], flat[voted, r]] = r
+    else:
+        rank = np.broadcast_to(tie_break_rank(MTS_LABELS if labels is None else labels, tie_break), (C, K))
+
+    worst = np.iinfo(np.int64).max
+    mode = np.where(candidates, rank, worst).argmin(axis=-1)
+    mode = np.where(n_votes > 0, mode, -1)
+
+    runner_up = np.sort(counts, axis=-1)[:, -2] if K > 1 else np.zeros(C, dtype=counts.dtype)
+    return voteResult(mode=mode.reshape(cells_shape),
+                      votes=top.reshape(cells_shape),
+                      margin=(top - runner_up).reshape(cells_shape),
+                      n_votes=n_votes.reshape(cells_shape),
+                      tied=tied.reshape(cells_shape),
+                      counts=counts.reshape(cells_shape + (K,)))
+
+def aggregate_answers(answers, tie_break: str = "alphabetical") -> tuple:
+    """
+        Normalises raw answers to MTS colours and takes the majority vote over the last axis (runs).
+    Args:
+        answers (array-like): Answers, shape (..., runs). Non-colour answers and missing ones are not votes.
+        tie_break (str): One of TIE_BREAKS.
+    Returns:
+        tuple: (mode labels as an object array, None where a cell has no vote; voteResult)
+    """
+
+    result = majority_vote(encode_answers(answers), len(MTS_LABELS), tie_break)
+    names = np.array(MTS_LABELS + (None,), dtype=object)
+    return names[result.mode], result
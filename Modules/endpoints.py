@@ -0,0 +1,208 @@
+import time
+import threading
+import httpx
+import ollama
+
+# Errors after which a request is retried on another host
+HOST_ERRORS = (ConnectionError, httpx.TransportError, ollama.ResponseError)
+
+# Seconds a health check waits for a host, so an unreachable host cannot stall the workers
+CHECK_TIMEOUT = 5.0
+
+class noHostAvailable(RuntimeError):
+    """
+        No healthy host can serve the model of a request (every host having it failed or is down).
+    """
+
+class ollamaEndpoint:
+    """
+        One Ollama host of an endpointPool: its client, model inventory, concurrency cap and health.
+    """
+
+    def __init__(self, host: str, max_concurrency: int = 1, timeout: float = None, check_timeout: float = CHECK_TIMEOUT):
+        self.host = host
+        self.max_concurrency = max_concurrency
+        self.client = ollama.Client(host=host, timeout=timeout)
+        self.check_client = ollama.Client(host=host, timeout=check_timeout)
+        self.models = {}
+        self.outstanding = 0
+        self.healthy = False
+        self.failures = 0
+        self.requests = 0
+        self.retry_at = 0.0
+        self.checking = False
+
+    def check(self) -> bool:
+        """
+            Health check: lists the models of the host, waiting at most the check timeout.
+            Updates the inventory (name -> digest) on success.
+        """
+
+        try:
+            self.models = {m.model: m.digest for m in self.check_client.list().models}
+            self.healthy = True
+        except HOST_ERRORS:
+            self.healthy = False
+        return self.healthy
+
+    def __repr__(self):
+        return f"ollamaEndpoint({self.host!r}, outstanding={self.outstanding}/{self.max_concurrency}, healthy={self.healthy})"
+
+    @staticmethod
+    def parse(spec: str, default_concurrency: int = 1) -> tuple:
+        """
+            Parses "host[=max_concurrency]", e.g. "http://box1:11434=4".
+        """
+
+        host, _, cap = spec.rpartition("=") if "=" in spec else (spec, "", "")
+        return host, int(cap) if cap else default_concurrency
+
+class endpointPool:
+    """
+        Pool of Ollama hosts used as a single backend.
+
+        Each request goes to the healthy host that has the model and the fewest outstanding
+        requests, without exceeding the host's concurrency cap (a caller waits while every host
+        having the model is full). When a host fails, it is marked down and the request is retried
+        on another host having the model. Hosts that are down are checked again after `cooldown`
+        seconds, on a background thread: requests keep going to the healthy hosts meanwhile, and
+        only wait for a check when no other host can serve their model.
+    """
+
+    def __init__(self, hosts: list[str], max_concurrency: int = 1, timeout: float = None, cooldown: float = 30.0):
+        self.endpoints = []
+        for spec in hosts:
+            host, cap = ollamaEndpoint.parse(spec, max_concurrency)
+            self.endpoints.append(ollamaEndpoint(host, cap, timeout))
+        self.cooldown = cooldown
+        self._cond = threading.Condition()
+        self.refresh()
+
+    def refresh(self):
+        """
+            Runs the health check of every host, refreshing their model inventories.
+        """
+
+        for endpoint in self.endpoints:
+            if not endpoint.check():
+                endpoint.retry_at = time.monotonic() + self.cooldown
+
+    @property
+    def capacity(self) -> int:
+        return sum(e.max_concurrency for e in self.endpoints if e.healthy)
+
+    def models(self) -> list[str]:
+        """
+            Models available on at least one healthy host, in host order.
+        """
+
+        return list(dict.fromkeys(m for e in self.endpoints if e.healthy for m in e.models))
+
+    def digests(self) -> dict:
+        digests = {}
+        for e in self.endpoints:
+            for model, digest in e.models.items():
+                digests.setdefault(model, digest)
+        return digests
+
+    def clients(self, model: str) -> list:
+        """
+            Clients of the healthy hosts having the model (e.g. to warm it up on every host).
+        """
+
+        return [e.client for e in self.endpoints if e.healthy and model in e.models]
+
+    def acquire(self, model: str, exclude: set = ()) -> ollamaEndpoint:
+        """
+            Reserves a request slot on the least loaded healthy host having the model, waiting for
+            a free slot when needed. Returns None when no host outside `exclude` can serve the model.
+        """
+
+        with self._cond:
+            while True:
+                self._start_checks(exclude)
+                candidates = [e for e in self.endpoints if e.healthy and model in e.models and e not in exclude]
+                if not candidates:
+                    # Um host em verificação ainda pode voltar com o modelo
+                    if any(e.checking and e not in exclude for e in self.endpoints):
+                        self._cond.wait(timeout=self.cooldown)
+                        continue
+                    return None
+
+                free = [e for e in candidates if e.outstanding < e.max_concurrency]
+                if free:
+                    endpoint = min(free, key=lambda e: e.outstanding / e.max_concurrency)
+                    endpoint.outstanding += 1
+                    endpoint.requests += 1
+                    return endpoint
+                self._cond.wait(timeout=self.cooldown)
+
+    def release(self, endpoint: ollamaEndpoint, failed: bool = False):
+        with self._cond:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failures += 1
+                endpoint.healthy = False
+                endpoint.retry_at = time.monotonic() + self.cooldown
+            self._cond.notify_all()
+
+    def _start_checks(self, exclude):
+        # Called with the lock held; the health check itself (a network call) runs without it
+        now = time.monotonic()
+        for e in self.endpoints:
+            if not e.healthy and not e.checking and e not in exclude and now >= e.retry_at:
+                e.checking = True
+                threading.Thread(target=self._check, args=(e,), daemon=True).start()
+
+    def _check(self, endpoint: ollamaEndpoint):
+        healthy = endpoint.check()
+        with self._cond:
+            endpoint.checking = False
+            if not healthy:
+                endpoint.retry_at = time.monotonic() + self.cooldown
+            self._cond.notify_all()
+
+    def call(self, model: str, request):
+        """
+            Runs request(client) on a host having the model, retrying on the other hosts when one fails.
+        Args:
+            model (str): Model the request needs.
+            request (callable): Called with the ollama.Client of the chosen host.
+        Returns:
+            The result of request.
+        Raises:
+            noHostAvailable: No host left to try.
+        """
+
+        tried = set()
+        while True:
+            endpoint = self.acquire(model, exclude=tried)
+            if endpoint is None:
+                raise noHostAvailable(f"No healthy Ollama host can serve {model} (tried {[e.host for e in tried]}).")
+
+            try:
+                result = request(endpoint.client)
+            except HOST_ERRORS as e:
+                if isinstance(e, ollama.ResponseError) and e.status_code == 404:
+                    # The host no longer has the model; it stays up for the others
+                    endpoint.models.pop(model, None)
+                    self.release(endpoint)
+                elif isinstance(e, ollama.ResponseError) and e.status_code < 500:
+                    # Bad request: the same request would fail on any host
+                    self.release(endpoint)
+                    raise
+                else:
+                    self.release(endpoint, failed=True)
+                tried.add(endpoint)
+                continue
+            except BaseException:
+                # Not a host failure (e.g. a deadline or cancellation): free the slot and let the caller handle it
+                self.release(endpoint)
+                raise
+
+            self.release(endpoint)
+            return result
+
+    def stats(self) -> list[dict]:
+        return [{"host": e.host, "healthy": e.healthy, "requests": e.requests, "failures": e.failures,
+                 "max_concurrency": e.max_concurrency, "models": len(e.models)} for e in self.endpoints]
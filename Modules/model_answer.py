@@ -1,19 +1,180 @@
 import json
+import numpy as np
 import pandas as pd
 
+from Modules.aggregation import MARGIN_MIN_RUNS, aggregate_answers
+
+MISSING = -1
+
+class answerStore:
+    """
+        Compact store of the answers of one model.
+
+        Answers are kept as integer codes in a (prompts, cases, runs) array; the distinct labels
+        ("Vermelho", "Failed JSON", ...) are stored once. Explanations are interned into a separate
+        column that is only materialised when needed, optionally read on first access through
+        `explanation_loader`. Status and telemetry are kept sparsely for the slots that have them.
+        Slots without an answer hold MISSING.
+    """
+
+    def __init__(self, prompts: list[str], case_ids: list, validation: int, explanation_loader=None):
+        self.prompts = list(prompts)
+        self.case_ids = list(case_ids)
+        self.validation = validation
+        self._prompt_index = {p: i for i, p in enumerate(self.prompts)}
+        self._case_index = {c: i for i, c in enumerate(self.case_ids)}
+
+        shape = (len(self.prompts), len(self.case_ids), validation)
+        self.codes = np.full(shape, MISSING, dtype=np.int32)
+        self.labels = []
+        self._label_codes = {}
+
+        self._explanation_codes = None
+        self.explanations = []
+        self._interned = {}
+        self._loader = explanation_loader
+
+        self.extras = {}
+        # Bumped on every change so cached views can tell they are stale
+        self.version = 0
+
+    @classmethod
+    def from_responses(cls, responses: dict, validation: int) -> "answerStore":
+        """
+            Builds the store from the nested prompt -> case -> runs dict layout.
+        """
+
+        prompts = list(responses)
+        case_ids = list(responses[prompts[0]]) if prompts else []
+        store = cls(prompts, case_ids, validation)
+        for prompt, cases in responses.items():
+            for case_id, runs in cases.items():
+                for run, answer in enumerate(runs):
+                    if answer is not None:
+                        store.set(prompt, case_id, run, answer)
+        return store
+
+    def _code(self, label) -> int:
+        code = self._label_codes.get(label)
+        if code is None:
+            code = self._label_codes[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+    def _intern(self, explanation) -> int:
+        code = self._interned.get(explanation)
+        if code is None:
+            code = self._interned[explanation] = len(self.explanations)
+            self.explanations.append(explanation)
+        return code
+
+    def _explanation_column(self) -> np.ndarray:
+        if self._explanation_codes is None:
+            self._explanation_codes = np.full(self.codes.shape, MISSING, dtype=np.int32)
+            if self._loader is not None:
+                loader, self._loader = self._loader, None
+                for prompt, case_id, run, explanation in loader():
+                    index = self.index(prompt, case_id, run)
+                    if index is not None:
+                        self._explanation_codes[index] = self._intern(explanation)
+        return self._explanation_codes
+
+    def index(self, prompt: str, case_id, run: int):
+        p, c = self._prompt_index.get(prompt), self._case_index.get(case_id)
+        if p is None or c is None or not 0 <= run < self.validation:
+            return None
+        return p, c, run
+
+    def set(self, prompt: str, case_id, run: int, answer: dict):
+        """
+            Stores an answer dict ({"answer", "explanation", optional "status" and "telemetry"}).
+        """
+
+        index = self.index(prompt, case_id, run)
+        if index is None:
+            raise KeyError(f"No slot for ({prompt}, {case_id}, {run}).")
+
+        self.codes[index] = self._code(answer["answer"])
+        if "explanation" in answer and (self._explanation_codes is not None or self._loader is None):
+            self._explanation_column()[index] = self._intern(answer["explanation"])
+
+        extra = {k: answer[k] for k in ("status", "telemetry") if k in answer}
+        if extra:
+            self.extras[index] = extra
+        else:
+            self.extras.pop(index, None)
+        self.version += 1
+
+    def get(self, prompt: str, case_id, run: int) -> dict:
+        """
+            Returns the answer dict of a slot, or None when it has no answer.
+        """
+
+        index = self.index(prompt, case_id, run)
+        if index is None or self.codes[index] == MISSING:
+            return None
+        return self._answer(index)
+
+    def _answer(self, index) -> dict:
+        explanation = self._explanation_column()[index]
+        answer = {"answer": self.labels[self.codes[index]], "explanation": self.explanations[explanation] if explanation != MISSING else ""}
+        answer.update(self.extras.get(index, {}))
+        return answer
+
+    def answers(self) -> np.ndarray:
+        """
+            Answer labels as an object array (prompts, cases, runs); slots without an answer are None.
+        """
+
+        # The extra entry at the end is what MISSING (-1) indexes
+        return np.array(self.labels + [None], dtype=object)[self.codes]
+
+    def __len__(self) -> int:
+        return int((self.codes != MISSING).sum())
+
 class modelAnswer:
     model: str
     validation: int
     prompts_used: int
     n_cases: int
-    responses: dict
+    store: answerStore
 
-    def __init__(self, model, validation, prompts_used, n_cases, responses):
+    def __init__(self, model, validation, prompts_used, n_cases, responses=None, store: answerStore = None):
         self.model = model
         self.validation = validation
         self.prompts_used = prompts_used
         self.n_cases = n_cases
-        self.responses = responses
+        self.store = store if store is not None else answerStore.from_responses(responses or {}, validation)
+        self._views = {}
+        self._views_version = None
+
+    @property
+    def responses(self) -> dict:
+        """
+            Nested prompt -> case -> runs view of the answers (None for runs without an answer).
+            Built on first access and cached until the answers change.
+        """
+
+        return self._cached("responses", lambda: {prompt: {case_id: [self.store.get(prompt, case_id, run) for run in range(self.validation)]
+                                                           for case_id in self.store.case_ids}
+                                                  for prompt in self.store.prompts})
+
+    @responses.setter
+    def responses(self, responses: dict):
+        self.store = answerStore.from_responses(responses, self.validation)
+
+    def set_answer(self, prompt, case_id, run, answer: dict):
+        self.store.set(prompt, case_id, run, answer)
+
+    def _cached(self, name, build):
+        # Views are dropped whenever the store changed (or was replaced) since they were built
+        version = (id(self.store), self.store.version)
+        if self._views_version != version:
+            self._views = {}
+            self._views_version = version
+        if name not in self._views:
+            self._views[name] = build()
+        return self._views[name]
 
     def print_summary(self):
         print(f"Model: {self.model}")
@@ -39,62 +200,75 @@ class modelAnswer:
             for case_id, case_responses in responses.items():
                 print(f"    Case {case_id}:")
                 for resp in case_responses:
+                    if resp is None:
+                        continue
                     print(f"      Answer: {resp['answer']}")
                     print(f"      Explanation: {resp['explanation']}")
 
-    def build_responses_df(self):   
+    def build_responses_df(self):
+        """
+            Wide table of the answers: ID, then one "<prompt> (<run>x)" column per prompt and run.
+            Built once per version of the answers; a copy is returned so callers may modify it.
+        """
 
-        dfs = []
+        return self._cached("responses_df", self._build_responses_df).copy()
 
-        ids = []
-        first_prompt = next(iter(self.responses.values()))
-        for case_id in first_prompt.keys():
-            ids.append(case_id)
+    def _build_responses_df(self) -> pd.DataFrame:
+        answers = self.store.answers()
+        P, N, R = answers.shape
+        columns = [f'{prompt} ({i+1}x)' for prompt in self.store.prompts for i in range(R)]
+        df = pd.DataFrame(answers.transpose(1, 0, 2).reshape(N, P * R), columns=columns)
+        df.insert(0, 'ID', self.store.case_ids)
+        return df
 
-        dfs.append(pd.DataFrame(data=ids, columns=['ID']))
+    def get_case_responses(self, correct_answers: pd.DataFrame = None, tie_break: str = "alphabetical"):
+        """
+            Majority answer of every case per prompt ("<prompt> (moda)") and, with MARGIN_MIN_RUNS runs
+            or more, its vote margin ("<prompt> (margem)": votes of the mode minus votes of the runner-up). Colour spellings
+            are normalised and non-colour answers ("Failed JSON", "Timeout") are not votes; ties
+            are broken by `tie_break` (see aggregation.majority_vote).
+        Returns:
+            tuple: (DataFrame with ID and the mode/margin columns of every prompt,
+                    list with one DataFrame per prompt: ID, the answers of each run, mode and margin)
+        """
 
-        for prompt, cases in self.responses.items():
-            
-            data = []
-            columns = [f'{prompt} ({i+1}x)' for i in range(self.validation)]
-            
-            for case, validations in cases.items():
-                #print(case, type(validations))
-                current_case_data = []
-                for test in validations:
-                    current_case_data.append(test["answer"])
-                    #print(current_case_data)
-                data.append(current_case_data)
-            dfs.append(pd.DataFrame(data=data, columns=columns))
-        return pd.concat(dfs, ignore_index=False, axis=1)
-
-    def get_case_responses(self, correct_answers: pd.DataFrame = None):
-        results = self.build_responses_df()
-        ids = results['ID']
-        results.drop(columns=['ID'], inplace=True)
+        ids, prompt_results = self._cached(f"case_responses:{tie_break}", lambda: self._build_case_responses(tie_break))
+        ids = ids.copy()
+
+        if correct_answers is not None:
+            prompt_results = [pd.merge(results_mode, correct_answers, on="ID", how="left") for results_mode in prompt_results]
+        else:
+            prompt_results = [results_mode.copy() for results_mode in prompt_results]
+        return ids, prompt_results
+
+    def _build_case_responses(self, tie_break: str):
+        results = self._cached("responses_df", self._build_responses_df)
+        mode, vote = aggregate_answers(self.store.answers(), tie_break)
+        ids = results[['ID']].copy()
         prompt_results =[]
 
         for i in range(self.prompts_used):
-            prompt_answers = results.iloc[:, i*self.validation:i*self.validation+self.validation]
+            prompt_answers = results.iloc[:, 1+i*self.validation:1+i*self.validation+self.validation].copy()
             prompt_name = prompt_answers.columns[0][:-4]
-            #prompt_answers[f"{prompt_name}(moda)"] = prompt_answers.mode(axis=1)[0]
-            prompt_answers.loc[:, f"{prompt_name}(moda)"] = prompt_answers.mode(axis=1)[0]
-            ids = pd.concat([ids, prompt_answers[f"{prompt_name}(moda)"]], axis=1)
-            results_mode= pd.concat([ids["ID"], prompt_answers], axis=1)
-
-            if correct_answers is not None:
-                results_mode = pd.merge(results_mode, correct_answers, on="ID", how="left")
-
-            prompt_results.append(results_mode)
+            prompt_answers[f"{prompt_name}(moda)"] = mode[i]
+            ids[f"{prompt_name}(moda)"] = mode[i]
+            if self.validation >= MARGIN_MIN_RUNS:
+                prompt_answers[f"{prompt_name}(margem)"] = vote.margin[i]
+                ids[f"{prompt_name}(margem)"] = vote.margin[i]
+            prompt_results.append(pd.concat([ids["ID"], prompt_answers], axis=1))
         return ids, prompt_results
     
-    def get_cases_responses_with_mode(self):
+    def get_cases_responses_with_mode(self, tie_break: str = "alphabetical"):
+
+        def build():
+            a = self._cached("responses_df", self._build_responses_df)
+            b, _ = self._cached(f"case_responses:{tie_break}", lambda: self._build_case_responses(tie_break))
+            return pd.concat([a.iloc[:, 0], b.iloc[:, 1:], a.iloc[:, 1:]], axis=1)
 
-        a = self.build_responses_df()
-        b, c = self.get_case_responses()
-        return pd.concat([a.iloc[:, 0], b.iloc[:, 1:], a.iloc[:, 1:]], axis=1)
+        return self._cached(f"responses_with_mode:{tie_break}", build).copy()
     
     def get_an_explanation(self, prompt, case_id, answer):
-        for resp in self.responses[prompt][case_id]:
-            if resp['answer'] == answer:
-                return resp['explanation']
\ No newline at end of file
+        for run in range(self.validation):
+            resp = self.store.get(prompt, case_id, run)
+            if resp is not None and resp['answer'] == answer:
+                return resp['explanation']
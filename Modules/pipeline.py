@@ -0,0 +1,106 @@
+import pandas as pd
+
+from Modules.table_processing import process_csv_table
+from Modules.prompt_creation import merge_information, add_document_references, add_answering_rules
+from Modules.result_store import resultSink, model_answers_from_records, iter_records
+from Modules.profiling import span
+
+def iter_case_chunks(data_path: str, chunksize: int):
+    """
+        Reads the test cases CSV in chunks.
+    Yields:
+        tuple: (information, correct_answers) of each chunk, as returned by process_csv_table.
+    """
+
+    for chunk in pd.read_csv(data_path, chunksize=chunksize):
+        with span("process_csv_table", rows=len(chunk)):
+            processed = process_csv_table(chunk)
+        yield processed
+
+def iter_prompt_chunks(case_chunks, prompts: pd.DataFrame, rag_agent_instance=None, prompts_path: str = None):
+    """
+        Builds the final prompts of each chunk of cases lazily: merge_information, the optional
+        protocol references and the answering rules.
+    Args:
+        case_chunks (iterable): (information, correct_answers) pairs, e.g. from iter_case_chunks.
+        prompts (pd.DataFrame): Prompt templates.
+        rag_agent_instance (rag_agent, optional): Agent used to add protocol references.
+        prompts_path (str, optional): CSV the final prompts are appended to, chunk by chunk.
+    Yields:
+        tuple: (final prompts, correct_answers) of each chunk.
+    """
+
+    first = True
+    for info, correct_answers in case_chunks:
+        with span("merge_information", rows=len(info)):
+            test_cases_prompts, patient_info = merge_information(prompts, info)
+
+        if rag_agent_instance is not None:
+            with span("add_document_references", rows=len(info)):
+                test_cases_prompts = add_document_references(test_cases_prompts, rag_agent_instance, patient_info)
+
+        with span("add_answering_rules"):
+            test_cases_prompts = add_answering_rules(test_cases_prompts)
+
+        if prompts_path:
+            with span("write_prompts_csv"):
+                test_cases_prompts.to_csv(prompts_path, mode="w" if first else "a", header=first, index=False)
+        first = False
+
+        yield test_cases_prompts, correct_answers
+
+def run_streaming(prompt_chunks, models: list[str], path_to_save: str, validation: int = 1, resume: bool = False, **query_kwargs):
+    """
+        Queries the models chunk by chunk and streams every answer to a resultSink, so only one
+        chunk of prompts and answers is held in memory while querying.
+
+        When all chunks are done the wide full_responses.csv of each model is exported, and
+        modelAnswer objects holding only the answers are rebuilt for the reports (explanations are
+        read back from the sink only if they are needed).
+    Args:
+        prompt_chunks (iterable): (final prompts, correct_answers) pairs, e.g. from iter_prompt_chunks.
+        models (list[str]): Models to query.
+        path_to_save (str): Run directory of the result sink.
+        validation (int): Number of runs per case.
+        resume (bool): Skip the answers already stored in the run directory.
+        **query_kwargs: Forwarded to query_models (verbose, concurrency, cache, ...).
+    Returns:
+        tuple: (list[modelAnswer], correct_answers DataFrame with ID and Classificacao_Correta)
+    """
+
+    from Modules.querie_exec import query_models
+
+    sink = resultSink(path_to_save, append=resume)
+
+    # Modelos terminados num chunk voltam no próximo: só são descarregados depois do último
+    scheduler = query_kwargs.get("scheduler")
+    if scheduler:
+        scheduler.defer_unloads = True
+
+    prompt_cols = None
+    case_ids = []
+    correct = []
+
+    try:
+        for test_cases_prompts, correct_answers in prompt_chunks:
+            prompt_cols = [col for col in test_cases_prompts.columns if col != 'ID']
+            case_ids.extend(test_cases_prompts["ID"].tolist())
+            correct.append(correct_answers[["ID", "Classificacao_Correta"]])
+
+            # As respostas do chunk ficam no sink; os objetos retornados são descartados
+            with span("query_models", rows=len(test_cases_prompts)):
+                query_models(test_cases_prompts, validation=validation, model=models, resume=resume, sink=sink, **query_kwargs)
+    finally:
+        if scheduler:
+            scheduler.unload_deferred()
+
+        # O JSONL é lido em streaming uma vez por modelo; só a tabela do modelo fica em memória
+        with span("export_full_responses"):
+            if prompt_cols is not None:
+                for m in models:
+                    sink.export_full_responses(m, prompt_cols, case_ids, validation)
+        sink.close()
+
+    model_results = model_answers_from_records(iter_records(sink.file_path), models, prompt_cols or [], case_ids, validation,
+                                               include_explanations=False, explanations_from=sink.file_path)
+    return model_results, pd.concat(correct, ignore_index=True) if correct else pd.DataFrame(columns=["ID", "Classificacao_Correta"])
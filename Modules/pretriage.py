@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+from typing import NamedTuple
+
+from Modules.aggregation import MTS_LABELS, encode_answers, normalize_label
+
+class discriminatorRule(NamedTuple):
+    name: str
+    category: str
+    conditions: tuple       # ((column, operator, value), ...); all of them must hold
+
+# Discriminadores gerais do MTS que dependem só dos sinais vitais estruturados
+DEFAULT_RULES = (
+    discriminatorRule("Não responsivo (Glasgow ≤ 8)", "Vermelho", (("Escala de Glasgow", "<=", 8),)),
+    discriminatorRule("Respiração inadequada (FR ≤ 8 ipm)", "Vermelho", (("Frequência Respiratória (ipm)", "<=", 8),)),
+    discriminatorRule("Choque (PAS < 90 mmHg e FC > 100 bpm)", "Vermelho", (("Pressão Sistólica (mmHg)", "<", 90), ("Frequência Cardíaca (bpm)", ">", 100))),
+    discriminatorRule("SaO2 muito baixa (< 90%)", "Laranja", (("Oximetria (%)", "<", 90),)),
+    discriminatorRule("Hipoglicemia (glicemia < 55 mg/dL)", "Laranja", (("Glicemia Capilar (mg/dL)", "<", 55),)),
+    discriminatorRule("Muito quente (≥ 41 °C)", "Laranja", (("Temperatura (°C)", ">=", 41),)),
+    discriminatorRule("Hipotermia (< 35 °C)", "Laranja", (("Temperatura (°C)", "<", 35),)),
+)
+
+OPERATORS = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal, "==": np.equal}
+
+def apply_rules(cases: pd.DataFrame, rules: tuple = DEFAULT_RULES, accept: tuple = ("Vermelho",)) -> pd.DataFrame:
+    """
+        Evaluates the discriminator rules over the whole case table at once and flags the cases
+        whose category is fixed by them.
+
+        Each rule is a conjunction of comparisons on vital-sign columns; values that are missing or
+        not numeric never trigger a rule, and rules on absent columns are ignored. A case gets the
+        most urgent category among the rules it triggers. Rules only see the vital signs, so a
+        category below Vermelho is only a lower bound (the complaint can still make the case
+        Vermelho): by default only Vermelho is taken as fixed, and Laranja is opt-in through `accept`.
+    Args:
+        cases (pd.DataFrame): Case table (e.g. the information returned by process_csv_table), with ID.
+        rules (tuple): discriminatorRule entries.
+        accept (tuple): Categories that are taken as fixed.
+    Returns:
+        pd.DataFrame: ID, rule_answer (None when the case is not flagged) and rule_reason (the triggered
+            discriminators of that category).
+    """
+
+    usable = [rule for rule in rules if all(column in cases.columns for column, _, _ in rule.conditions)]
+    hits = np.zeros((len(cases), len(usable)), dtype=bool)
+    values = {}
+    for r, rule in enumerate(usable):
+        hit = np.ones(len(cases), dtype=bool)
+        for column, operator, value in rule.conditions:
+            if column not in values:
+                values[column] = pd.to_numeric(cases[column], errors="coerce").to_numpy(dtype=float)
+            with np.errstate(invalid="ignore"):
+                hit &= OPERATORS[operator](values[column], value)
+        hits[:, r] = hit
+
+    # Categoria mais urgente entre as regras disparadas (índice em MTS_LABELS; menor = mais urgente)
+    rank = np.array([MTS_LABELS.index(normalize_label(rule.category)) for rule in usable], dtype=int)
+    worst = len(MTS_LABELS)
+    best = np.where(hits, rank, worst).min(axis=1) if usable else np.full(len(cases), worst)
+    accepted = np.isin(best, [MTS_LABELS.index(normalize_label(c)) for c in accept])
+
+    # Reasons are built once per distinct pattern of triggered rules of the winning category
+    winning = hits & (rank == best[:, None])
+    patterns, inverse = np.unique(winning, axis=0, return_inverse=True)
+    reasons = np.array(["; ".join(rule.name for rule, hit in zip(usable, pattern) if hit) for pattern in patterns] or [""], dtype=object)
+    reasons = reasons[inverse.ravel()] if len(cases) else reasons[:0]
+
+    labels = np.array(MTS_LABELS + (None,), dtype=object)
+    return pd.DataFrame({"ID": cases["ID"].to_numpy(),
+                         "rule_answer": np.where(accepted, labels[best], None),
+                         "rule_reason": np.where(accepted, reasons, None)})
+
+def pretriage_report(rules: pd.DataFrame, correct_answers: pd.DataFrame, models: list[str], n_prompts: int, validation: int,
+                     route_model: str = None) -> pd.DataFrame:
+    """
+        Coverage and accuracy of the rule path, and LLM calls it saved, per rule category and in total.
+
+        Without a route model the flagged cases cost no call. With one, each flagged run is sent
+        once to it instead of to every evaluated model; when the route model is not one of the
+        evaluated models those calls are extra, and are subtracted from the calls saved.
+    Args:
+        rules (pd.DataFrame): Output of apply_rules.
+        correct_answers (pd.DataFrame): ID and Classificacao_Correta.
+        models (list[str]): Models evaluated.
+        n_prompts (int): Prompts per case.
+        validation (int): Runs per prompt.
+        route_model (str, optional): Model answering the flagged cases ("route" mode); None when the
+            rules answer them ("skip" mode).
+    Returns:
+        pd.DataFrame: One row per category plus "Total".
+    """
+
+    df = rules.merge(correct_answers[["ID", "Classificacao_Correta"]], on="ID", how="left")
+    flagged = df[df["rule_answer"].notna()]
+    runs = n_prompts * validation
+    # Chamadas por caso sinalizado: evitadas nos modelos avaliados e feitas ao modelo de triagem
+    routed_here = route_model is not None and route_model in models
+    avoided = runs * (len(models) - routed_here)
+    added = runs if route_model is not None and not routed_here else 0
+
+    def summarise(group: pd.DataFrame, category: str) -> dict:
+        answer, true = encode_answers(group["rule_answer"]), encode_answers(group["Classificacao_Correta"])
+        known = true >= 0
+        return {"Categoria": category,
+                "Casos sinalizados": len(group),
+                "Cobertura": len(group) / len(df) if len(df) else np.nan,
+                "Acurácia da regra": (answer == true)[known].mean() if known.any() else np.nan,
+                # Código maior = cor menos urgente
+                "Under-triage da regra": (answer > true)[known].mean() if known.any() else np.nan,
+                "Chamadas evitadas (modelos avaliados)": len(group) * avoided,
+                "Chamadas ao modelo de triagem": len(group) * added,
+                "Chamadas LLM evitadas": len(group) * (avoided - added)}
+
+    rows = [summarise(group, category) for category, group in flagged.groupby("rule_answer", sort=False)]
+    rows.append(summarise(flagged, "Total"))
+    return pd.DataFrame(rows)
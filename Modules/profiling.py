@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+import pandas as pd
+
+class stageProfiler:
+    """
+        Collects timed spans of the pipeline stages, optionally with cProfile and tracemalloc.
+
+        Spans are recorded from any thread and exported as a Chrome trace (chrome://tracing or
+        https://ui.perfetto.dev) and as a per-stage summary. cProfile only sees the thread that
+        enabled it (the main thread); requests running on worker threads show up as spans.
+    """
+
+    def __init__(self, cprofile: bool = False, memory: bool = False):
+        self.events = []
+        self.pid = os.getpid()
+        self.start = time.perf_counter()
+        self.memory = memory
+        self.cprofile = None
+        self._lock = threading.Lock()
+        self._threads = {}
+        self._stopped = False
+
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        if memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    def span(self, name: str, **args):
+        return _span(self, name, args)
+
+    def record(self, name: str, start: float, end: float, args: dict):
+        thread = threading.current_thread()
+        event = {"name": name, "ph": "X", "pid": self.pid, "tid": thread.ident,
+                 "ts": (start - self.start) * 1e6, "dur": (end - start) * 1e6}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            self.events.append(event)
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.memory:
+            import tracemalloc
+            self._snapshot = tracemalloc.take_snapshot()
+            self._peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    def summary(self) -> pd.DataFrame:
+        """
+            Per stage: number of spans, total, mean, p95 and max duration in seconds, and the share
+            of the profiled wall time (spans of parallel requests can add up to more than 100%).
+        """
+
+        with self._lock:
+            df = pd.DataFrame([{"Stage": e["name"], "dur": e["dur"] / 1e6, "mem": e.get("args", {}).get("mem_delta_mb")} for e in self.events],
+                              columns=["Stage", "dur", "mem"])
+        wall = time.perf_counter() - self.start
+
+        rows = []
+        for stage, group in df.groupby("Stage", sort=False):
+            durations = group["dur"].to_numpy()
+            row = {"Stage": stage, "calls": len(durations), "total_s": durations.sum(), "mean_s": durations.mean(),
+                   "p95_s": np.percentile(durations, 95), "max_s": durations.max(), "share": durations.sum() / wall}
+            if self.memory:
+                row["mem_delta_mb"] = group["mem"].sum()
+            rows.append(row)
+        return pd.DataFrame(rows).sort_values("total_s", ascending=False, ignore_index=True) if rows else pd.DataFrame(columns=["Stage"])
+
+    def write(self, path: str) -> dict:
+        """
+            Stops the profiler and writes profile_trace.json, profile_summary.csv and, when enabled,
+            profile.pstats/profile_functions.txt (cProfile) and profile_memory.txt (tracemalloc).
+        Returns:
+            dict: Written files by kind.
+        """
+
+        self.stop()
+        os.makedirs(path, exist_ok=True)
+        files = {"trace": os.path.join(path, "profile_trace.json"), "summary": os.path.join(path, "profile_summary.csv")}
+
+        with self._lock:
+            metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}} for tid, name in self._threads.items()]
+            trace = {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+        with open(files["trace"], "w", encoding="utf-8") as f:
+            json.dump(trace, f, default=str)
+        self.summary().to_csv(files["summary"], index=False)
+
+        if self.cprofile is not None:
+            import io
+            import pstats
+            files["pstats"] = os.path.join(path, "profile.pstats")
+            files["functions"] = os.path.join(path, "profile_functions.txt")
+            self.cprofile.dump_stats(files["pstats"])
+            text = io.StringIO()
+            pstats.Stats(self.cprofile, stream=text).sort_stats("cumulative").print_stats(40)
+            with open(files["functions"], "w", encoding="utf-8") as f:
+                f.write(text.getvalue())
+
+        if self.memory:
+            files["memory"] = os.path.join(path, "profile_memory.txt")
+            with open(files["memory"], "w", encoding="utf-8") as f:
+                f.write(f"Peak traced memory: {self._peak / 2**20:.1f} MB\n\n")
+                for stat in self._snapshot.statistics("lineno")[:30]:
+                    f.write(f"{stat}\n")
+        return files
+
+class _span:
+    __slots__ = ("profiler", "name", "args", "start", "mem")
+
+    def __init__(self, profiler: stageProfiler, name: str, args: dict):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        if self.profiler.memory and not self.profiler._stopped:
+            import tracemalloc
+            self.mem = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        if self.profiler.memory and not self.profiler._stopped:
+            import tracemalloc
+            self.args["mem_delta_mb"] = (tracemalloc.get_traced_memory()[0] - self.mem) / 2**20
+        self.profiler.record(self.name, self.start, end, self.args)
+        return False
+
+class _nullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _nullSpan()
+_profiler = None
+
+def span(name: str, **args):
+    """
+        Times a block as a stage of the profile: `with span("merge_information"): ...`.
+        Without an active profiler it returns a shared no-op context manager.
+    """
+
+    if _profiler is None:
+        return _NULL_SPAN
+    return _span(_profiler, name, args)
+
+def enable(cprofile: bool = False, memory: bool = False) -> stageProfiler:
+    global _profiler
+    _profiler = stageProfiler(cprofile=cprofile, memory=memory)
+    return _profiler
+
+def disable() -> stageProfiler:
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+def active() -> stageProfiler:
+    return _profiler
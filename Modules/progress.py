@@ -0,0 +1,152 @@
+import sys
+import json
+import time
+from collections import deque
+
+class progressReporter:
+    """
+        Progress display and structured event stream of a querying run.
+
+        Only the most recent messages are kept (ring buffer) and the terminal is redrawn at most
+        `max_rate` times per second, with ANSI escape codes instead of spawning `clear`. The
+        display shows completed/total queries, the throughput over the last `window` completions
+        and the ETA. When the number of queries is known up front (set_total, e.g. cases x prompts x
+        runs x models of a chunked run) it is shown from the start, and the queries that turn out
+        not to be needed (stored answers, pre-triage) are taken off it. Every event is also written
+        as one JSON line to `event_log` (when given) and handed to the `listeners`, so runs can be
+        followed from a file or by the benchmark suite.
+    """
+
+    def __init__(self, render: bool = True, max_messages: int = 20, max_rate: float = 10.0, event_log: str = None,
+                 listeners: list = None, window: int = 50, stream=None):
+        self.render_enabled = render
+        self.messages = deque(maxlen=max_messages)
+        self.min_interval = 1 / max_rate if max_rate else 0.0
+        self.listeners = list(listeners or [])
+        self.stream = stream or sys.stdout
+        self.total = 0
+        self.total_known = False
+        self.done = 0
+        self.start = time.perf_counter()
+        self._completions = deque(maxlen=window)
+        self._last_render = 0.0
+        self._last_flush = 0.0
+        self._log = open(event_log, "a", encoding="utf-8") if event_log else None
+        self._tty = hasattr(self.stream, "isatty") and self.stream.isatty()
+        if not self._tty:
+            # Logs and pipes get a status line at most once per second
+            self.min_interval = max(self.min_interval, 1.0)
+
+    def event(self, kind: str, **fields):
+        """
+            Emits a structured event ({"t": seconds since start, "event": kind, **fields}).
+        """
+
+        if self._log is None and not self.listeners:
+            return
+        now = time.perf_counter()
+        record = {"t": round(now - self.start, 6), "event": kind, **fields}
+        if self._log is not None:
+            self._log.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            if kind == "done" or now - self._last_flush > 1.0:
+                self.flush()
+        for listener in self.listeners:
+            listener(record)
+
+    def message(self, text: str):
+        self.messages.append(str(text))
+        self.event("message", text=str(text))
+
+    def flush(self):
+        if self._log is not None:
+            self._log.flush()
+            self._last_flush = time.perf_counter()
+
+    def set_total(self, total: int):
+        """
+            Sets the total number of queries of the run, when it is known before querying.
+        """
+
+        self.total, self.total_known = total, True
+        self.event("total", total=self.total)
+        self.render()
+
+    def add_total(self, n: int, planned: int = None):
+        """
+            Adds queries to the expected total (query_models calls it once per call, e.g. per
+            chunk). When the total was given up front, the `planned` queries of the call are
+            already counted in it, and only the ones that will not be sent (planned - n) are
+            taken off.
+        """
+
+        if self.total_known and planned is not None:
+            self.total -= planned - n
+        elif not self.total_known:
+            self.total += n
+        self.event("total", total=self.total)
+        self.render()
+
+    def advance(self, n: int = 1, **fields):
+        """
+            Marks queries as completed. Extra fields are stored in the "progress" event.
+        """
+
+        self.done += n
+        now = time.perf_counter()
+        self._completions.append((now, self.done))
+        self.event("progress", done=self.done, total=self.total, **fields)
+        self.render()
+
+    def throughput(self) -> float:
+        """
+            Completed queries per second over the recent completions (the whole run until there
+            are two).
+        """
+
+        if len(self._completions) >= 2:
+            (t0, d0), (t1, d1) = self._completions[0], self._completions[-1]
+            if t1 > t0:
+                return (d1 - d0) / (t1 - t0)
+        elapsed = time.perf_counter() - self.start
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def eta(self) -> float:
+        rate = self.throughput()
+        return max(self.total - self.done, 0) / rate if rate > 0 else float("nan")
+
+    def render(self, force: bool = False):
+        if not self.render_enabled:
+            return
+        now = time.perf_counter()
+        if not force and now - self._last_render < self.min_interval:
+            return
+        self._last_render = now
+
+        lines = [self.status_line()] + list(self.messages)
+        # Cursor to the top-left and clear the screen, then redraw; on pipes only the status line is printed
+        prefix = "\033[H\033[J" if self._tty else ""
+        self.stream.write(prefix + "\n".join(lines if self._tty else lines[:1]) + "\n")
+        self.stream.flush()
+
+    def status_line(self, width: int = 30) -> str:
+        fraction = min(self.done / self.total, 1.0) if self.total else 0.0
+        filled = int(fraction * width)
+        eta = self.eta()
+        return (f"Processing: {fraction:4.0%} |{'█' * filled}{' ' * (width - filled)}| {self.done}/{self.total} "
+                f"[elapsed {format_seconds(time.perf_counter() - self.start)}, {self.throughput():.2f} q/s, "
+                f"ETA {format_seconds(eta)}]")
+
+    def close(self, **summary):
+        self.render(force=True)
+        self.event("done", done=self.done, total=self.total, elapsed=time.perf_counter() - self.start, **summary)
+        if self._log is not None:
+            self.flush()
+            self._log.close()
+            self._log = None
+
+def format_seconds(seconds: float) -> str:
+    if seconds != seconds:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
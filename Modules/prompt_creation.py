@@ -1,27 +1,63 @@
 import pandas as pd
 
+def build_patient_info(test_cases_df: pd.DataFrame) -> pd.Series:
+    """
+        Builds the "<column>: <value>" block of every case, skipping missing values.
+
+        The text is assembled column by column over the whole table. Values are taken from
+        DataFrame.to_numpy(), the same array DataFrame.iterrows() reads rows from, so the
+        formatting is identical to formatting each row separately.
+        Args:
+            test_cases_df (pd.DataFrame): Case information without the ID column.
+        Returns:
+            pd.Series: One text block per case.
+    """
+
+    values = test_cases_df.to_numpy()
+    patient_info = pd.Series([""] * len(test_cases_df), dtype=object)
+
+    for j, col in enumerate(test_cases_df.columns):
+        column = values[:, j]
+        if column.dtype.kind == "f":
+            # iterrows formats float32 cells through Python floats (0.10000000149011612), astype(str) would not (0.1)
+            column = column.astype("float64")
+        text = f"{col}: " + pd.Series(column.astype(str), dtype=object) + "\n"
+        patient_info = patient_info + text.where(pd.notna(column).tolist(), "")
+
+    return patient_info
+
 def merge_information(prompts: pd.DataFrame, 
                       test_cases_df: pd.DataFrame,
                       prompts_to_use: list[int] = None
                       ) -> pd.DataFrame:
 
-    case_ids = test_cases_df["ID"]
+    case_ids = test_cases_df["ID"].reset_index(drop=True)
     test_cases_df = test_cases_df.drop(columns=["ID"])
 
-    patient_info = ("".join([f"{col}: {row[col]}\n" for col in test_cases_df.columns if pd.notna(row[col])]) for _, row in test_cases_df.iterrows())
-    patient_info = pd.Series(patient_info)
+    patient_info = build_patient_info(test_cases_df)
 
-    result_df = pd.DataFrame()
+    result_df = pd.DataFrame(index=patient_info.index)
     for _, prompt_row in prompts.iterrows():
         prompt_text = prompt_row["prompt_text"]
         prompt_col = f"prompt_{prompt_row['id']}"
 
-        result_df[prompt_col] = [
-            f"{prompt_text} \n" +
-            "".join(patient_info[row]) for row in range(len(patient_info))] 
+        result_df[prompt_col] = f"{prompt_text} \n" + patient_info
         
     return pd.concat([case_ids, result_df], axis=1), patient_info
 
+def merge_information_chunks(prompts: pd.DataFrame, 
+                             test_cases_df: pd.DataFrame,
+                             chunksize: int = 10000):
+    """
+        Generator version of merge_information that yields the prompts in chunks of cases,
+        so only one chunk of prompt text is held in memory at a time.
+        Yields:
+            tuple: (prompts DataFrame, patient_info Series) of each chunk, both indexed from 0.
+    """
+
+    for start in range(0, len(test_cases_df), chunksize):
+        yield merge_information(prompts, test_cases_df.iloc[start:start + chunksize].reset_index(drop=True))
+
 def add_answering_rules(prompts: pd.DataFrame):
     """
         Adds answering rules to each prompt in the DataFrame.
@@ -46,8 +82,26 @@ Responda no formato json, com as chaves "resposta" e "explicacao"."""
     return prompts
 
 def add_document_references(prompts: pd.DataFrame, rag_agent_instance, patient_info: pd.Series):
-    
+    """
+        Appends the protocol chunks retrieved for each patient to every prompt column.
+
+        Each distinct patient text is embedded once, all of them in a single batch, and the
+        retrieved chunks are shared by every prompt column of that case.
+        Args:
+            prompts (pd.DataFrame): DataFrame containing prompts.
+            rag_agent_instance (rag_agent): Agent holding the protocol index.
+            patient_info (pd.Series): Patient information of each case, aligned with the prompts rows.
+        Returns:
+            pd.DataFrame: DataFrame with the protocol references added to the prompts.
+    """
+
+    queries = patient_info.str.replace("\n", " ", regex=False)
+    unique_queries = queries.unique()
+
+    documents = rag_agent_instance.retrieve_docs_batch(unique_queries, 2)
+    references = dict(zip(unique_queries, (rag_agent_instance.references_text(d) for d in documents)))
+    references = queries.map(references).values
+
     for col in prompts.columns[1:]:
-        for i in range(len(prompts)):
-            prompts.at[i, col] = rag_agent_instance.improve_query(prompts.at[i, col], patient_info[i])
-    return prompts
\ No newline at end of file
+        prompts[col] = prompts[col] + references
+    return prompts
@@ -1,9 +1,24 @@
 import os
+import httpx
 import ollama
 import pandas as pd
 import json
-from Modules.model_answer import modelAnswer
+from Modules.model_answer import modelAnswer, answerStore
+from Modules.aggregation import normalize_label
+from Modules.result_store import resultSink, stored_answer, _to_builtin
+from Modules.response_cache import responseCache
+from Modules.scheduler import modelScheduler
+from Modules.endpoints import endpointPool, noHostAvailable
+from Modules.progress import progressReporter
+from Modules.profiling import span
 import re
+import math
+import time
+import bisect
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import NamedTuple
 
 def get_ollama_models():
     models = []
@@ -12,146 +27,762 @@ def get_ollama_models():
             models.append(model.model)
     return models
 
+def get_model_digests() -> dict:
+    """
+        Returns the digest of every local model, used to tell apart different weights published under the same name.
+    """
+    return {model.model: model.digest for model in ollama.list().models}
+
+class answerExtractor:
+    """
+        Incremental extractor of the answer object from a (possibly streamed) response.
+
+        Text is fed as it arrives. Braces are matched outside JSON strings, so the first complete
+        top-level object holding a "resposta" key is found as soon as its closing brace arrives,
+        whatever surrounds it (code fences, chain-of-thought preambles, trailing text).
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.answer = None
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> bool:
+        """
+            Adds a piece of the response.
+        Returns:
+            bool: True once the answer object is complete (it is then in self.answer).
+        """
+
+        self.text += chunk
+        text = self.text
+        while self.answer is None and self._pos < len(text):
+            c = text[self._pos]
+            self._pos += 1
+
+            if self._start is None:
+                if c == "{":
+                    self._start, self._depth = self._pos - 1, 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c == "{":
+                self._depth += 1
+            elif c == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._close_object(text[self._start:self._pos])
+
+        return self.answer is not None
+
+    def _close_object(self, candidate: str):
+        try:
+            obj = json.loads(candidate)
+        except json.JSONDecodeError:
+            obj = None
+
+        if isinstance(obj, dict) and "resposta" in obj:
+            self.answer = candidate
+        else:
+            # Not the answer (e.g. braces in the reasoning): resume right after its opening brace
+            self._pos = self._start + 1
+        self._start = None
+        self._in_string = self._escape = False
+
 def fix_response(response: str) -> str:
 
     """
-        Attempts to fix common JSON formatting issues and other inconsistencies in the response string.
+        Extracts the answer JSON object from the response string, ignoring code fences and any text around it.
     Args:
         response (str): The raw response string from the model.
     Returns:
-        str: The corrected response string.
+        str: The answer object, or the stripped response when none is found.
     """
 
-    # Remove Markdown code blocks
-    text = response.strip()
+    extractor = answerExtractor()
+    extractor.feed(response)
+    return extractor.answer if extractor.answer is not None else response.strip()
 
-    match = re.search(r"```(?:json)?\s*(.*?)\s*```", text, re.DOTALL)
-    if match:
-        text = match.group(1).strip()
+class queryJob(NamedTuple):
+    model: str
+    prompt: str
+    case_id: object
+    run: int
+    text: str
+    attempt: int = 0
 
-    return text
+# JSON schema of the answer, used for schema-constrained decoding (format=) in structured mode
+ANSWER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "resposta": {"type": "string", "enum": ["Vermelho", "Laranja", "Amarelo", "Verde", "Azul"]},
+        "explicacao": {"type": "string"},
+    },
+    "required": ["resposta", "explicacao"],
+}
 
-def query_models(prompts: pd.DataFrame, 
-                 validation: int = 1, 
-                 model = None, 
-                 verbose: int = 0,
-                 path_to_save: str = None,
-                 ) -> list[modelAnswer]:
+# Timing/token fields Ollama returns with every completed request
+OLLAMA_METRICS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration")
 
-    if model is None or model == ["Todos"]:
-        models = get_ollama_models()
-    else:
-        models = model
+# Stored with each answer: Ollama's fields plus the wall-clock latency seen by the client, in seconds.
+# Streamed requests also record the time to the first token and to the complete answer object,
+# and whether the generation was cancelled right after the answer (Ollama's fields are then missing).
+TELEMETRY_FIELDS = OLLAMA_METRICS + ("wall_time", "ttft", "time_to_answer", "stopped_early", "hedged")
 
-    total_queries = len(models) * (prompts.shape[1] - 1) * prompts.shape[0] * validation
-    current_query = 0
-    messages = []
+# Flags of the last attempt; the other fields are added up over the JSON retries of a run
+FLAG_FIELDS = ("stopped_early", "hedged")
 
-    def update_progress_bar():
-        nonlocal current_query
-        current_query += 1
+# Stored records that are not an answer; --resume queries them again
+RETRY_STATUSES = ("timeout", "cancelled", "unavailable")
 
-        if hasattr(query_models, "progress_callback") and callable(query_models.progress_callback):
-            query_models.progress_callback(current_query, total_queries, messages)
-
-    update_progress_bar()
-    responses = []
+def is_answered(record: dict) -> bool:
+    return record.get("status") not in RETRY_STATUSES
 
-    for m in models:
-        if path_to_save:
-            os.makedirs(f'{path_to_save}/{m}/', exist_ok=True)
-            saving_df = pd.DataFrame(columns=["ID"] + [f'{col} ({i+1}x)' for col in prompts.columns if col != 'ID' for i in range(validation)] + [f'{col} ({i+1}x) Explanation' for col in prompts.columns if col != 'ID' for i in range(validation)])
-            saving_df.to_csv(f'{path_to_save}/{m}/full_responses.csv', index=False)
+class requestTimeout(Exception):
+    """Raised when a request misses its deadline; its generation is cancelled."""
 
-        msg = f"Querying model: {m}"
-        if verbose > 0:
-            print(msg)
-        else:
-            messages.append(msg)
+class requestCancelled(Exception):
+    """Raised when a request is cancelled by the caller (e.g. the losing copy of a hedged request)."""
 
-        results = {}
-        for prompt in [col for col in prompts.columns if col != 'ID']:
+# Clients of the local Ollama with a read timeout, by timeout
+_timeout_clients = {}
 
-            msg = f"\tQuerying {prompt}"
-            if verbose > 0:
-                print(msg)
-            else:
-                messages.append(msg)
-
-            p = {prompt: {}}
-            for idx, row in prompts.iterrows():
-                current_prompt = row[prompt]
-                current_id = row["ID"]
-
-                msg = f"\t\tCase ID: {current_id}"
-                if verbose > 1:
-                    print(msg)
-                else:
-                    messages.append(msg)
+def ask_model(model: str, prompt_text: str, options: dict = None, keep_alive=None, format=None, think=None, stream: bool = False,
+              client: ollama.Client = None, timeout: float = None, cancel=None) -> dict:
+    """
+        Sends a single prompt to a model.
+    Args:
+        model (str): Name of the Ollama model.
+        prompt_text (str): Final prompt sent as the user message.
+        options (dict, optional): Generation options (temperature, seed, num_predict, ...).
+        keep_alive (optional): How long Ollama keeps the model loaded after the request.
+        format (optional): "json" or a JSON schema constraining the output.
+        think (bool, optional): Enables/disables the thinking output of reasoning models.
+        stream (bool): Stream the response and stop the generation as soon as the answer object is complete.
+        client (ollama.Client, optional): Host to send the request to. Defaults to the local Ollama.
+        timeout (float, optional): Deadline of the request, in seconds.
+        cancel (threading.Event, optional): Cancels the request when set.
+    Returns:
+        dict: "content" with the response text after fix_response, the OLLAMA_METRICS fields and "wall_time"
+        (plus "ttft", "time_to_answer" and "stopped_early" when streaming).
+    Raises:
+        requestTimeout: The deadline passed. requestCancelled: cancel was set.
+    """
 
-                case_answers = []
-                for i in range(validation):
+    if client is None and timeout is not None:
+        if timeout not in _timeout_clients:
+            _timeout_clients[timeout] = ollama.Client(timeout=timeout)
+        client = _timeout_clients[timeout]
+
+    # Deadlines and cancellation are checked between streamed chunks, so such requests are always
+    # streamed; closing the stream stops the generation on the server
+    streamed = stream or timeout is not None or cancel is not None
+
+    start = time.perf_counter()
+    try:
+        with span("ollama.chat", model=model, stream=streamed):
+            response = (client or ollama).chat(
+                model=model,
+                messages=[
+                    {"role": "user", "content": prompt_text}
+                ],
+                options=options,
+                keep_alive=keep_alive,
+                format=format,
+                think=think,
+                stream=streamed
+            )
+
+            if streamed:
+                return read_stream(response, start, stop_on_answer=stream,
+                                   deadline=start + timeout if timeout is not None else None, cancel=cancel)
+    except httpx.TimeoutException:
+        # Host sent nothing for `timeout` seconds
+        raise requestTimeout(f"{model} did not answer within {timeout}s")
+
+    wall_time = time.perf_counter() - start
+
+    with span("fix_response"):
+        reply = {"content": fix_response(response["message"]["content"])}
+    reply.update({field: response.get(field) for field in OLLAMA_METRICS})
+    reply["wall_time"] = wall_time
+    return reply
+
+def read_stream(chunks, start: float, stop_on_answer: bool = True, deadline: float = None, cancel=None) -> dict:
+    """
+        Reads a streamed chat response until the answer object is complete, then closes the
+        stream, which cancels the rest of the generation on the server.
+    Args:
+        chunks: Iterator of streamed ChatResponse chunks.
+        start (float): time.perf_counter() when the request was sent.
+        stop_on_answer (bool): Stop once the answer object is complete. Otherwise the whole response is read.
+        deadline (float, optional): time.perf_counter() after which the request is cancelled.
+        cancel (threading.Event, optional): Cancels the request when set.
+    Returns:
+        dict: Same as ask_model. When the generation is cancelled, eval_count is the number of
+        chunks received (one token each) and the other Ollama fields are None.
+    Raises:
+        requestTimeout: The deadline passed. requestCancelled: cancel was set.
+    """
 
-                    response = ollama.chat(
-                        model=m,
-                        messages=[
-                            {"role": "user", "content": current_prompt}
-                        ]
-                    )
+    extractor = answerExtractor()
+    reply = {field: None for field in OLLAMA_METRICS}
+    reply.update({"ttft": None, "time_to_answer": None, "stopped_early": False})
+    tokens = 0
+
+    try:
+        for chunk in chunks:
+            if cancel is not None and cancel.is_set():
+                raise requestCancelled()
+            if deadline is not None and time.perf_counter() > deadline:
+                raise requestTimeout(f"deadline passed after {tokens} chunks")
+
+            message = chunk.get("message")
+            content = (message.get("content") if message else None) or ""
+            if reply["ttft"] is None and (content or (message and message.get("thinking"))):
+                reply["ttft"] = time.perf_counter() - start
+            tokens += 1
+
+            if chunk.get("done"):
+                extractor.feed(content)
+                reply.update({field: chunk.get(field) for field in OLLAMA_METRICS})
+                break
+
+            if extractor.feed(content) and reply["time_to_answer"] is None:
+                reply["time_to_answer"] = time.perf_counter() - start
+                if stop_on_answer:
+                    reply["stopped_early"] = True
+                    reply["eval_count"] = tokens
+                    break
+    finally:
+        # Fechar o stream encerra a conexão e o Ollama interrompe a geração
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+    reply["wall_time"] = time.perf_counter() - start
+    if extractor.answer is not None and reply["time_to_answer"] is None:
+        reply["time_to_answer"] = reply["wall_time"]
+    reply["content"] = extractor.answer if extractor.answer is not None else extractor.text.strip()
+    return reply
+
+def parse_answer(response: str):
+    """
+        Parses a model response into an answer/explanation pair.
+    Args:
+        response (str): The cleaned response string.
+    Returns:
+        dict | None: {"answer", "explanation"} or None if the response is not valid JSON.
+    """
 
-                    response = response["message"]["content"]
-                    response = fix_response(response)
+    try:
+        json_response = json.loads(response)
+        return {"answer": str(json_response.get('resposta', '')),
+                "explanation": str(json_response.get('explicacao', ''))}
+    except (json.JSONDecodeError, AttributeError):
+        return None
 
-                    if verbose > 3:
-                        print("\t\tResponse:", response)
-                    update_progress_bar()
+def majority_decided(votes: list[str], max_runs: int, threshold: float = None) -> bool:
+    """
+        Tells whether more runs can still change the most voted answer of a case.
+    Args:
+        votes (list[str]): Answers received so far.
+        max_runs (int): Maximum number of runs of the case.
+        threshold (float, optional): Also stop once the leading answer has at least this fraction of max_runs.
+    Returns:
+        bool: True when the remaining runs are not needed.
+    """
 
-                    try:
+    # Spellings of a colour are one vote; answers that are not a colour do not vote (see aggregation)
+    colors = [color for color in map(normalize_label, votes) if color is not None]
+    if not colors:
+        return False
 
-                        json_response = json.loads(response)
+    counts = Counter(colors).most_common(2)
+    leader = counts[0][1]
+    second = counts[1][1] if len(counts) > 1 else 0
 
-                        result = str(json_response.get('resposta', ''))
-                        explanation = str(json_response.get('explicacao', ''))
-                        case_answers.append({"answer": result, "explanation": explanation})
+    if leader > second + (max_runs - len(votes)):
+        return True
+    return threshold is not None and leader >= threshold * max_runs
 
-                    except json.JSONDecodeError:
+def run_jobs(jobs: list[queryJob], on_done, concurrency: int = 1, model_concurrency: int = None, on_start=None, request: dict = None,
+             scheduler: modelScheduler = None, endpoints: endpointPool = None, hedge_after: float = None, hedge_min_samples: int = 5):
+    """
+        Executes query jobs, serially or on a thread pool, and hands each result to on_done in the main thread.
+
+        Jobs are dispatched in their original order, keeping at most `concurrency` requests in
+        flight overall and at most `model_concurrency` per model. on_done may return follow-up
+        jobs, which are queued ahead of the remaining jobs of their model. With a scheduler, jobs
+        are reordered by model and only one model is dispatched at a time (see modelScheduler).
+
+        With hedge_after, a request still running after that percentile of the latencies observed
+        for its model is sent again on a free slot (another host when using endpoints). The first
+        copy to answer is kept, with "hedged" set in its reply when it was the duplicate, and the
+        other copy is cancelled. A copy that fails (timeout, no host) while the other is still
+        running is dropped, so the other copy can still answer; a request is hedged at most once.
+    Args:
+        jobs (list[queryJob]): Jobs to execute.
+        on_done (callable): Called as on_done(job, reply) with the ask_model reply when a job finishes. Returns a list of new jobs or None.
+        concurrency (int): Maximum number of requests in flight.
+        model_concurrency (int, optional): Maximum number of requests in flight per model. Defaults to concurrency.
+        on_start (callable, optional): Called as on_start(job) right before a job is sent.
+        request (dict, optional): Extra ask_model arguments sent with every request (options, format, think, timeout).
+        scheduler (modelScheduler, optional): Model-aware ordering, pre-warming and keep_alive handling.
+        endpoints (endpointPool, optional): Hosts the requests are balanced across. Defaults to the local Ollama.
+        hedge_after (float, optional): Latency percentile (0-100) after which a request is hedged. Needs concurrency > 1.
+        hedge_min_samples (int): Latencies a model needs before its requests are hedged.
+    """
 
-                        msg = f"\t\t\tFailed to decode JSON"
-                        if verbose > 2:
-                            print(msg)
-                        else:
-                            messages.append(msg)
+    request = dict(request or {})
+    if scheduler:
+        request["keep_alive"] = scheduler.keep_alive
+
+    def send(job: queryJob, cancel=None) -> dict:
+        start = time.perf_counter()
+        try:
+            if endpoints is None:
+                return ask_model(job.model, job.text, cancel=cancel, **request)
+            return endpoints.call(job.model, lambda client: ask_model(job.model, job.text, client=client, cancel=cancel, **request))
+        except requestTimeout:
+            return {"content": "", "status": "timeout", "wall_time": time.perf_counter() - start}
+        except requestCancelled:
+            return {"content": "", "status": "cancelled", "wall_time": time.perf_counter() - start}
+        except noHostAvailable as e:
+            # Todos os hosts falharam: a execução fica registrada como falha, sem abortar a rodada
+            return {"content": "", "status": "unavailable", "error": str(e), "wall_time": time.perf_counter() - start}
+
+    if concurrency <= 1 and scheduler is None:
+        queue = deque(jobs)
+        while queue:
+            job = queue.popleft()
+            if on_start:
+                on_start(job)
+            queue.extendleft(reversed(on_done(job, send(job)) or []))
+        return
+
+    concurrency = max(concurrency, 1)
+    model_concurrency = min(model_concurrency or concurrency, concurrency)
+
+    if scheduler:
+        jobs = scheduler.order(jobs)
+
+    queues = {}
+    for job in jobs:
+        queues.setdefault(job.model, deque()).append(job)
+
+    running = Counter()
+    in_flight = {}    # future -> (job, cancel event, is hedge)
+    copies = {}       # job -> futures still answering it
+    started = {}      # job -> time.perf_counter() of its first copy
+    latencies = {}    # model -> sorted wall times of the answered requests
+
+    def hedge_threshold(model: str):
+        lat = latencies.get(model, [])
+        if hedge_after is None or len(lat) < hedge_min_samples:
+            return None
+        return lat[min(len(lat) - 1, int(len(lat) * hedge_after / 100))]
+
+    # One extra worker so model warm-ups/unloads never take a request slot
+    with ThreadPoolExecutor(max_workers=concurrency + (1 if scheduler else 0)) as pool:
+
+        hedged_jobs = set()
+
+        def launch(job: queryJob, hedge: bool = False):
+            # Only hedged requests can be cancelled; a cancel event makes ask_model stream the response
+            cancel = threading.Event() if hedge_after is not None else None
+            future = pool.submit(send, job, cancel)
+            in_flight[future] = (job, cancel, hedge)
+            copies.setdefault(job, []).append(future)
+            started.setdefault(job, time.perf_counter())
+            running[job.model] += 1
+            if hedge:
+                hedged_jobs.add(job)
+
+        def fill():
+            # Requests past their model's latency percentile are hedged first
+            now = time.perf_counter()
+            for job, futures in list(copies.items()):
+                if len(in_flight) >= concurrency:
+                    break
+                threshold = hedge_threshold(job.model)
+                if len(futures) == 1 and job not in hedged_jobs and threshold is not None and now - started[job] >= threshold and running[job.model] < model_concurrency:
+                    launch(job, hedge=True)
+
+            for m in (scheduler.model_order if scheduler else list(queues)):
+                queue = queues.get(m)
+                if not queue:
+                    continue
+                while queue and len(in_flight) < concurrency and running[m] < model_concurrency:
+                    job = queue.popleft()
+                    if on_start:
+                        on_start(job)
+                    launch(job)
+                if not queue:
+                    del queues[m]
+                    if scheduler:
+                        # Fila do modelo atual esvaziou: carrega o próximo enquanto este termina
+                        pool.submit(scheduler.warm, scheduler.next_model(m))
+                elif scheduler:
+                    break
+
+        def next_hedge() -> float:
+            # Seconds until the next unhedged request crosses its threshold (None: nothing to hedge)
+            now = time.perf_counter()
+            waits = [started[job] + threshold - now for job, futures in copies.items()
+                     if len(futures) == 1 and job not in hedged_jobs and (threshold := hedge_threshold(job.model)) is not None]
+            return max(min(waits), 0.01) if waits else None
+
+        while queues or in_flight:
+            fill()
+
+            if not in_flight:
+                continue
+
+            done, _ = wait(in_flight, timeout=next_hedge() if hedge_after is not None else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, _, hedge = in_flight.pop(future)
+                running[job.model] -= 1
+                reply = future.result()
+
+                if job not in copies:
+                    # Another copy of the request already answered
+                    if scheduler and running[job.model] == 0 and not queues.get(job.model):
+                        pool.submit(scheduler.unload, job.model)
+                    continue
+                if reply.get("status") is not None and len(copies[job]) > 1:
+                    # Esta cópia falhou (timeout, sem host), mas a outra ainda pode responder
+                    copies[job].remove(future)
+                    continue
+                for other in copies.pop(job):
+                    if other is not future:
+                        in_flight[other][1].set()
+                started.pop(job)
+                hedged_jobs.discard(job)
+
+                if hedge:
+                    reply["hedged"] = True
+                if reply.get("status") is None:
+                    bisect.insort(latencies.setdefault(job.model, []), reply["wall_time"])
+                if scheduler:
+                    scheduler.record(job.model, reply)
+
+                follow_up = on_done(job, reply)
+                if follow_up:
+                    queue = queues.setdefault(job.model, deque())
+                    queue.extendleft(reversed(follow_up))
+                elif scheduler and running[job.model] == 0 and not queues.get(job.model):
+                    pool.submit(scheduler.unload, job.model)
 
-                        case_answers.append({"answer": "Failed JSON", "explanation": "Failed json"})
-                    
-                    if path_to_save:   #Salvando as respostas enquanto elas são geradas                 
+def query_models(prompts: pd.DataFrame, 
+                 validation: int = 1, 
+                 model = None, 
+                 verbose: int = 0,
+                 path_to_save: str = None,
+                 concurrency: int = 1,
+                 model_concurrency: int = None,
+                 resume: bool = False,
+                 cache: responseCache = None,
+                 options: dict = None,
+                 sink: resultSink = None,
+                 adaptive: bool = False,
+                 adaptive_threshold: float = None,
+                 scheduler: modelScheduler = None,
+                 structured: bool = False,
+                 think: bool = None,
+                 json_retries: int = 0,
+                 stream: bool = False,
+                 endpoints: endpointPool = None,
+                 timeout: float = None,
+                 hedge_after: float = None,
+                 progress: progressReporter = None,
+                 pretriage: pd.DataFrame = None,
+                 route_model: str = None,
+                 ) -> list[modelAnswer]:
 
-                        if current_id in saving_df["ID"].values:
-                            # find its index
-                            idx = saving_df.index[saving_df["ID"] == current_id][0]
-                        else:
-                            # create a new row
-                            idx = len(saving_df)
-                            saving_df.loc[idx, "ID"] = current_id
+    if resume and not (path_to_save or sink):
+        raise ValueError("Resuming a run requires path_to_save.")
 
-                        saving_df.loc[idx, f'{prompt} ({i+1}x)'] = result
-                        saving_df.loc[idx, f'{prompt} ({i+1}x) Explanation'] = explanation
+    if model is None or model == ["Todos"]:
+        models = endpoints.models() if endpoints else get_ollama_models()
+    else:
+        models = model
 
-                        saving_df.to_csv(f'{path_to_save}/{m}/full_responses.csv', index=False)
-                            
+    prompt_cols = [col for col in prompts.columns if col != 'ID']
 
-                p[prompt].update({current_id: case_answers})
+    def log(msg, level):
+        if verbose > level:
+            print(msg)
+        elif progress:
+            progress.message(msg)
+
+    # Slots are allocated up front so the responses keep the prompt/case/run order whatever the completion order
+    results = {m: answerStore(prompt_cols, list(prompts["ID"]), validation) for m in models}
+
+    # Cada resposta é gravada uma única vez; o full_responses.csv é exportado no final.
+    # Um sink recebido de fora (pipeline em chunks) é exportado e fechado por quem o criou.
+    own_sink = sink is None and path_to_save is not None
+    if own_sink:
+        sink = resultSink(path_to_save, append=resume)
+
+    done = sink.stored(prompts["ID"]) if resume else {}
+
+    # Casos com a categoria fixada pelos discriminadores (apply_rules): respondidos pela regra ou
+    # enviados uma única vez ao route_model, cuja resposta vale para todos os modelos
+    flagged = {}
+    if pretriage is not None:
+        # Só os casos deste lote (no modo em chunks as regras cobrem o arquivo inteiro)
+        rules = pretriage.loc[pretriage["ID"].isin(prompts["ID"]) & pretriage["rule_answer"].notna(), ["ID", "rule_answer", "rule_reason"]]
+        flagged = {case_id: (answer, reason) for case_id, answer, reason in rules.itertuples(index=False)}
+    answered_by_rule = 0
+
+    # Estado de cada (modelo, prompt, caso): execuções ainda não enviadas, em andamento e respostas recebidas
+    groups = {}
+    for m in models:
+        for prompt in prompt_cols:
+            for _, row in prompts.iterrows():
+                rule = flagged.get(row["ID"])
+                if rule is not None and route_model is None:
+                    for i in range(validation):
+                        results[m].set(prompt, row["ID"], i, {"answer": rule[0], "explanation": rule[1], "status": "rule"})
+                        if sink and (m, prompt, _to_builtin(row["ID"]), i) not in done:
+                            sink.write(m, prompt, row["ID"], i, rule[0], rule[1], status="rule")
+                    answered_by_rule += validation
+                    continue
+
+                owner, targets = m, [m]
+                if rule is not None:
+                    if m != models[0]:
+                        continue
+                    # Um único grupo por caso sinalizado, respondido pelo route_model para todos os modelos
+                    owner, targets = route_model, models
+
+                group = {"text": row[prompt], "pending": [], "in_flight": 0, "votes": [], "targets": targets}
+                for i in range(validation):
+                    stored = [done.get((t, prompt, _to_builtin(row["ID"]), i)) for t in targets]
+                    # Timeouts and hosts unavailable are queried again; a Failed JSON is an answer of the model
+                    if any(record is None or not is_answered(record) for record in stored):
+                        group["pending"].append(i)
+                        continue
+                    for t, record in zip(targets, stored):
+                        results[t].set(prompt, row["ID"], i, stored_answer(record))
+                    if stored[0].get("status") != "skipped":
+                        group["votes"].append(stored[0]["answer"])
+                groups[(owner, prompt, row["ID"])] = group
+
+    remaining = sum(len(group["pending"]) for group in groups.values())
+    planned = len(models) * len(prompt_cols) * prompts.shape[0] * validation
+    if resume:
+        log(f"Resuming run: {planned - remaining} answers already stored, {remaining} remaining", 0)
+    if flagged and route_model is None:
+        log(f"Pre-triage: {len(flagged)} cases flagged, {answered_by_rule} answers taken from the rules", 0)
+    elif flagged:
+        routed = sum(len(group["pending"]) for group in groups.values() if len(group["targets"]) > 1)
+        log(f"Pre-triage: {len(flagged)} cases flagged, {routed} runs routed to {route_model} for all models", 0)
+
+    # With adaptive sampling the total is an upper bound; skipped runs also advance the progress
+    skipped = 0
+    if progress:
+        progress.add_total(remaining, planned)
+
+    def update_progress_bar(job: queryJob, status: str, wall_time: float = None):
+        if progress:
+            progress.advance(model=job.model, prompt=job.prompt, case=_to_builtin(job.case_id), run=job.run, status=status, wall_time=wall_time)
+
+    first_runs = validation
+    if adaptive:
+        first_runs = validation // 2 + 1
+        if adaptive_threshold is not None:
+            first_runs = min(first_runs, max(1, math.ceil(adaptive_threshold * validation)))
+
+    def next_jobs(key) -> list[queryJob]:
+        nonlocal skipped
+        group = groups[key]
+        m, prompt, case_id = key
+
+        if not adaptive:
+            runs, group["pending"] = group["pending"], []
+        elif majority_decided(group["votes"], validation, adaptive_threshold):
+            # Execuções restantes não podem mudar a moda: registradas como puladas
+            for i in group["pending"]:
+                for t in group["targets"]:
+                    results[t].set(prompt, case_id, i, {"answer": None, "explanation": None, "status": "skipped"})
+                    if sink:
+                        sink.write(t, prompt, case_id, i, None, None, status="skipped")
+                skipped += 1
+                update_progress_bar(queryJob(m, prompt, case_id, i, group["text"]), "skipped")
+            group["pending"] = []
+            return []
+        else:
+            answered = len(group["votes"])
+            target = max(first_runs, answered + 1) if group["in_flight"] == 0 else first_runs
+            n = max(0, target - answered - group["in_flight"])
+            runs, group["pending"] = group["pending"][:n], group["pending"][n:]
+
+        group["in_flight"] += len(runs)
+        return [queryJob(m, prompt, case_id, i, group["text"]) for i in runs]
+
+    last_started = [None, None, None]
+
+    def on_start(job: queryJob):
+        if job.model != last_started[0]:
+            log(f"Querying model: {job.model}", 0)
+            last_started[1] = None
+        if job.prompt != last_started[1]:
+            log(f"\tQuerying {job.prompt}", 0)
+            last_started[2] = None
+        if job.case_id != last_started[2]:
+            log(f"\t\tCase ID: {job.case_id}", 1)
+        last_started[:] = [job.model, job.prompt, job.case_id]
+
+    outcomes = Counter()
+
+    # Telemetria acumulada das tentativas anteriores de cada execução (retentativas de JSON)
+    retried = {}
+
+    def on_done(job: queryJob, reply: dict) -> list[queryJob]:
+
+        if verbose > 3:
+            print("\t\tResponse:", reply["content"])
+
+        # Cache hits carry no telemetry: the fields stay None
+        telemetry = {field: reply.get(field) for field in TELEMETRY_FIELDS}
+        previous = retried.pop(job[:4], None)
+        if previous:
+            telemetry = {field: telemetry[field] if field in FLAG_FIELDS or (telemetry[field] is None and previous[field] is None)
+                         else (telemetry[field] or 0) + (previous[field] or 0)
+                         for field in TELEMETRY_FIELDS}
+        telemetry["attempts"] = job.attempt + 1
+
+        status = reply.get("status")
+        with span("parse_answer"):
+            answer = parse_answer(reply["content"]) if status is None else None
+        if answer is None and status is None and job.attempt < json_retries:
+            log(f"\t\t\tFailed to decode JSON, retrying ({job.attempt + 1}/{json_retries})", 2)
+            if progress:
+                progress.event("retry", model=job.model, prompt=job.prompt, case=_to_builtin(job.case_id), run=job.run, attempt=job.attempt + 1)
+            retried[job[:4]] = telemetry
+            return [job._replace(attempt=job.attempt + 1)]
+
+        if status == "timeout":
+            log(f"\t\t\tTimed out after {reply['wall_time']:.1f}s", 2)
+            answer = {"answer": "Timeout", "explanation": "Timeout", "status": "timeout"}
+        elif status == "unavailable":
+            log(f"\t\t\t{reply['error']}", 0)
+            answer = {"answer": "Unavailable", "explanation": reply["error"], "status": "unavailable"}
+        elif answer is None:
+            log(f"\t\t\tFailed to decode JSON", 2)
+            answer = {"answer": "Failed JSON", "explanation": "Failed json"}
+        # The hedge flag stays in the telemetry, apart from the status (a hedged copy can still time out)
+        outcomes[answer.get("status")] += 1
+        outcomes["hedged"] += bool(telemetry["hedged"])
+        update_progress_bar(job, answer.get("status") or ("failed_json" if answer["answer"] == "Failed JSON" else "ok"), telemetry["wall_time"])
+
+        key = (job.model, job.prompt, job.case_id)
+        targets = groups[key]["targets"]
+        if len(targets) > 1 and "status" not in answer:
+            answer["status"] = "routed"
+        answer["telemetry"] = telemetry
+        for t in targets:
+            results[t].set(job.prompt, job.case_id, job.run, answer)
+
+        if sink:   #Salvando as respostas enquanto elas são geradas
+            status = {"status": answer["status"]} if "status" in answer else {}
+            with span("sink.write"):
+                for t in targets:
+                    sink.write(t, job.prompt, job.case_id, job.run, answer["answer"], answer["explanation"], **answer["telemetry"], **status)
+
+        groups[key]["in_flight"] -= 1
+        groups[key]["votes"].append(answer["answer"])
+        return next_jobs(key)
+
+    request = {"options": options}
+    if structured:
+        request["format"] = ANSWER_SCHEMA
+    if think is not None:
+        request["think"] = think
+
+    # Streaming and deadlines do not change the answer, so they are left out of the cache key
+    cache_request = dict(request)
+    if stream:
+        request["stream"] = True
+    if timeout is not None:
+        request["timeout"] = timeout
+
+    # Respostas já conhecidas vêm do cache; só os misses vão para o Ollama
+    cache_keys = {}
+    digests = (endpoints.digests() if endpoints else get_model_digests()) if cache else {}
+    hits = 0
+
+    def from_cache(new_jobs: list[queryJob]) -> list[queryJob]:
+        nonlocal hits
+        if not cache:
+            return new_jobs
+
+        to_send = []
+        queue = deque(new_jobs)
+        while queue:
+            job = queue.popleft()
+            key = cache.make_key(job.model, digests.get(job.model, ""), job.text, job.run, cache_request, job.attempt)
+            with span("cache.get"):
+                response = cache.get(key)
+            if response is None:
+                cache_keys[job] = key
+                to_send.append(job)
+            else:
+                hits += 1
+                queue.extend(on_done(job, {"content": response}))
+        return to_send
+
+    def on_response(job: queryJob, reply: dict) -> list[queryJob]:
+        if cache:
+            key = cache_keys.pop(job)
+            # Only answers that parse are cached; a malformed reply may not happen again
+            if reply.get("status") is None and parse_answer(reply["content"]) is not None:
+                with span("cache.put"):
+                    cache.put(key, job.model, reply["content"])
+        return from_cache(on_done(job, reply))
+
+    try:
+        jobs = from_cache([job for key in groups for job in next_jobs(key)])
+        if cache:
+            log(f"Response cache: {hits} hits before querying", 0)
+        run_jobs(jobs, on_response, concurrency=concurrency, model_concurrency=model_concurrency, on_start=on_start, request=request, scheduler=scheduler, endpoints=endpoints, hedge_after=hedge_after)
+    finally:
+        if own_sink:
+            with span("export_full_responses"):
+                records = sink.read()
+                for m in models:
+                    sink.export_full_responses(m, prompt_cols, list(prompts["ID"]), validation, records=records)
+            sink.close()
+
+    if timeout is not None or hedge_after is not None:
+        log(f"Timeouts: {outcomes['timeout']}, answers from hedged requests: {outcomes['hedged']}", 0)
+
+    if adaptive:
+        log(f"Adaptive validation: {skipped} of {remaining} runs skipped ({skipped / remaining if remaining else 0:.1%})", 0)
 
-            results.update(p)
-        
+    responses = []
+    for m in models:
         answ = modelAnswer(
             model=m,
             validation=validation,
-            prompts_used=prompts.shape[1] - 1,
+            prompts_used=len(prompt_cols),
             n_cases=prompts.shape[0],
-            responses=results
+            store=results[m]
         )
 
         responses.append(answ)
 
-    return responses
\ No newline at end of file
+    return responses
@@ -1,18 +1,33 @@
 
-from sentence_transformers import SentenceTransformer
-import faiss
 import numpy as np
+import hashlib
+import os
+import re
+
 class rag_agent:
     
-    def __init__(self, encoder_model_name='all-MiniLM-L6-v2', protocol_text: str=None):
-        self.encoder = SentenceTransformer(encoder_model_name)
+    def __init__(self, encoder_model_name='all-MiniLM-L6-v2', protocol_text: str=None, cache_dir: str=None):
+        self.encoder_model_name = encoder_model_name
+        self._encoder = None
+        self.cache_dir = cache_dir
         if protocol_text is not None:
             self.chunks = self.txt_to_chunks_marks(protocol_text)
-            self.index_base = self.rebuild_index_base(self.chunks)
+            if cache_dir:
+                self.index_base = self.load_or_build_index(protocol_text, self.chunks)
+            else:
+                self.index_base = self.rebuild_index_base(self.chunks)
         else:
             self.chunks = self._pdf_to_text_chunks(pdf_path)
             self.index_base = self.rebuild_index_base(self.chunks)
 
+    @property
+    def encoder(self):
+        # The encoder (and torch) is only loaded when something actually needs to be embedded
+        if self._encoder is None:
+            from sentence_transformers import SentenceTransformer
+            self._encoder = SentenceTransformer(self.encoder_model_name)
+        return self._encoder
+
     def txt_to_chunks(self, text, chunk_size=250):
         chunks = []
         words = text.split()
@@ -25,11 +40,41 @@ class rag_agent:
         return texts.split("#-#")
 
     def rebuild_index_base(self, text_chunks):
+        import faiss
         embeddings = self.encoder.encode(text_chunks)
         self.index_base = faiss.IndexFlatL2(embeddings.shape[1])
         self.index_base.add(np.array(embeddings))
         return self.index_base
 
+    def index_cache_path(self, protocol_text: str):
+        """
+            Returns the index file path for this encoder and protocol text.
+        """
+        protocol_hash = hashlib.sha256(protocol_text.encode("utf-8")).hexdigest()[:16]
+        encoder_name = re.sub(r'[^A-Za-z0-9_.-]', '_', self.encoder_model_name)
+        base = os.path.join(self.cache_dir, f"{encoder_name}-{protocol_hash}")
+        return f"{base}.faiss"
+
+    def load_or_build_index(self, protocol_text: str, text_chunks):
+        """
+            Loads the index (the chunk embeddings) saved for this encoder/protocol pair, or builds
+            and saves it when the protocol text or the encoder changed.
+        """
+        import faiss
+        index_path = self.index_cache_path(protocol_text)
+
+        if os.path.exists(index_path):
+            self.index_base = faiss.read_index(index_path)
+            return self.index_base
+
+        self.rebuild_index_base(text_chunks)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write to a temporary file first so an interrupted run never leaves a half written cache behind
+        faiss.write_index(self.index_base, f"{index_path}.tmp")
+        os.replace(f"{index_path}.tmp", index_path)
+        return self.index_base
+
     def _retrieve_docs(self, query, top_k=5):
         if self.index_base is None:
             raise ValueError("Index base not built yet.")
@@ -37,20 +82,35 @@ class rag_agent:
         D, I = self.index_base.search(np.array(query_embedding), top_k)
         return I[0]
     
-    def improve_query(self, query: str, patient_info: str):
-
-        documents = self._retrieve_docs(patient_info.replace("\n", " "), 2)
-        documents = [int(i) for i in documents]
+    def retrieve_docs_batch(self, queries: list[str], top_k=5):
+        """
+            Retrieves the top_k chunk IDs of several queries with one encode call and one index search.
+        Returns:
+            np.ndarray: Array (len(queries), top_k) of chunk IDs.
+        """
+        if self.index_base is None:
+            raise ValueError("Index base not built yet.")
+        query_embeddings = self.encoder.encode(list(queries))
+        D, I = self.index_base.search(np.asarray(query_embeddings, dtype=np.float32), top_k)
+        return I
 
+    def references_text(self, documents) -> str:
+        """
+            Builds the text appended to a prompt for the retrieved chunk IDs.
+        """
         chunks_found = []
         for number in documents:
-            chunks_found.append(self.chunks[number])
+            chunks_found.append(self.chunks[int(number)])
 
         if len(chunks_found) == 0:
-            return query
-        
-        new_query = query + "\nConsidere os seguintes trechos do protocolo de triagem como subsídio para sua decisão:"
+            return ""
+
+        text = "\nConsidere os seguintes trechos do protocolo de triagem como subsídio para sua decisão:"
         for i, doc in enumerate(chunks_found):
-            new_query += f"\nTrecho {i+1}:{doc}"
-        return new_query
+            text += f"\nTrecho {i+1}:{doc}"
+        return text
+
+    def improve_query(self, query: str, patient_info: str):
 
+        documents = self._retrieve_docs(patient_info.replace("\n", " "), 2)
+        return query + self.references_text(documents)
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+class responseCache:
+    """
+        On-disk cache of raw model responses with size-bounded LRU eviction.
+
+        Entries are keyed by model name and digest, a hash of the final prompt text, the
+        validation run index and the generation options, so a cached answer is only reused
+        for exactly the same request against exactly the same weights.
+    """
+
+    def __init__(self, path: str = "./.cache/responses.sqlite", max_size_mb: float = 512):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                model TEXT,
+                                response TEXT,
+                                size INTEGER,
+                                last_used REAL)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, digest: str, prompt_text: str, run: int, options: dict = None, attempt: int = 0) -> str:
+        """
+            Builds the cache key of a request.
+        Args:
+            model (str): Model name.
+            digest (str): Model digest reported by ollama.list.
+            prompt_text (str): Final prompt text.
+            run (int): Validation run index.
+            options (dict, optional): Generation options sent with the request.
+            attempt (int): Retry number of the request, so retries are not answered with the cached failure.
+        Returns:
+            str: Hex digest identifying the request.
+        """
+
+        prompt_hash = hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()
+        key = [model, digest, prompt_hash, int(run), options or {}]
+        if attempt:
+            key.append(int(attempt))
+        payload = json.dumps(key, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return row[0]
+
+    def put(self, key: str, model: str, response: str):
+        size = len(response.encode("utf-8"))
+        old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if old is not None:
+            self._size -= old[0]
+
+        self._conn.execute("INSERT OR REPLACE INTO responses (key, model, response, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                           (key, model, response, size, time.time()))
+        self._size += size
+        self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        # Remove least recently used entries until the cache fits again
+        while self._size > self.max_bytes:
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_used LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._size <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._size -= size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size_mb": self._size / (1024 * 1024)}
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,247 @@
+import os
+import json
+import pandas as pd
+from Modules.model_answer import modelAnswer, answerStore
+
+# Fields identifying a record and its answer; any other field is telemetry
+RECORD_KEYS = ("model", "prompt", "case", "run", "answer", "explanation")
+
+def _to_builtin(value):
+    # numpy scalars (e.g. IDs read by pandas) are not JSON serializable
+    return value.item() if hasattr(value, "item") else value
+
+class resultSink:
+    """
+        Append-only store for model answers.
+
+        Every answer is written once, as one JSON line keyed by (model, prompt, case, run),
+        to `<path>/responses.jsonl`. The wide `full_responses.csv` layout read by
+        cal_statistics.py is exported from these records when the run ends or on demand.
+        For resuming, only the key and file offset of each record are kept in memory; the
+        records themselves are read back from the file when asked for.
+    """
+
+    filename = "responses.jsonl"
+
+    def __init__(self, path: str, append: bool = False):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.file_path = os.path.join(path, self.filename)
+        self._file = open(self.file_path, "ab" if append else "wb")
+        self._index = None
+
+        # Uma linha truncada (escrita interrompida) é terminada, para não colar no próximo registro
+        if append and self._file.tell() > 0:
+            with open(self.file_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write(b"\n")
+
+    def write(self, model: str, prompt: str, case_id, run: int, answer: str, explanation: str, **extra):
+        """
+            Appends a single answer to the store.
+        Args:
+            model (str): Model name.
+            prompt (str): Prompt column (e.g. "prompt_1").
+            case_id: Case ID.
+            run (int): Validation run index, starting at 0.
+            answer (str): Parsed answer.
+            explanation (str): Parsed explanation.
+            **extra: Additional fields stored with the record.
+        """
+
+        record = {"model": model, "prompt": prompt, "case": _to_builtin(case_id), "run": int(run),
+                  "answer": answer, "explanation": explanation}
+        record.update({k: _to_builtin(v) for k, v in extra.items()})
+
+        offset = self._file.tell()
+        self._file.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        self._file.flush()
+
+        if self._index is not None:
+            self._index.setdefault(record["case"], {})[(model, prompt, record["run"])] = offset
+
+    def read(self) -> list[dict]:
+        """
+            Reads every record written so far. A truncated last line (interrupted write) is ignored.
+        Returns:
+            list[dict]: The stored records in write order.
+        """
+
+        self._file.flush()
+        return read_records(self.file_path)
+
+    def records(self):
+        """
+            Iterates over the records written so far without holding them in memory.
+        """
+
+        self._file.flush()
+        return iter_records(self.file_path)
+
+    def _build_index(self) -> dict:
+        # case -> {(model, prompt, run): offset of its last record}
+        index = {}
+        self._file.flush()
+        with open(self.file_path, "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    r = json.loads(line)
+                    index.setdefault(r["case"], {})[(r["model"], r["prompt"], r["run"])] = offset
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    pass
+                offset += len(line)
+        return index
+
+    def stored(self, cases: list = None) -> dict:
+        """
+            Returns the stored records keyed by (model, prompt, case, run), last record winning.
+
+            The file is scanned once on the first call and only the keys and offsets are kept;
+            later writes keep that index up to date. The records are read back from the file.
+        Args:
+            cases (list, optional): Only return the records of these case IDs (e.g. one chunk of a run).
+        """
+
+        if self._index is None:
+            self._index = self._build_index()
+        cases = list(self._index) if cases is None else [_to_builtin(c) for c in cases]
+
+        wanted = sorted((offset, (model, prompt, case, run)) for case in cases
+                        for (model, prompt, run), offset in self._index.get(case, {}).items())
+        stored = {}
+        self._file.flush()
+        with open(self.file_path, "rb") as f:
+            for offset, key in wanted:
+                f.seek(offset)
+                stored[key] = json.loads(f.readline())
+        return stored
+
+    def export_full_responses(self, model: str, prompts: list[str] = None, case_ids: list = None, validation: int = None, records: list[dict] = None) -> pd.DataFrame:
+        """
+            Writes `<path>/<model>/full_responses.csv` in the layout produced by query_models.
+        Args:
+            model (str): Model to export.
+            prompts (list[str], optional): Prompt columns, in order. Defaults to the order they appear in the records.
+            case_ids (list, optional): Case IDs, in order. Defaults to the order they appear in the records.
+            validation (int, optional): Number of runs per case. Defaults to the highest run found.
+            records (list[dict], optional): Records already read from the store, to avoid reading it again.
+                By default the file is streamed and only the records of this model are kept.
+        Returns:
+            pd.DataFrame: The exported table.
+        """
+
+        df = full_responses_table(self.records() if records is None else records, model, prompts, case_ids, validation)
+
+        os.makedirs(f'{self.path}/{model}/', exist_ok=True)
+        df.to_csv(f'{self.path}/{model}/full_responses.csv', index=False)
+        return df
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_records(file_path: str):
+    if not os.path.exists(file_path):
+        return
+
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+def read_records(file_path: str) -> list[dict]:
+    return list(iter_records(file_path))
+
+def full_responses_table(records: list[dict], model: str, prompts: list[str] = None, case_ids: list = None, validation: int = None) -> pd.DataFrame:
+    """
+        Pivots answer records of one model into the wide full_responses.csv layout:
+        ID, "<prompt> (<run>x)" answer columns, then "<prompt> (<run>x) Explanation" columns.
+        When a (prompt, case, run) was written more than once the last record wins.
+    """
+
+    df = pd.DataFrame([r for r in records if r["model"] == model],
+                      columns=list(RECORD_KEYS))
+
+    if prompts is None:
+        prompts = list(dict.fromkeys(df["prompt"]))
+    if case_ids is None:
+        case_ids = list(dict.fromkeys(df["case"]))
+    else:
+        case_ids = [_to_builtin(c) for c in case_ids]
+    if validation is None:
+        validation = int(df["run"].max()) + 1 if len(df) else 0
+
+    df = df.drop_duplicates(subset=["prompt", "case", "run"], keep="last")
+    df["column"] = df["prompt"] + " (" + (df["run"] + 1).astype(str) + "x)"
+
+    answer_cols = [f'{col} ({i+1}x)' for col in prompts for i in range(validation)]
+    answers = df.pivot(index="case", columns="column", values="answer").reindex(index=case_ids, columns=answer_cols)
+    explanations = df.pivot(index="case", columns="column", values="explanation").reindex(index=case_ids, columns=answer_cols)
+    explanations.columns = [f'{col} Explanation' for col in answer_cols]
+
+    table = pd.concat([answers, explanations], axis=1)
+    table.index.name = "ID"
+    return table.reset_index()
+
+def stored_answer(record: dict, include_explanations: bool = True) -> dict:
+    """
+        Converts a stored record back into the answer dict kept in modelAnswer.responses.
+    """
+
+    answer = {"answer": record["answer"], "explanation": record["explanation"] if include_explanations else ""}
+    if "status" in record:
+        answer["status"] = record["status"]
+
+    telemetry = {k: v for k, v in record.items() if k not in RECORD_KEYS and k != "status"}
+    if telemetry:
+        answer["telemetry"] = telemetry
+    return answer
+
+def model_answers_from_records(records: list[dict], models: list[str], prompts: list[str], case_ids: list, validation: int, include_explanations: bool = True, explanations_from: str = None) -> list[modelAnswer]:
+    """
+        Rebuilds modelAnswer objects from stored records. Answers missing from the records are left as None.
+    Args:
+        records (iterable): Records read from a resultSink; an iterator (e.g. iter_records) is consumed
+            once without being held in memory.
+        models (list[str]): Models to rebuild.
+        prompts (list[str]): Prompt columns, in order.
+        case_ids (list): Case IDs, in order.
+        validation (int): Number of runs per case.
+        include_explanations (bool): Keep the explanations. Without them only the answers are held in memory.
+        explanations_from (str, optional): responses.jsonl to read the explanations from when they are first
+            needed, instead of keeping them (used with include_explanations=False).
+    Returns:
+        list[modelAnswer]: One object per model.
+    """
+
+    case_ids = list(case_ids)
+    wanted = set(models)
+
+    stores = {}
+    for m in models:
+        loader = None
+        if not include_explanations and explanations_from is not None:
+            loader = lambda m=m: ((r["prompt"], r["case"], r["run"], r["explanation"]) for r in iter_records(explanations_from) if r["model"] == m)
+        stores[m] = answerStore(prompts, case_ids, validation, explanation_loader=loader)
+
+    # Store slots are keyed by the given case IDs; records hold them as builtins.
+    # Records come in write order, so a later record of the same slot overwrites the earlier one
+    cases = {_to_builtin(case_id): case_id for case_id in case_ids}
+    for r in records:
+        m, prompt, case, run = r["model"], r["prompt"], r["case"], r["run"]
+        if m in wanted and case in cases and stores[m].index(prompt, cases[case], run) is not None:
+            answer = stored_answer(r, include_explanations)
+            if not include_explanations:
+                del answer["explanation"]
+            stores[m].set(prompt, cases[case], run, answer)
+
+    return [modelAnswer(model=m, validation=validation, prompts_used=len(prompts), n_cases=len(case_ids), store=stores[m]) for m in models]
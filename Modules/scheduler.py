@@ -0,0 +1,133 @@
+import time
+import threading
+import ollama
+import pandas as pd
+
+class modelScheduler:
+    """
+        Model-aware ordering of query jobs, to avoid Ollama evicting and reloading weights.
+
+        Work is grouped by model and only one model is dispatched at a time. As soon as the
+        queue of the current model is empty (its last requests are still running) the next model
+        is pre-warmed, so its weights load while the current one drains. Within a model, jobs are
+        ordered by prompt, case and run, so requests sharing the same prompt prefix run back to back
+        and can reuse Ollama's prompt cache. Every request carries an explicit keep_alive, and
+        finished models can be unloaded right away (or, with `defer_unloads`, when the whole run is
+        done, e.g. after the last chunk). With an endpointPool, models are warmed up and unloaded
+        on every host that has them.
+    """
+
+    def __init__(self, keep_alive="10m", unload_finished: bool = False, endpoints=None):
+        self.keep_alive = keep_alive
+        self.unload_finished = unload_finished
+        self.endpoints = endpoints
+        self.model_order = []
+        self.defer_unloads = False
+        self._warmed = set()
+        self._finished = []
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def order(self, jobs: list) -> list:
+        """
+            Orders jobs by model (first appearance), then prompt, case and run.
+        """
+
+        for job in jobs:
+            if job.model not in self.model_order:
+                self.model_order.append(job.model)
+
+        prompt_order = {}
+        case_order = {}
+        for job in jobs:
+            prompt_order.setdefault(job.prompt, len(prompt_order))
+            case_order.setdefault(job.case_id, len(case_order))
+
+        return sorted(jobs, key=lambda job: (self.model_order.index(job.model), prompt_order[job.prompt], case_order[job.case_id], job.run))
+
+    def next_model(self, model: str):
+        i = self.model_order.index(model)
+        return self.model_order[i + 1] if i + 1 < len(self.model_order) else None
+
+    def warm(self, model: str):
+        """
+            Loads a model without generating anything. Safe to call more than once.
+        """
+
+        with self._lock:
+            if model is None or model in self._warmed:
+                return
+            self._warmed.add(model)
+
+        start = time.perf_counter()
+        load = 0
+        for client in self._clients(model):
+            load += client.generate(model=model, prompt="", keep_alive=self.keep_alive).get("load_duration") or 0
+        with self._lock:
+            stats = self._model_stats(model)
+            stats["warmup_s"] += time.perf_counter() - start
+            stats["load_s"] += load / 1e9
+
+    def unload(self, model: str):
+        if not self.unload_finished:
+            return
+        with self._lock:
+            if self.defer_unloads:
+                if model not in self._finished:
+                    self._finished.append(model)
+                return
+            # Um modelo descarregado precisa ser aquecido de novo se voltar a ser usado
+            self._warmed.discard(model)
+        for client in self._clients(model):
+            client.generate(model=model, prompt="", keep_alive=0)
+
+    def unload_deferred(self):
+        """
+            Stops deferring unloads and unloads the models that finished meanwhile.
+        """
+
+        with self._lock:
+            self.defer_unloads = False
+            finished, self._finished = self._finished, []
+        for model in finished:
+            self.unload(model)
+
+    def _clients(self, model: str) -> list:
+        # Every host of the pool having the model, or the local Ollama
+        return self.endpoints.clients(model) if self.endpoints else [ollama]
+
+    def record(self, model: str, metrics: dict):
+        """
+            Accounts the load and inference time reported by Ollama for one request. Streamed
+            requests cancelled right after the answer carry no Ollama durations: their client
+            wall time is used as the inference time. Failed requests (timeouts) are not counted.
+        """
+
+        if metrics.get("status") is not None:
+            return
+
+        load = (metrics.get("load_duration") or 0) / 1e9
+        estimated = metrics.get("total_duration") is None
+        total = (metrics.get("wall_time") or 0) if estimated else metrics["total_duration"] / 1e9
+        with self._lock:
+            stats = self._model_stats(model)
+            stats["requests"] += 1
+            stats["estimated"] += estimated
+            stats["load_s"] += load
+            stats["inference_s"] += max(total - load, 0.0)
+
+    def _model_stats(self, model: str) -> dict:
+        return self._stats.setdefault(model, {"requests": 0, "estimated": 0, "warmup_s": 0.0, "load_s": 0.0, "inference_s": 0.0})
+
+    def report(self) -> pd.DataFrame:
+        """
+            Returns, per model, the number of requests (and how many of them had their inference
+            time estimated from the wall time), the wall time spent pre-warming, the model load time
+            (Ollama load_duration, including warm-ups) and the inference time (total_duration minus
+            load_duration), in seconds.
+        """
+
+        with self._lock:
+            rows = [{"Model": m, **stats} for m, stats in self._stats.items()]
+        return pd.DataFrame(rows,
+                            columns=["Model", "requests", "estimated", "warmup_s", "load_s", "inference_s"])
@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from Modules.aggregation import MTS_LABELS, encode_answers, majority_vote
+
+CI_METRICS = ("Acurácia (moda)", "F1 (moda)", "Under-triage (moda)", "Over-triage (moda)")
+
+# Replicates are processed in chunks of about this many (replicate, case) weights
+_CHUNK_CELLS = 2_000_000
+
+def case_indicators(predictions: np.ndarray, y_true: np.ndarray, tie_break: str = "alphabetical") -> dict:
+    """
+        Per-case indicators of the mode answers, from which every metric is a sum over the cases.
+
+        Uses the same definitions as triage_metrics: a case without a mode is a wrong answer
+        predicted as an extra "no answer" label, so it still counts in the true total of its label,
+        and under/over-triage are fractions of the misses.
+    Args:
+        predictions (np.ndarray): Answers, shape (models, cases, prompts, runs).
+        y_true (np.ndarray): Correct classification of each case, shape (cases,).
+        tie_break (str): Tie-break policy of the mode.
+    Returns:
+        dict: Boolean arrays "correct", "miss", "under", "over" of shape (models, prompts, cases) and
+            "tp", "pred", "true" of shape (models, prompts, labels + 1, cases), "no answer" last.
+    """
+
+    mode = majority_vote(encode_answers(predictions), len(MTS_LABELS), tie_break).mode
+    mode = np.moveaxis(mode, 1, -1)                 # (models, prompts, cases)
+    true = encode_answers(y_true)
+    # Código len(MTS_LABELS) = sem resposta
+    labels = np.arange(len(MTS_LABELS) + 1)[:, None]
+    mode_code = np.where(mode >= 0, mode, len(MTS_LABELS))
+
+    # Códigos em ordem de urgência: código maior = cor menos urgente
+    known = (mode >= 0) & (true >= 0)
+    correct = known & (mode == true)
+    predicted = (mode_code[..., None, :] == labels) & (true >= 0)
+    return {
+        "correct": correct,
+        "miss": ~correct,
+        "under": known & (mode > true),
+        "over": known & (mode < true),
+        "tp": predicted & correct[..., None, :],
+        "pred": predicted,
+        "true": np.broadcast_to(true == labels, predicted.shape),
+    }
+
+def metrics_from_sums(sums: dict, n_cases: int) -> dict:
+    """
+        Accuracy, macro-F1 (over the labels present, zero_division=0) and under/over-triage rates
+        from indicator sums whose last axis holds the replicates (labels are the axis before it).
+    """
+
+    tp, pred, true = sums["tp"], sums["pred"], sums["true"]
+    present = (true > 0) | (pred > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f1 = np.where(true + pred > 0, 2 * tp / np.maximum(true + pred, 1), 0.0)
+        macro_f1 = np.where(present.any(axis=-2), (f1 * present).sum(axis=-2) / present.sum(axis=-2), np.nan)
+        under = np.where(sums["miss"] > 0, sums["under"] / sums["miss"], np.nan)
+        over = np.where(sums["miss"] > 0, sums["over"] / sums["miss"], np.nan)
+    return dict(zip(CI_METRICS, (sums["correct"] / n_cases, macro_f1, under, over)))
+
+def _totals(indicators: dict) -> dict:
+    # Sums over all the cases, as a single replicate
+    return {key: value.sum(axis=-1, keepdims=True) for key, value in indicators.items()}
+
+def _weighted_sums(indicators: dict, weights: np.ndarray) -> dict:
+    # (..., cases) @ (cases, replicates) -> (..., replicates)
+    return {key: value.astype(np.float32) @ weights.T for key, value in indicators.items()}
+
+def _bootstrap_chunk(task: tuple) -> dict:
+    indicators, n_cases, size, seed = task
+    rng = np.random.default_rng(seed)
+    # All replicates of the chunk as one index matrix, turned into per-case resampling counts
+    index = rng.integers(0, n_cases, size=(size, n_cases))
+    rows = np.arange(size)[:, None]
+    weights = np.bincount((rows * n_cases + index).ravel(), minlength=size * n_cases).reshape(size, n_cases).astype(np.float32)
+    return metrics_from_sums(_weighted_sums(indicators, weights), n_cases)
+
+def _permutation_chunk(task: tuple) -> dict:
+    first, second, n_cases, size, seed = task
+    rng = np.random.default_rng(seed)
+    # Paired test: each case swaps the answers of the two configurations with probability 1/2
+    swaps = rng.integers(0, 2, size=(size, n_cases)).astype(np.float32)
+    shifts = _weighted_sums({key: second[key].astype(np.float32) - first[key] for key in first}, swaps)
+    totals_first, totals_second = _totals(first), _totals(second)
+    a = metrics_from_sums({key: totals_first[key] + shifts[key] for key in first}, n_cases)
+    b = metrics_from_sums({key: totals_second[key] - shifts[key] for key in first}, n_cases)
+    return {metric: a[metric] - b[metric] for metric in CI_METRICS}
+
+def _run_chunks(function, make_task, n: int, n_cases: int, seed: int, workers: int) -> dict:
+    size = max(1, min(n, _CHUNK_CELLS // max(n_cases, 1)))
+    sizes = [min(size, n - start) for start in range(0, n, size)]
+    # One seed per chunk, so the results do not depend on the number of workers
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [make_task(chunk, s) for chunk, s in zip(sizes, seeds)]
+
+    if workers and workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(function, tasks))
+    else:
+        parts = [function(task) for task in tasks]
+    return {metric: np.concatenate([part[metric] for part in parts], axis=-1) for metric in CI_METRICS}
+
+def bootstrap_ci(predictions: np.ndarray, y_true: np.ndarray, models: list[str], prompts: list[str], n_resamples: int = 10000,
+                 confidence: float = 0.95, tie_break: str = "alphabetical", seed: int = 0, workers: int = None) -> pd.DataFrame:
+    """
+        Percentile bootstrap confidence intervals of accuracy, macro-F1 and under/over-triage (mode
+        answers) for every model and prompt.
+
+        Cases are resampled with replacement. The replicates are drawn as one index matrix per
+        chunk and turned into per-case counts, so every metric of every model, prompt and
+        replicate comes from a matrix product of the case indicators with the counts. Chunks can
+        be spread over a process pool with `workers`.
+    Args:
+        predictions (np.ndarray): Answers, shape (models, cases, prompts, runs).
+        y_true (np.ndarray): Correct classification of each case, shape (cases,).
+        models (list[str]): Model names, in the order of the first axis.
+        prompts (list[str]): Prompt names, in the order of the third axis.
+        n_resamples (int): Number of bootstrap replicates.
+        confidence (float): Confidence level of the intervals.
+        tie_break (str): Tie-break policy of the mode.
+        seed (int): Seed of the resampling.
+        workers (int, optional): Processes of the pool; the replicates are computed in process when omitted.
+    Returns:
+        pd.DataFrame: One row per model, prompt and metric with the estimate, the interval and the standard error.
+    """
+
+    indicators = case_indicators(predictions, y_true, tie_break)
+    n_cases = len(y_true)
+    estimate = {metric: value[..., 0] for metric, value in metrics_from_sums(_totals(indicators), n_cases).items()}
+    replicates = _run_chunks(_bootstrap_chunk, lambda size, s: (indicators, n_cases, size, s), n_resamples, n_cases, seed, workers)
+
+    tail = (1 - confidence) / 2 * 100
+    rows = []
+    for metric in CI_METRICS:
+        with np.errstate(all="ignore"):
+            low, high = np.nanpercentile(replicates[metric], [tail, 100 - tail], axis=-1)
+            std = np.nanstd(replicates[metric], axis=-1)
+        for m, model in enumerate(models):
+            for p, prompt in enumerate(prompts):
+                rows.append({"Model": model, "Prompt": prompt, "Métrica": metric, "Estimativa": estimate[metric][m, p],
+                             "IC inferior": low[m, p], "IC superior": high[m, p], "Erro padrão": std[m, p]})
+    return pd.DataFrame(rows)
+
+def comparison_pairs(models: list[str], prompts: list[str]) -> list[tuple]:
+    """
+        Pairs of (model index, prompt index) compared by permutation_tests: every two models on the
+        same prompt, and every two prompts of the same model.
+    """
+
+    pairs = [((a, p), (b, p)) for p in range(len(prompts)) for a in range(len(models)) for b in range(a + 1, len(models))]
+    pairs += [((m, a), (m, b)) for m in range(len(models)) for a in range(len(prompts)) for b in range(a + 1, len(prompts))]
+    return pairs
+
+def permutation_tests(predictions: np.ndarray, y_true: np.ndarray, models: list[str], prompts: list[str], n_permutations: int = 10000,
+                      tie_break: str = "alphabetical", seed: int = 0, workers: int = None, pairs: list[tuple] = None) -> pd.DataFrame:
+    """
+        Paired permutation tests of the metric differences between configurations evaluated on the
+        same cases (see comparison_pairs).
+
+        Under the null hypothesis the two configurations are exchangeable on each case, so each
+        permutation swaps their answers on a random subset of cases. Every metric is linear in the
+        swaps, so all permutations and pairs are evaluated at once from the swap matrix.
+        The p-value is two-sided: (1 + #|permuted difference| >= |observed difference|) / (1 + n_permutations).
+    Args:
+        predictions (np.ndarray): Answers, shape (models, cases, prompts, runs).
+        y_true (np.ndarray): Correct classification of each case, shape (cases,).
+        models (list[str]): Model names, in the order of the first axis.
+        prompts (list[str]): Prompt names, in the order of the third axis.
+        n_permutations (int): Number of permutations.
+        tie_break (str): Tie-break policy of the mode.
+        seed (int): Seed of the permutations.
+        workers (int, optional): Processes of the pool.
+        pairs (list[tuple], optional): ((model, prompt), (model, prompt)) index pairs. Defaults to comparison_pairs.
+    Returns:
+        pd.DataFrame: One row per pair and metric with both estimates, their difference and the p-value.
+    """
+
+    pairs = comparison_pairs(models, prompts) if pairs is None else pairs
+    if not pairs:
+        return pd.DataFrame(columns=["Métrica", "Model A", "Prompt A", "Model B", "Prompt B", "A", "B", "Diferença", "p-valor"])
+
+    indicators = case_indicators(predictions, y_true, tie_break)
+    n_cases = len(y_true)
+    first_index, second_index = (tuple(np.array(side).T) for side in zip(*pairs))
+    first = {key: value[first_index] for key, value in indicators.items()}
+    second = {key: value[second_index] for key, value in indicators.items()}
+
+    a = {metric: value[..., 0] for metric, value in metrics_from_sums(_totals(first), n_cases).items()}
+    b = {metric: value[..., 0] for metric, value in metrics_from_sums(_totals(second), n_cases).items()}
+    permuted = _run_chunks(_permutation_chunk, lambda size, s: (first, second, n_cases, size, s), n_permutations, n_cases, seed, workers)
+
+    rows = []
+    for metric in CI_METRICS:
+        observed = a[metric] - b[metric]
+        with np.errstate(invalid="ignore"):
+            # Small tolerance so permutations reproducing the observed difference count despite rounding
+            extreme = (np.abs(permuted[metric]) >= np.abs(observed)[:, None] - 1e-9).sum(axis=-1)
+        p_values = np.where(np.isnan(observed), np.nan, (1 + extreme) / (1 + n_permutations))
+        for i, ((ma, pa), (mb, pb)) in enumerate(pairs):
+            rows.append({"Métrica": metric, "Model A": models[ma], "Prompt A": prompts[pa], "Model B": models[mb], "Prompt B": prompts[pb],
+                         "A": a[metric][i], "B": b[metric][i], "Diferença": observed[i], "p-valor": p_values[i]})
+    return pd.DataFrame(rows)
@@ -1,35 +1,184 @@
 import pandas as pd
 import numpy as np
 
-from sklearn.metrics import confusion_matrix, precision_score, recall_score, f1_score, accuracy_score
 from Modules.model_answer import modelAnswer
+from Modules.aggregation import MARGIN_MIN_RUNS, majority_vote, normalize_answers, normalize_label
 
-def calculate_metrics(model_answers: list[modelAnswer], correct_df: pd.DataFrame) -> pd.DataFrame:
+# Gravidade de cada cor no MTS (quanto maior, mais urgente)
+COLOR_SEVERITY = {
+	'Vermelho': 5,
+	'Laranja': 4,
+	'Amarelo': 3,
+	'Verde': 2,
+	'Azul': 1,
+	'vermelho': 5,
+	'laranja': 4,
+	'amarelo': 3,
+	'verde': 2,
+	'azul': 1,
+	'Blue': 1,
+	'Green': 2,
+	'Yellow': 3,
+	'Orange': 4,
+	'Red': 5
+}
+
+# Rótulo da moda de um caso sem nenhuma resposta válida (só "Failed JSON", "Timeout", ...)
+NO_ANSWER = 'Sem resposta'
+
+METRIC_COLUMNS = ['Acurácia (moda)', 'Precisão (moda)', 'Recall (moda)', 'F1 (moda)',
+                  'Under-triage (moda)', 'Over-triage (moda)', 'Concordância média',
+                  'Acurácia geral', 'Under-triage geral', 'Over-triage geral',
+                  'Margem média (moda)', 'Empates (moda)']
+
+def encode_labels(*arrays):
+	"""
+		Encodes label arrays into integer codes over one shared, sorted vocabulary.
+		Missing values (NaN/None) are encoded as -1.
+	Returns:
+		tuple: (list of code arrays with the input shapes, np.ndarray of labels)
+	"""
+
+	flat = np.concatenate([np.asarray(a, dtype=object).ravel() for a in arrays])
+	codes, labels = pd.factorize(flat, sort=True)
+
+	encoded = []
+	start = 0
+	for a in arrays:
+		size = np.asarray(a, dtype=object).size
+		encoded.append(codes[start:start + size].reshape(np.shape(a)))
+		start += size
+	return encoded, np.asarray(labels, dtype=object)
+
+def _safe_divide(a, b):
+	a = np.asarray(a, dtype=float)
+	b = np.asarray(b, dtype=float)
+	out = np.full(np.broadcast(a, b).shape, np.nan)
+	np.divide(a, b, out=out, where=b != 0)
+	return out
+
+def triage_metrics(predictions: np.ndarray, y_true: np.ndarray, models: list[str], prompts: list[str], tie_break: str = "alphabetical"):
+	"""
+		Computes every triage metric for all models and prompts in one vectorized pass.
+
+		Colour spellings are normalised and labels encoded once into integer codes; the per-case
+		mode, the confusion matrices and the vote counts are then obtained with bincount over the
+		whole (models, cases, prompts, runs) array. Only MTS colours are votes: answers such as
+		"Failed JSON" never become the mode, but still count as wrong answers in the overall
+		statistics. A case whose runs hold no colour is predicted as NO_ANSWER, so it stays in the
+		confusion matrix (and lowers the recall of its true label). Ties are broken by `tie_break`
+		(see aggregation.majority_vote); the mean vote margin is only reported with MARGIN_MIN_RUNS
+		runs or more, since with fewer runs it equals the agreement. Macro precision/recall/F1
+		average over the labels present in y_true or in the predictions with zero_division=0, like
+		sklearn. Missing answers are ignored.
+	Args:
+		predictions (np.ndarray): Answers, shape (models, cases, prompts, runs).
+		y_true (np.ndarray): Correct classification of each case, shape (cases,).
+		models (list[str]): Model names, in the order of the first axis.
+		prompts (list[str]): Prompt names, in the order of the third axis.
+		tie_break (str): Tie-break policy of the mode; "alphabetical" reproduces DataFrame.mode.
+	Returns:
+		tuple: (metrics DataFrame with one row per model and prompt,
+				confusion matrices np.ndarray (models, prompts, labels, labels) of the mode answers,
+				labels np.ndarray naming the confusion matrix rows/columns, NO_ANSWER last)
+	"""
+
+	(pred, true), labels = encode_labels(normalize_answers(predictions), normalize_answers(y_true))
+	M, N, P, R = pred.shape
+	K = len(labels)
+
+	severity = np.array([COLOR_SEVERITY.get(label, np.nan) for label in labels], dtype=float)
+	severity = np.append(severity, np.nan)      # code -1 (missing) -> NaN
+	true_b = true[None, :, None]
+
+	# Votos de cada cor por (modelo, caso, prompt); respostas que não são cores não votam
+	valid = pred >= 0
+	is_color = np.append([normalize_label(label) is not None for label in labels], False)
+	vote = majority_vote(np.where(is_color[pred], pred, -1), K, tie_break, labels)
+	counts, n_votes, mode = vote.counts, vote.n_votes, vote.mode
+
+	# Matrizes de confusão da moda; casos sem moda entram na coluna extra "sem resposta" (código K),
+	# assim continuam no total de cada rótulo verdadeiro e no denominador do recall
+	mp = (np.arange(M)[:, None, None] * P + np.arange(P)[None, None, :])
+	mode_code = np.where(mode >= 0, mode, K)
+	known = np.broadcast_to(true_b >= 0, mode.shape)
+	confusion = np.bincount(((mp * (K + 1) + true_b) * (K + 1) + mode_code)[known], minlength=M * P * (K + 1) * (K + 1)).reshape(M, P, K + 1, K + 1)
+	labels = np.append(labels, NO_ANSWER)
+
+	tp = np.diagonal(confusion, axis1=-2, axis2=-1)
+	true_count = confusion.sum(axis=-1)
+	pred_count = confusion.sum(axis=-2)
+	present = (true_count > 0) | (pred_count > 0)
+	n_present = present.sum(axis=-1)
+
+	precision = np.where(pred_count > 0, tp / np.maximum(pred_count, 1), 0.0)
+	recall = np.where(true_count > 0, tp / np.maximum(true_count, 1), 0.0)
+	f1 = np.where(true_count + pred_count > 0, 2 * tp / np.maximum(true_count + pred_count, 1), 0.0)
+
+	accuracy_mode = ((mode == true_b) & known).sum(axis=1) / N
+	precision_mode = _safe_divide((precision * present).sum(axis=-1), n_present)
+	recall_mode = _safe_divide((recall * present).sum(axis=-1), n_present)
+	f1_mode = _safe_divide((f1 * present).sum(axis=-1), n_present)
+
+	sev_mode = severity[mode]
+	sev_true = severity[true][None, :, None]
+	miss_mode = (sev_mode != sev_true).sum(axis=1)
+	under_mode = _safe_divide((sev_mode < sev_true).sum(axis=1), miss_mode)
+	over_mode = _safe_divide((sev_mode > sev_true).sum(axis=1), miss_mode)
+
+	# Estatísticas gerais: todas as respostas de todas as execuções
+	sev_pred = severity[pred]
+	sev_true_runs = sev_true[..., None]
+	answered = valid.sum(axis=(1, 3))
+	accuracy_all = _safe_divide(((pred == true[None, :, None, None]) & valid).sum(axis=(1, 3)), answered)
+	miss_all = ((sev_pred != sev_true_runs) & valid).sum(axis=(1, 3))
+	under_all = _safe_divide((sev_pred < sev_true_runs).sum(axis=(1, 3)), miss_all)
+	over_all = _safe_divide((sev_pred > sev_true_runs).sum(axis=(1, 3)), miss_all)
+
+	# Concordância: fração de pares de execuções com a mesma resposta
+	agreeing_pairs = (counts * (counts - 1) / 2).sum(axis=-1)
+	pairs = n_votes * (n_votes - 1) / 2
+	agreement = _safe_divide(agreeing_pairs, pairs)
+	with_pairs = pairs > 0
+	agreement_mean = _safe_divide(np.where(with_pairs, agreement, 0).sum(axis=1), with_pairs.sum(axis=1))
+
+	# Margem da moda (fração dos votos) e casos decididos pela regra de desempate
+	voted = n_votes > 0
+	margin_mean = _safe_divide(np.where(voted, _safe_divide(vote.margin, n_votes), 0).sum(axis=1), voted.sum(axis=1))
+	ties = _safe_divide(vote.tied.sum(axis=1), voted.sum(axis=1))
+
+	values = np.stack([accuracy_mode, precision_mode, recall_mode, f1_mode,
+                       under_mode, over_mode, agreement_mean,
+                       accuracy_all, under_all, over_all,
+                       margin_mean, ties], axis=-1)
+
+	metrics = pd.DataFrame(values.reshape(M * P, -1), columns=METRIC_COLUMNS)
+	if R < MARGIN_MIN_RUNS:
+		metrics = metrics.drop(columns=['Margem média (moda)'])
+	metrics.insert(0, 'Prompt', np.tile(np.asarray(prompts, dtype=object), M))
+	metrics.insert(0, 'Model', np.repeat(np.asarray(models, dtype=object), P))
+
+	return metrics, confusion, labels
+
+def answers_array(model: modelAnswer) -> np.ndarray:
+	"""
+		Returns the answers of a modelAnswer as an object array of shape (cases, prompts, runs).
+		Missing answers are None.
+	"""
+
+	return model.store.answers().transpose(1, 0, 2)
+
+def calculate_metrics(model_answers: list[modelAnswer], correct_df: pd.DataFrame, tie_break: str = "alphabetical") -> pd.DataFrame:
 	
-	accuracy_results = []
-
-	for model in model_answers:
-		results, _ = model.get_case_responses()
-		#print(results)
-		for prompt in results.columns[1:]:
-			y_true = correct_df['Classificacao_Correta'].values
-			y_pred = results[prompt].values
-
-			#print(y_true, y_pred)
-
-			accuracy = accuracy_score(y_true, y_pred)
-			
-			precision = precision_score(y_true, y_pred, average='macro', zero_division=0)
-			recall = recall_score(y_true, y_pred, average='macro', zero_division=0)
-			f1 = f1_score(y_true, y_pred, average='macro', zero_division=0)
-			#conf_matrix = confusion_matrix(y_true, y_pred)
-
-			accuracy_results.append({
-				'Model': model.model,
-				'Prompt': prompt[:-7],
-				'Accuracy': accuracy,
-				'Precision': precision,
-				'Recal': recall,
-				'F1': f1,
-			})
-	return pd.DataFrame(accuracy_results)
+	y_true = correct_df['Classificacao_Correta'].values
+	prompts = model_answers[0].store.prompts
+
+	predictions = np.stack([answers_array(model) for model in model_answers])
+	metrics, _, _ = triage_metrics(predictions, y_true, [model.model for model in model_answers], prompts, tie_break)
+
+	return metrics[['Model', 'Prompt', 'Acurácia (moda)', 'Precisão (moda)', 'Recall (moda)', 'F1 (moda)']].rename(columns={
+		'Acurácia (moda)': 'Accuracy',
+		'Precisão (moda)': 'Precision',
+		'Recall (moda)': 'Recal',
+		'F1 (moda)': 'F1',
+	})
@@ -29,12 +29,13 @@ def process_csv_table(data: pd.DataFrame, slices: tuple = None):
 
     return information, results_df
 
-def save_results_to_csv(results: list[modelAnswer], correct_answers: pd.DataFrame = None, path: str = None):
+def save_results_to_csv(results: list[modelAnswer], correct_answers: pd.DataFrame = None, path: str = None, tie_break: str = "alphabetical"):
     """
     Saves the results DataFrame to a CSV file.
 
     Args:
         results (list[modelAnswer]): List of modelAnswer objects containing the results to be saved.
+        tie_break (str): Tie-break policy of the majority answer (see aggregation.majority_vote).
     """
     
     if not results:
@@ -51,7 +52,7 @@ def save_results_to_csv(results: list[modelAnswer], correct_answers: pd.DataFram
         log_dir = path
         os.makedirs(log_dir, exist_ok=True)
 
-    summary= calculate_metrics(results, correct_answers)
+    summary= calculate_metrics(results, correct_answers, tie_break=tie_break)
     summary.to_csv(f"{log_dir}/summary_statistics.csv", index=False)
 
     for r in results:
@@ -63,8 +64,8 @@ def save_results_to_csv(results: list[modelAnswer], correct_answers: pd.DataFram
             folder = f"{log_dir}/{modelo}"
             os.makedirs(folder, exist_ok=True)
 
-            b, _ = r.get_case_responses()
-            results_mode = pd.merge(b, correct_answers, on="ID", how="left").drop(columns=["Justificativa"])
+            b, _ = r.get_case_responses(tie_break=tie_break)
+            results_mode = pd.merge(b, correct_answers, on="ID", how="left").drop(columns=["Justificativa"], errors="ignore")
             results_mode.to_csv(f"{folder}/results_summary.csv", index=False)
 
         except Exception as e:
@@ -74,6 +75,6 @@ def save_results_to_csv(results: list[modelAnswer], correct_answers: pd.DataFram
             folder = f"{log_dir}/{modelo}"
             os.makedirs(folder, exist_ok=True)
 
-            b, _ = r.get_case_responses()
-            results_mode = pd.merge(b, correct_answers, on="ID", how="left").drop(columns=["Justificativa"])
+            b, _ = r.get_case_responses(tie_break=tie_break)
+            results_mode = pd.merge(b, correct_answers, on="ID", how="left").drop(columns=["Justificativa"], errors="ignore")
             results_mode.to_csv(f"{folder}/results_summary.csv", index=False)
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import numpy as np
+import pandas as pd
+
+from Modules.model_answer import modelAnswer
+
+NS = 1e9
+
+TELEMETRY_COLUMNS = ["Model", "Prompt", "ID", "run", "answer", "status", "total_duration", "load_duration", "prompt_eval_count",
+                     "prompt_eval_duration", "eval_count", "eval_duration", "wall_time", "ttft", "time_to_answer",
+                     "stopped_early", "hedged", "attempts"]
+
+def telemetry_frame(model_answers: list[modelAnswer]) -> pd.DataFrame:
+    """
+        Flattens the per-request telemetry of every answer into one row per request.
+        Answers without telemetry (cache hits, skipped runs) are left out.
+    """
+
+    rows = []
+    for model in model_answers:
+        store = model.store
+        # Only the slots holding telemetry are visited, in prompt/case/run order
+        for p, c, run in sorted(store.extras):
+            extra = store.extras[(p, c, run)]
+            telemetry = extra.get("telemetry")
+            if not telemetry or telemetry.get("wall_time") is None:
+                continue
+            rows.append({"Model": model.model, "Prompt": store.prompts[p], "ID": store.case_ids[c], "run": run,
+                         "answer": store.labels[store.codes[p, c, run]], "status": extra.get("status"), **telemetry})
+
+    return pd.DataFrame(rows, columns=TELEMETRY_COLUMNS)
+
+def records_telemetry_frame(records: list[dict]) -> pd.DataFrame:
+    """
+        Same as telemetry_frame, from the records of a resultSink (e.g. an earlier run directory).
+    """
+
+    # Last record of each (model, prompt, case, run) wins, as in the result store
+    latest = {(r["model"], r["prompt"], r["case"], r["run"]): r for r in records}
+    rows = [{"Model": r["model"], "Prompt": r["prompt"], "ID": r["case"], **r}
+            for r in latest.values() if r.get("wall_time") is not None]
+    return pd.DataFrame(rows, columns=TELEMETRY_COLUMNS)
+
+def telemetry_report(model_answers: list[modelAnswer], rag: bool = False) -> pd.DataFrame:
+    """
+        Summarises inference throughput and latency per model and prompt.
+
+        Columns: number of requests, generation and prompt-eval throughput (tokens/s over the
+        summed Ollama durations), p50/p95/p99 of the client wall-clock latency, the median time to
+        first token and to the complete answer with the fraction of requests cancelled right after
+        the answer (streaming mode only), the number of timed out and hedged requests, and the
+        mean load, prompt-eval and generation time per request, in seconds.
+    Args:
+        model_answers (list[modelAnswer]): Answers holding telemetry (see query_models).
+        rag (bool): Whether the prompts had RAG references; stored in the "RAG" column.
+    Returns:
+        pd.DataFrame: One row per model and prompt.
+    """
+
+    df = telemetry_frame(model_answers).drop(columns=["answer", "attempts"])
+    status = df.pop("status")
+    durations = ["total_duration", "load_duration", "prompt_eval_duration", "eval_duration"]
+    df[durations] = df[durations].astype(float) / NS
+
+    def median(values: pd.Series) -> float:
+        # Columns that only streaming fills (ttft, time_to_answer) are all missing otherwise
+        values = values.astype(float).dropna()
+        return values.median() if len(values) else np.nan
+
+    def summarise(group: pd.DataFrame) -> pd.Series:
+        wall = group["wall_time"].astype(float).dropna().values
+        p50, p95, p99 = np.percentile(wall, [50, 95, 99]) if len(wall) else (np.nan,) * 3
+        # Requests cancelled after the answer (streaming) have token counts but no Ollama durations
+        timed = group["eval_duration"].notna()
+        eval_s = group["eval_duration"].sum()
+        prompt_s = group["prompt_eval_duration"].sum()
+        return pd.Series({
+            "Requests": len(group),
+            "Tokens/s (geração)": group.loc[timed, "eval_count"].sum() / eval_s if eval_s else np.nan,
+            "Tokens/s (prompt)": group.loc[timed, "prompt_eval_count"].sum() / prompt_s if prompt_s else np.nan,
+            "Latência p50 (s)": p50,
+            "Latência p95 (s)": p95,
+            "Latência p99 (s)": p99,
+            "TTFT p50 (s)": median(group["ttft"]),
+            "Tempo até resposta p50 (s)": median(group["time_to_answer"]),
+            "Interrompidas após resposta": group["stopped_early"].astype("boolean").fillna(False).mean(),
+            "Timeouts": int((status[group.index] == "timeout").sum()),
+            "Hedged": int(group["hedged"].astype("boolean").fillna(False).sum()),
+            "Carga média (s)": group["load_duration"].mean(),
+            "Prompt eval médio (s)": group["prompt_eval_duration"].mean(),
+            "Geração média (s)": group["eval_duration"].mean(),
+            "Tokens gerados médios": group["eval_count"].mean(),
+        })
+
+    if df.empty:
+        report = pd.DataFrame(columns=["Model", "Prompt"])
+    else:
+        report = df.groupby(["Model", "Prompt"], sort=False)[df.columns[4:]].apply(summarise).reset_index()
+        report[["Requests", "Timeouts", "Hedged"]] = report[["Requests", "Timeouts", "Hedged"]].astype(int)
+
+    report.insert(2, "RAG", rag)
+    return report
+
+def save_telemetry_report(report: pd.DataFrame, path: str, filename: str = "inference_report.csv") -> pd.DataFrame:
+    """
+        Writes the report to `<path>/<filename>`. Rows of an existing report made with the other
+        RAG setting are kept, so runs with and without RAG can be compared in one file.
+    """
+
+    os.makedirs(path, exist_ok=True)
+    file_path = os.path.join(path, filename)
+
+    if os.path.exists(file_path) and len(report):
+        previous = pd.read_csv(file_path)
+        previous = previous[~previous["RAG"].isin(report["RAG"].unique())]
+        report = pd.concat([previous, report], ignore_index=True)
+
+    report.to_csv(file_path, index=False)
+    return report
+
+def generation_savings(current: pd.DataFrame, baseline: pd.DataFrame) -> pd.DataFrame:
+    """
+        Compares the generated-token volume, wall time and JSON failures of a run with a baseline
+        run (e.g. structured output vs. the free-text mode), per model and prompt.
+    Args:
+        current (pd.DataFrame): telemetry_frame of the run being evaluated.
+        baseline (pd.DataFrame): telemetry_frame (or records_telemetry_frame) of the baseline run.
+    Returns:
+        pd.DataFrame: Totals of both runs and the relative savings ("Economia") of the current one.
+    """
+
+    def totals(df: pd.DataFrame) -> pd.DataFrame:
+        df = df.assign(failed=(df["answer"] == "Failed JSON").astype(int), attempts=df["attempts"].fillna(1))
+        return df.groupby(["Model", "Prompt"]).agg(requests=("wall_time", "size"),
+                                                    tokens=("eval_count", "sum"),
+                                                    wall=("wall_time", "sum"),
+                                                    attempts=("attempts", "sum"),
+                                                    failed=("failed", "sum"))
+
+    both = totals(baseline).join(totals(current), how="inner", lsuffix="_base", rsuffix="_new")
+
+    savings = pd.DataFrame({
+        "Tokens gerados (base)": both["tokens_base"],
+        "Tokens gerados (novo)": both["tokens_new"],
+        "Economia de tokens": 1 - both["tokens_new"] / both["tokens_base"],
+        "Tempo total (base, s)": both["wall_base"],
+        "Tempo total (novo, s)": both["wall_new"],
+        "Economia de tempo": 1 - both["wall_new"] / both["wall_base"],
+        "Tokens por resposta (base)": both["tokens_base"] / both["requests_base"],
+        "Tokens por resposta (novo)": both["tokens_new"] / both["requests_new"],
+        "Tentativas (novo)": both["attempts_new"],
+        "Falhas JSON (base)": both["failed_base"] / both["requests_base"],
+        "Falhas JSON (novo)": both["failed_new"] / both["requests_new"],
+    })
+    return savings.reset_index()
@@ -0,0 +1,83 @@
+# Prompt assembly scaling: python benchmarks/bench_merge_information.py [--sizes 1000 10000 100000] [--prompts 1 3]
+#
+# Builds synthetic case tables by resampling test_cases_new.csv, times merge_information
+# (and its chunked generator) and checks that the prompts are identical to the original
+# row-by-row implementation, which is kept below as the reference.
+
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Modules.prompt_creation import merge_information, merge_information_chunks
+from Modules.table_processing import process_csv_table
+
+def merge_information_rowwise(prompts: pd.DataFrame, test_cases_df: pd.DataFrame):
+    # Implementation before the column-wise rewrite
+    case_ids = test_cases_df["ID"]
+    test_cases_df = test_cases_df.drop(columns=["ID"])
+
+    patient_info = ("".join([f"{col}: {row[col]}\n" for col in test_cases_df.columns if pd.notna(row[col])]) for _, row in test_cases_df.iterrows())
+    patient_info = pd.Series(patient_info)
+
+    result_df = pd.DataFrame()
+    for _, prompt_row in prompts.iterrows():
+        prompt_text = prompt_row["prompt_text"]
+        prompt_col = f"prompt_{prompt_row['id']}"
+
+        result_df[prompt_col] = [
+            f"{prompt_text} \n" +
+            "".join(patient_info[row]) for row in range(len(patient_info))]
+
+    return pd.concat([case_ids, result_df], axis=1), patient_info
+
+def synthetic_cases(n: int) -> pd.DataFrame:
+    info, _ = process_csv_table(pd.read_csv(os.path.join(ROOT, "test_cases_new.csv")))
+    cases = info.sample(n=n, replace=True, random_state=0).reset_index(drop=True)
+    cases["ID"] = range(1, n + 1)
+    return cases
+
+def synthetic_prompts(n: int) -> pd.DataFrame:
+    return pd.DataFrame([{"id": i + 1, "prompt_text": f"Prompt {i + 1}: classifique o paciente segundo o MTS."} for i in range(n)])
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt assembly for large case tables.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000], help="Number of cases.")
+    parser.add_argument("--prompts", nargs="+", type=int, default=[1, 3], help="Number of prompt variants.")
+    parser.add_argument("--chunksize", type=int, default=10000, help="Chunk size of the generator path.")
+    parser.add_argument("--skip-reference", action="store_true", help="Do not time the row-by-row reference (slow for large sizes).")
+    args = parser.parse_args()
+
+    rows = []
+    for size in args.sizes:
+        cases = synthetic_cases(size)
+        for n_prompts in args.prompts:
+            prompts = synthetic_prompts(n_prompts)
+
+            t_new, (new, _) = timed(merge_information, prompts, cases)
+            t_chunks, chunks = timed(lambda: [c for c, _ in merge_information_chunks(prompts, cases, args.chunksize)])
+            row = {"cases": size, "prompts": n_prompts, "columnwise (s)": t_new, "chunked (s)": t_chunks}
+
+            if not args.skip_reference:
+                t_old, (old, _) = timed(merge_information_rowwise, prompts, cases)
+                row["rowwise (s)"] = t_old
+                row["speedup"] = t_old / t_new
+                row["identical"] = old.equals(new) and pd.concat(chunks, ignore_index=True).equals(old)
+
+            rows.append(row)
+            print(row, flush=True)
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
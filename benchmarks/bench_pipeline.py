@@ -0,0 +1,189 @@
+# End-to-end throughput suite: python benchmarks/bench_pipeline.py [--sizes 50 200 1000] [--save-baseline]
+#
+# Runs the pipeline against the stand-in server of mock_ollama.py at several dataset sizes
+# (synthetic case tables resampled from test_cases_new.csv):
+#   prompts  merge_information + add_answering_rules, in process
+#   rag      add_document_references (only with --rag; needs sentence-transformers and faiss)
+#   script   script.py end to end in a child process: queries/s, p95 request latency (from its
+#            --event-log), peak RSS and bytes read/written by the process
+#   metrics  calculate_metrics over the answers stored by the script run
+#
+# Results are compared with benchmarks/baseline.json (exit code 1 when a metric regresses by more
+# than --tolerance); --save-baseline replaces it. Baselines are machine specific: regenerate it
+# on the machine the comparisons run on.
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.mock_ollama import start_server
+from benchmarks.bench_merge_information import synthetic_cases
+from Modules.prompt_creation import merge_information, add_answering_rules, add_document_references
+from Modules.result_store import read_records, model_answers_from_records
+from Modules.statistics import calculate_metrics
+
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+# metric -> True when higher is better
+METRICS = {"wall_s": False, "qps": True, "p95_s": False, "peak_rss_mb": False, "io_mb": False}
+
+# Runs script.py inside the child and reports its own peak RSS and I/O counters on exit
+PROBE = """
+import atexit, json, resource, runpy, sys
+sys.path.insert(0, {root!r})
+def report():
+    io = {{}}
+    try:
+        with open("/proc/self/io") as f:
+            io = dict((k, int(v)) for k, v in (line.split(": ") for line in f))
+    except OSError:
+        pass
+    sys.stderr.write("BENCH " + json.dumps({{"peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                            "rchar": io.get("rchar"), "wchar": io.get("wchar")}}) + "\\n")
+atexit.register(report)
+sys.argv = {argv!r}
+runpy.run_path({script!r}, run_name="__main__")
+"""
+
+def case_table(n: int) -> pd.DataFrame:
+    # synthetic_cases drops the answer columns; they are resampled the same way here
+    data = pd.read_csv(os.path.join(ROOT, "test_cases_new.csv"))
+    data = data.sample(n=n, replace=True, random_state=0).reset_index(drop=True)
+    data["ID"] = range(1, n + 1)
+    return data
+
+def bench_prompts(n: int, prompts: pd.DataFrame) -> dict:
+    cases = synthetic_cases(n)
+    start = time.perf_counter()
+    test_cases_prompts, _ = merge_information(prompts, cases)
+    add_answering_rules(test_cases_prompts)
+    wall = time.perf_counter() - start
+    return {"wall_s": wall, "qps": n * len(prompts) / wall}
+
+def bench_rag(n: int, prompts: pd.DataFrame) -> dict:
+    from Modules.rag import rag_agent
+
+    agent = rag_agent(protocol_text=open(os.path.join(ROOT, "protocolo_splits.txt"), encoding="utf-8").read(),
+                      cache_dir=os.path.join(ROOT, ".cache", "rag"))
+    test_cases_prompts, patient_info = merge_information(prompts, synthetic_cases(n))
+    start = time.perf_counter()
+    add_document_references(test_cases_prompts, agent, patient_info)
+    wall = time.perf_counter() - start
+    return {"wall_s": wall, "qps": n / wall}
+
+def bench_script(n: int, url: str, models: list[str], args) -> tuple:
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    data_path = os.path.join(workdir, "cases.csv")
+    case_table(n).to_csv(data_path, index=False)
+    out = os.path.join(workdir, "results")
+    event_log = os.path.join(workdir, "events.jsonl")
+
+    argv = ["script.py", "--data", data_path, "--models", *models, "--validation", str(args.validation),
+            "--prompts", *map(str, args.prompts), "--path_to_save", out, "--verbose", "0",
+            "--concurrency", str(args.concurrency), "--event-log", event_log, *shlex.split(args.script_args)]
+    probe = PROBE.format(root=ROOT, argv=argv, script=os.path.join(ROOT, "script.py"))
+
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", probe], cwd=workdir, env={**os.environ, "OLLAMA_HOST": url},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"script.py failed:\n{result.stderr[-2000:]}")
+
+    usage = json.loads([line for line in result.stderr.splitlines() if line.startswith("BENCH ")][-1][6:])
+    records = read_records(os.path.join(out, "responses.jsonl"))
+    # Request latencies come from the run's structured progress events
+    latencies = [e["wall_time"] for e in read_records(event_log) if e["event"] == "progress" and e.get("wall_time") is not None]
+    io = (usage["rchar"] or 0) + (usage["wchar"] or 0) if usage["rchar"] is not None else np.nan
+
+    row = {"wall_s": wall,
+           "qps": len(latencies) / wall,
+           "p95_s": float(np.percentile(latencies, 95)) if latencies else np.nan,
+           "peak_rss_mb": usage["peak_rss_kb"] / 1024,
+           "io_mb": io / 2**20}
+    return row, records
+
+def bench_metrics(n: int, records: list[dict], models: list[str], args) -> dict:
+    cases = case_table(n)
+    prompt_cols = [f"prompt_{p}" for p in args.prompts]
+
+    start = time.perf_counter()
+    model_results = model_answers_from_records(records, models, prompt_cols, cases["ID"].tolist(), args.validation, include_explanations=False)
+    calculate_metrics(model_results, cases[["ID", "Classificacao_Correta"]])
+    return {"wall_s": time.perf_counter() - start}
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for key, row in results.items():
+        for metric, higher_is_better in METRICS.items():
+            new, old = row.get(metric), baseline.get(key, {}).get(metric)
+            if new is None or old is None or not np.isfinite(new) or not np.isfinite(old) or old == 0:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{key} {metric}: {old:.4g} -> {new:.4g} ({change:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput benchmarks of the pipeline against a stand-in Ollama server.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[50, 200, 1000], help="Number of cases.")
+    parser.add_argument("--prompts", nargs="+", type=int, default=[1, 2], help="Prompt IDs of script.py to use.")
+    parser.add_argument("--models", type=int, default=2, help="Number of mock models.")
+    parser.add_argument("--validation", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=str, default="lognormal:0.02,0.5", help="Mock latency distribution (see mock_ollama.py).")
+    parser.add_argument("--tokens-per-sec", type=float, default=2000.0, help="Mock generation speed.")
+    parser.add_argument("--script-args", type=str, default="", help='Extra script.py arguments, e.g. "--stream --schedule".')
+    parser.add_argument("--rag", action="store_true", help="Also time the RAG augmentation.")
+    parser.add_argument("--skip-script", action="store_true", help="Only run the in-process benchmarks.")
+    parser.add_argument("--baseline", type=str, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative change counted as a regression.")
+    args = parser.parse_args()
+
+    models = [f"mock-{i}" for i in range(args.models)]
+    server, url, _ = start_server(models=models, latency=args.latency, tokens_per_sec=args.tokens_per_sec, seed=0)
+    prompts = pd.DataFrame([{"id": i, "prompt_text": f"Prompt {i}: classifique o paciente segundo o MTS."} for i in args.prompts])
+
+    results = {}
+    try:
+        for n in args.sizes:
+            results[f"prompts@{n}"] = bench_prompts(n, prompts)
+            if args.rag:
+                results[f"rag@{n}"] = bench_rag(n, prompts)
+            if not args.skip_script:
+                results[f"script@{n}"], records = bench_script(n, url, models, args)
+                results[f"metrics@{n}"] = bench_metrics(n, records, models, args)
+            for key in [k for k in results if k.endswith(f"@{n}")]:
+                print(key, {k: round(v, 4) for k, v in results[key].items()}, flush=True)
+    finally:
+        server.shutdown()
+
+    print(pd.DataFrame(results).T.to_string(float_format=lambda v: f"{v:.4g}"))
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
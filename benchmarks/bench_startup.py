@@ -0,0 +1,82 @@
+# Startup-time guard: python benchmarks/bench_startup.py [--runs 5] [--max-overhead 0.25] [--budget SECONDS]
+#
+# Each entry point is imported in a fresh interpreter and compared with the import time of the
+# third-party packages it cannot avoid (pandas, plus ollama for querying). The check fails
+# (exit code 1) when the project's own overhead on top of that floor grows past --max-overhead,
+# when the optional absolute --budget is exceeded, or when a heavy dependency the entry point
+# does not need (torch, sentence-transformers, faiss, sklearn) gets imported.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["torch", "sentence_transformers", "faiss", "sklearn"]
+
+# name -> (code under test, code importing only the unavoidable dependencies)
+ENTRY_POINTS = {
+    "Modules": ("import Modules", "import pandas"),
+    "reporting": ("import Modules.statistics, Modules.table_processing, Modules.result_store", "import pandas"),
+    "querying": ("import Modules.querie_exec, Modules.prompt_creation", "import pandas, ollama"),
+    "script.py --help": ("import sys, runpy; sys.argv = ['script.py', '--help']; runpy.run_path('script.py', run_name='__main__')",
+                         "import pandas"),
+}
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+try:
+    exec({code!r})
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+print(elapsed, ",".join(m for m in {heavy!r} if m in sys.modules), file=sys.stderr)
+"""
+
+def measure(code: str):
+    result = subprocess.run([sys.executable, "-c", PROBE.format(code=code, heavy=HEAVY_MODULES)],
+                            cwd=ROOT, capture_output=True, text=True)
+    last_line = result.stderr.strip().splitlines()[-1]
+    elapsed, _, loaded = last_line.partition(" ")
+    return float(elapsed), [m for m in loaded.split(",") if m]
+
+def median_time(code: str, runs: int):
+    timings = []
+    loaded = set()
+    for _ in range(runs):
+        elapsed, heavy = measure(code)
+        timings.append(elapsed)
+        loaded.update(heavy)
+    return statistics.median(timings), sorted(loaded)
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time regression check for the pipeline entry points.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per measurement.")
+    parser.add_argument("--max-overhead", type=float, default=0.25, help="Maximum time, in seconds, on top of the unavoidable imports.")
+    parser.add_argument("--budget", type=float, default=None, help="Optional maximum absolute median import time, in seconds.")
+    args = parser.parse_args()
+
+    failed = False
+    for name, (code, floor_code) in ENTRY_POINTS.items():
+        median, loaded = median_time(code, args.runs)
+        floor, _ = median_time(floor_code, args.runs)
+        overhead = median - floor
+
+        problems = []
+        if overhead > args.max_overhead:
+            problems.append(f"overhead over {args.max_overhead:.2f}s")
+        if args.budget is not None and median > args.budget:
+            problems.append(f"over budget {args.budget:.2f}s")
+        if loaded:
+            problems.append(f"heavy imports: {', '.join(loaded)}")
+        failed = failed or bool(problems)
+
+        print(f"{name:<18} {median:.3f}s (floor {floor:.3f}s, overhead {overhead:+.3f}s)  {'; '.join(problems) or 'ok'}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# Stand-in Ollama server: python benchmarks/mock_ollama.py [--port 11435] [--models mock-a mock-b] [--latency lognormal:0.5,0.4]
+#
+# Implements the endpoints the pipeline uses (/api/tags, /api/chat with and without streaming,
+# /api/generate for warm-ups/unloads, /api/version) with configurable behaviour, so query
+# throughput can be measured without real models:
+#   --latency           time before the first token: const:S, uniform:A,B or lognormal:MEDIAN,SIGMA (seconds)
+#   --tokens-per-sec    generation speed; the answer is sent token by token at this rate
+#   --failure-rate      fraction of requests answered with HTTP 500
+#   --malformed-rate    fraction of answers that are not valid JSON
+#   --load-delay        seconds to load a model that is not resident (reported as load_duration)
+#   --max-loaded        models resident at once; loading another one evicts the least recently used
+#
+# Point the pipeline at it with OLLAMA_HOST=http://127.0.0.1:<port> or --endpoints.
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COLORS = ["Vermelho", "Laranja", "Amarelo", "Verde", "Azul"]
+
+def parse_distribution(spec: str):
+    """
+        Parses "const:S", "uniform:A,B" or "lognormal:MEDIAN,SIGMA" into a sampler taking a random.Random.
+    """
+
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "const":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda rng: median * rng.lognormvariate(0, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+class mockConfig:
+    def __init__(self, models=("mock-a", "mock-b"), latency="const:0.05", tokens_per_sec=200.0, answer_tokens=40,
+                 failure_rate=0.0, malformed_rate=0.0, load_delay=0.0, max_loaded=0, seed=0):
+        self.models = list(models)
+        self.latency = parse_distribution(latency)
+        self.tokens_per_sec = tokens_per_sec
+        self.answer_tokens = answer_tokens
+        self.failure_rate = failure_rate
+        self.malformed_rate = malformed_rate
+        self.load_delay = load_delay
+        self.max_loaded = max_loaded
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.loaded = OrderedDict()
+        self.stats = {"requests": 0, "failures": 0, "malformed": 0, "loads": 0, "cancelled": 0}
+
+    def draw(self):
+        with self.lock:
+            return self.rng.random(), self.rng.random(), self.latency(self.rng)
+
+    def load(self, model: str) -> float:
+        """
+            Makes the model resident, returning the load delay paid (0 when it already was).
+        """
+
+        with self.lock:
+            if model in self.loaded:
+                self.loaded.move_to_end(model)
+                return 0.0
+            self.loaded[model] = True
+            if self.max_loaded and len(self.loaded) > self.max_loaded:
+                self.loaded.popitem(last=False)
+            self.stats["loads"] += 1
+        time.sleep(self.load_delay)
+        return self.load_delay
+
+    def unload(self, model: str):
+        with self.lock:
+            self.loaded.pop(model, None)
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+def answer_tokens(prompt: str, n_tokens: int, malformed: bool) -> list[str]:
+    # The colour depends only on the prompt, so repeated runs of a case agree
+    color = COLORS[int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16) % len(COLORS)]
+    filler = ["critério"] * max(n_tokens - 6, 0)
+    tokens = ['{"resposta": ', f'"{color}"', ', "explicacao": ', '"Classificado', " conforme", " o MTS:"] + [f" {w}" for w in filler] + ['"}']
+    if malformed:
+        tokens = [f"A classificação é {color}"] + [f" {w}" for w in filler]
+    return tokens
+
+def make_handler(config: mockConfig):
+
+    class handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, body: dict, status: int = 200):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self.send_json({"models": [{"name": m, "model": m, "digest": hashlib.sha256(m.encode()).hexdigest(), "size": 0} for m in config.models]})
+            elif self.path == "/api/version":
+                self.send_json({"version": "0.0.0-mock"})
+            else:
+                self.send_json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            model = request.get("model")
+            if model not in config.models:
+                return self.send_json({"error": f"model '{model}' not found"}, 404)
+
+            if self.path == "/api/generate":
+                # Usado só para carregar/descarregar modelos
+                if request.get("keep_alive") in (0, "0"):
+                    config.unload(model)
+                    load = 0.0
+                else:
+                    load = config.load(model)
+                return self.send_json({"model": model, "response": "", "done": True, "load_duration": int(load * 1e9), "total_duration": int(load * 1e9)})
+
+            if self.path != "/api/chat":
+                return self.send_json({"error": "not found"}, 404)
+
+            config.count("requests")
+            fail, malformed, latency = config.draw()
+            if fail < config.failure_rate:
+                config.count("failures")
+                return self.send_json({"error": "mock failure"}, 500)
+            malformed = malformed < config.malformed_rate
+            if malformed:
+                config.count("malformed")
+
+            start = time.perf_counter()
+            load = config.load(model)
+            prompt = request["messages"][-1]["content"]
+            time.sleep(latency)
+            prompt_eval = time.perf_counter() - start - load
+            tokens = answer_tokens(prompt, config.answer_tokens, malformed)
+
+            metrics = {"load_duration": int(load * 1e9), "prompt_eval_count": len(prompt) // 4,
+                       "prompt_eval_duration": int(prompt_eval * 1e9), "eval_count": len(tokens)}
+
+            if not request.get("stream", True):
+                time.sleep(len(tokens) / config.tokens_per_sec)
+                metrics["eval_duration"] = int(len(tokens) / config.tokens_per_sec * 1e9)
+                metrics["total_duration"] = int((time.perf_counter() - start) * 1e9)
+                return self.send_json({"model": model, "message": {"role": "assistant", "content": "".join(tokens)}, "done": True, **metrics})
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                gen_start = time.perf_counter()
+                for token in tokens:
+                    time.sleep(1 / config.tokens_per_sec)
+                    self.write_chunk({"model": model, "message": {"role": "assistant", "content": token}, "done": False})
+                metrics["eval_duration"] = int((time.perf_counter() - gen_start) * 1e9)
+                metrics["total_duration"] = int((time.perf_counter() - start) * 1e9)
+                self.write_chunk({"model": model, "message": {"role": "assistant", "content": ""}, "done": True, **metrics})
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # Cliente fechou o stream (resposta completa, timeout ou hedge)
+                config.count("cancelled")
+
+        def write_chunk(self, body: dict):
+            data = (json.dumps(body) + "\n").encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+    return handler
+
+class mockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is expected
+        pass
+
+def start_server(port: int = 0, **config) -> tuple:
+    """
+        Starts the stand-in server on a background thread.
+    Args:
+        port (int): Port to listen on; 0 picks a free one.
+        **config: mockConfig arguments.
+    Returns:
+        tuple: (server, url, mockConfig). Stop it with server.shutdown().
+    """
+
+    config = mockConfig(**config)
+    server = mockServer(("127.0.0.1", port), make_handler(config))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", config
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in Ollama server for benchmarks.")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", nargs="+", default=["mock-a", "mock-b"])
+    parser.add_argument("--latency", type=str, default="const:0.05", help="const:S, uniform:A,B or lognormal:MEDIAN,SIGMA (seconds).")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0)
+    parser.add_argument("--answer-tokens", type=int, default=40)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--load-delay", type=float, default=0.0)
+    parser.add_argument("--max-loaded", type=int, default=0, help="Models resident at once (0: unlimited).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server, url, config = start_server(args.port, models=args.models, latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+                                       answer_tokens=args.answer_tokens, failure_rate=args.failure_rate, malformed_rate=args.malformed_rate,
+                                       load_delay=args.load_delay, max_loaded=args.max_loaded, seed=args.seed)
+    print(f"Mock Ollama listening on {url} (models: {', '.join(args.models)})", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(config.stats)
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,46 @@
+import os
+import re
+import json
+import hashlib
 import pandas as pd
 import argparse
-
-from sklearn.metrics import confusion_matrix, precision_score, recall_score, f1_score, accuracy_score
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from Modules.statistics import triage_metrics
+from Modules.aggregation import aggregate_answers, MARGIN_MIN_RUNS, TIE_BREAKS
+
+MANIFEST = "report_manifest.json"
+# Tabelas combinadas de todos os modelos (nomes usados em final_results)
+COMBINED = "sumary_statistics_full.csv"
+COMBINED_PERCENT = "sumary_statistics_full_percent.csv"
+
+def table_answers(results, prompts_used, validation) -> tuple:
+    """
+        Answers of a full_responses.csv table as an array (cases, prompts, runs), with the prompt names.
+    """
 
-parser = argparse.ArgumentParser(description="Run the triage assessment tool.")
-parser.add_argument("--validation", type=int, default=1, help="Validation level")
-parser.add_argument("--data", type=str, help="Path to the test cases CSV file.")
-parser.add_argument("--results_path", type=str, help="Path to the results CSV file.")
-parser.add_argument("--results_filename", type=str, help="Name of the results CSV file.")
-parser.add_argument("--prompts-used", type=int, default=1, help="Number of prompts used")
-parser.add_argument("--model", type=str, help="Model name")
-args = parser.parse_args()
-
-def get_case_responses(results, prompts_used, validation, correct_answers: pd.DataFrame = None):
-    ids = results['ID']
-    results = results.drop(columns=['ID'])
+    # Respostas (casos x prompts x execuções), na ordem das colunas do full_responses.csv
+    answers = results.iloc[:, 1:1 + prompts_used * validation].to_numpy(dtype=object)
+    answers = answers.reshape(len(results), prompts_used, validation)
+    prompt_names = [results.columns[1 + i * validation][:-5] for i in range(prompts_used)]
+    return answers, prompt_names
+
+def get_case_responses(results, prompts_used, validation, correct_answers: pd.DataFrame = None, tie_break: str = "alphabetical"):
+    ids = results[['ID']].copy()
     prompt_results =[]
 
+    answers, _ = table_answers(results, prompts_used, validation)
+    mode, vote = aggregate_answers(answers.transpose(1, 0, 2), tie_break)
+
     for i in range(prompts_used):
-        prompt_answers = results.iloc[:, i*validation:i*validation+validation]
+        prompt_answers = results.iloc[:, 1 + i*validation:1 + i*validation+validation].copy()
         prompt_name = prompt_answers.columns[0][:-4]
-        #prompt_answers[f"{prompt_name}(moda)"] = prompt_answers.mode(axis=1)[0]
-        prompt_answers.loc[:, f"{prompt_name}(moda)"] = prompt_answers.mode(axis=1)[0]
-        ids = pd.concat([ids, prompt_answers[f"{prompt_name}(moda)"]], axis=1)
+        prompt_answers[f"{prompt_name}(moda)"] = mode[i]
+        ids[f"{prompt_name}(moda)"] = mode[i]
+        if validation >= MARGIN_MIN_RUNS:
+            prompt_answers[f"{prompt_name}(margem)"] = vote.margin[i]
+            ids[f"{prompt_name}(margem)"] = vote.margin[i]
         results_mode= pd.concat([ids["ID"], prompt_answers], axis=1)
 
         if correct_answers is not None:
@@ -32,122 +49,13 @@ def get_case_responses(results, prompts_used, validation, correct_answers: pd.Da
         prompt_results.append(results_mode)
     return ids, prompt_results
 
-def calcular_concordancia(respostas):
-    arr = np.asarray(respostas)
-    if arr.ndim != 2 or arr.shape[1] != 3:
-        raise ValueError("respostas must be a 2D array with 3 columns")
-    a, b, c = arr[:, 0], arr[:, 1], arr[:, 2]
-    eq_counts = (a == b).astype(int) + (b == c).astype(int) + (a == c).astype(int)
-    per_row_agreement = eq_counts / 3.0
-    return float(per_row_agreement.mean())
-
-def replace_colors(value):
-    color_map = {
-        'Vermelho': 5,
-        'Laranja': 4,
-        'Amarelo': 3,
-        'Verde': 2,
-        'Azul': 1,
-        'vermelho': 5,
-        'laranja': 4,
-        'amarelo': 3,
-        'verde': 2,
-        'azul': 1,
-        'Blue': 1,
-        'Green': 2,
-        'Yellow': 3,
-        'Orange': 4,
-        'Red': 5
-
-    }
-    return color_map[value]
-
-def calcula_acuracia_geral_por_prompt(y_true, y_pred):
-
-    arr = np.asarray(y_pred)
-    a, b, c = arr[:, 0], arr[:, 1], arr[:, 2]
-
-    correct_counts = ((a == y_true).astype(int) + (b == y_true).astype(int) + (c == y_true).astype(int))
-    total_predictions = arr.shape[0] * 3
-    accuracy = correct_counts.sum() / total_predictions
-    return accuracy
-
-def calcula_under_over_triage_geral(y_true, y_pred):
-
-    vfunc = np.vectorize(replace_colors)
-
-    arr = np.asarray(y_pred)
-    a, b, c = vfunc(arr[:, 0]), vfunc(arr[:, 1]), vfunc(arr[:, 2])
-    y_true_mapped = vfunc(np.asarray(y_true))
-
-    under_triage_counts = (((a < y_true_mapped).astype(int) + (b < y_true_mapped).astype(int) + (c < y_true_mapped).astype(int)))
-    over_triage_counts = (((a > y_true_mapped).astype(int) + (b > y_true_mapped).astype(int) + (c > y_true_mapped).astype(int)))
-    total_miss_predictions = (((a != y_true_mapped).astype(int) + (b != y_true_mapped).astype(int) + (c != y_true_mapped).astype(int))).sum()
-    under_triage_rate = under_triage_counts.sum() / total_miss_predictions
-    over_triage_rate = over_triage_counts.sum() / total_miss_predictions
-    return under_triage_rate, over_triage_rate
-
-def calcula_under_over_triage_mode(y_true, y_pred):
-
-    vfunc = np.vectorize(replace_colors)
-    arr = np.asarray(y_pred)
-    y_pred_mapped = vfunc(arr)
-    y_true_mapped = vfunc(np.asarray(y_true))
-
-    under_triage_counts = (((y_pred_mapped < y_true_mapped).astype(int)).sum())
-    over_triage_counts = (((y_pred_mapped > y_true_mapped).astype(int)).sum())
-    total_miss_predictions = (((y_pred_mapped != y_true_mapped).astype(int)).sum())
-    under_triage_rate = under_triage_counts / total_miss_predictions
-    over_triage_rate = over_triage_counts / total_miss_predictions
-    return under_triage_rate, over_triage_rate
-
-
-def calculate_metrics(model, results, prompts_used, validation, correct_df: pd.DataFrame) -> pd.DataFrame:
-	
-    accuracy_results = []
-
-    results_, _ = get_case_responses(results, prompts_used, validation)
-
-    for prompt in range(prompts_used):
-
-        #Estatísticas gerais
-        prompt_name = results_.columns[prompt+1][:-7]
-        y_true = correct_df['Classificacao_Correta'].values
-
-        accuracy_geral = calcula_acuracia_geral_por_prompt(y_true, results.iloc[:, (prompt*3)+1:(prompt*3)+4].values)
-        under_triage_rate, over_triage_rate = calcula_under_over_triage_geral(y_true, results.iloc[:, (prompt*3)+1:(prompt*3)+4].values)
-
-        # Estatísticas por moda
-        y_pred = results_.iloc[:, prompt+1].values
-        
-        n = results.iloc[:, (prompt*3)+1:(prompt*3)+4].values
-        concordancia = calcular_concordancia(n)
-
-        under_triage_mode, over_triage_mode = calcula_under_over_triage_mode(y_true, y_pred)
-
-        accuracy = accuracy_score(y_true, y_pred)
-        
-        precision = precision_score(y_true, y_pred, average='macro', zero_division=0)
-        recall = recall_score(y_true, y_pred, average='macro', zero_division=0)
-        f1 = f1_score(y_true, y_pred, average='macro', zero_division=0)
-        #conf_matrix = confusion_matrix(y_true, y_pred)
-
-        accuracy_results.append({
-            'Model': model,
-            'Prompt':prompt_name,
-            'Acurácia (moda)': accuracy,
-            'Precisão (moda)': precision,
-            'Recall (moda)': recall,
-            'F1 (moda)': f1,
-            'Under-triage (moda)': under_triage_mode,
-            'Over-triage (moda)': over_triage_mode,
-            'Concordância média': concordancia,
-            'Acurácia geral': accuracy_geral,
-            'Under-triage geral': under_triage_rate,
-            'Over-triage geral': over_triage_rate
-        })
-
-    results = pd.DataFrame(accuracy_results)
+def calculate_metrics(model, results, prompts_used, validation, correct_df: pd.DataFrame, tie_break: str = "alphabetical") -> pd.DataFrame:
+
+    answers, prompt_names = table_answers(results, prompts_used, validation)
+
+    y_true = correct_df['Classificacao_Correta'].values
+    results, _, _ = triage_metrics(answers[None], y_true, [model], prompt_names, tie_break)
+
     # add a total row averaging numeric/result columns
     numeric_cols = results.select_dtypes(include=[np.number]).columns
     if len(numeric_cols) > 0:
@@ -159,25 +67,223 @@ def calculate_metrics(model, results, prompts_used, validation, correct_df: pd.D
 
     return results
 
-table = pd.read_csv(f'{args.results_path}/{args.results_filename}')
-data = pd.read_csv(args.data)[["ID","Classificacao_Correta"]]
-
-x, y =get_case_responses(table, args.prompts_used, args.validation)
-a = pd.concat([x, data["Classificacao_Correta"]], axis=1)
-a.to_csv(f"{args.results_path}/results_summary.csv", index=False)
-
-summary= calculate_metrics(args.model, table, args.prompts_used, args.validation, data)
-
-print(summary)
-
-summary.to_csv(f"statistics.csv", index=False)
-
-summary = summary.round(4)
-# convert numeric columns to percentage strings
-numeric_cols = summary.select_dtypes(include=[np.number]).columns
-for col in numeric_cols:
-    summary[col] = summary[col].apply(lambda x: "" if pd.isna(x) else f"{x*100:.2f}%")
-summary.to_csv(f"statistics_percent.csv", index=False)
-print("Métricas calculadas e salvas com sucesso.")
-
-# uv run cal_statistics.py --data test_cases_new.csv --results_path ./ --results_filename full_responses.csv --model deepsseek --prompts-used 3 --validation 3
\ No newline at end of file
+def to_percent(summary: pd.DataFrame) -> pd.DataFrame:
+    summary = summary.round(4)
+    # convert numeric columns to percentage strings
+    numeric_cols = summary.select_dtypes(include=[np.number]).columns
+    for col in numeric_cols:
+        summary[col] = summary[col].apply(lambda x: "" if pd.isna(x) else f"{x*100:.2f}%")
+    return summary
+
+def answer_layout(columns) -> tuple:
+    """
+        Number of prompts and of runs of a full_responses.csv, from its "<prompt> (<run>x)" columns.
+    """
+
+    runs = [re.fullmatch(r"(.+) \((\d+)x\)", col) for col in columns]
+    runs = [m for m in runs if m]
+    prompts = list(dict.fromkeys(m.group(1) for m in runs))
+    validation = max((int(m.group(2)) for m in runs), default=0)
+    return len(prompts), validation
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def report_model(results_path: str, data_path: str, model: str = None, results_filename: str = "full_responses.csv",
+                 prompts_used: int = None, validation: int = None, tie_break: str = "alphabetical") -> pd.DataFrame:
+    """
+        Computes the metrics of one model and writes results_summary.csv, statistics.csv and
+        statistics_percent.csv next to its full_responses.csv.
+    Args:
+        results_path (str): Directory of the model's results.
+        data_path (str): Test cases CSV with ID and Classificacao_Correta.
+        model (str, optional): Model name. Defaults to the directory name.
+        results_filename (str): Answers file inside results_path.
+        prompts_used (int, optional): Number of prompts. Inferred from the answer columns when omitted.
+        validation (int, optional): Number of runs per prompt. Inferred from the answer columns when omitted.
+        tie_break (str): Tie-break policy of the majority answer.
+    Returns:
+        pd.DataFrame: The metrics, with a "Total (Média)" row.
+    """
+
+    model = model or os.path.basename(os.path.normpath(results_path))
+    table = pd.read_csv(os.path.join(results_path, results_filename))
+    inferred_prompts, inferred_validation = answer_layout(table.columns)
+    prompts_used = prompts_used or inferred_prompts
+    validation = validation or inferred_validation
+
+    # Respostas corretas na ordem dos casos da tabela
+    data = table[["ID"]].merge(pd.read_csv(data_path)[["ID", "Classificacao_Correta"]], on="ID", how="left")
+
+    x, _ = get_case_responses(table, prompts_used, validation, tie_break=tie_break)
+    x.merge(data, on="ID", how="left").to_csv(os.path.join(results_path, "results_summary.csv"), index=False)
+
+    summary = calculate_metrics(model, table, prompts_used, validation, data, tie_break)
+    summary.to_csv(os.path.join(results_path, "statistics.csv"), index=False)
+    to_percent(summary).to_csv(os.path.join(results_path, "statistics_percent.csv"), index=False)
+    return summary
+
+def _report_task(task: tuple) -> pd.DataFrame:
+    results_path, data_path, tie_break = task
+    return report_model(results_path, data_path, tie_break=tie_break)
+
+def model_directories(root: str) -> list[str]:
+    return sorted(entry.path for entry in os.scandir(root)
+                  if entry.is_dir() and os.path.exists(os.path.join(entry.path, "full_responses.csv")))
+
+def batch_report(root: str, data_path: str, tie_break: str = "alphabetical", workers: int = None, force: bool = False) -> pd.DataFrame:
+    """
+        Reports every model directory (holding a full_responses.csv) under `root` in a process pool
+        and merges their metrics into the combined tables of the root (COMBINED, COMBINED_PERCENT).
+
+        The inputs of each model (its full_responses.csv, the test cases and the tie-break policy)
+        are hashed into `<root>/report_manifest.json`; models whose inputs did not change since the
+        last report are not recomputed and their statistics.csv is reused.
+    Args:
+        root (str): Results root, e.g. final_results.
+        data_path (str): Test cases CSV with ID and Classificacao_Correta.
+        tie_break (str): Tie-break policy of the majority answer.
+        workers (int, optional): Processes of the pool. Defaults to the number of CPUs.
+        force (bool): Recompute every model.
+    Returns:
+        pd.DataFrame: The metrics of every model and prompt, followed by the "Todos (Média)" rows
+            averaging the models per prompt and overall.
+    """
+
+    model_dirs = model_directories(root)
+
+    manifest_path = os.path.join(root, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+
+    data_hash = file_hash(data_path)
+    hashes = {}
+    to_report = []
+    for model_dir in model_dirs:
+        model = os.path.basename(model_dir)
+        hashes[model] = hashlib.sha256(f"{file_hash(os.path.join(model_dir, 'full_responses.csv'))}:{data_hash}:{tie_break}".encode()).hexdigest()
+        up_to_date = manifest.get(model) == hashes[model] and os.path.exists(os.path.join(model_dir, "statistics.csv"))
+        if force or not up_to_date:
+            to_report.append(model_dir)
+
+    summaries = {}
+    if to_report:
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(to_report))) as pool:
+            for model_dir, summary in zip(to_report, pool.map(_report_task, [(d, data_path, tie_break) for d in to_report])):
+                summaries[os.path.basename(model_dir)] = summary
+                # O manifesto é atualizado a cada modelo, para não refazer os já concluídos se o lote for interrompido
+                manifest[os.path.basename(model_dir)] = hashes[os.path.basename(model_dir)]
+                with open(manifest_path, "w", encoding="utf-8") as f:
+                    json.dump(manifest, f, indent=2)
+
+    print(f"Reported {len(to_report)} of {len(model_dirs)} models ({len(model_dirs) - len(to_report)} unchanged).")
+
+    tables = []
+    for model_dir in model_dirs:
+        model = os.path.basename(model_dir)
+        summary = summaries.get(model)
+        if summary is None:
+            summary = pd.read_csv(os.path.join(model_dir, "statistics.csv"))
+        tables.append(summary[summary["Prompt"] != "Total (Média)"])
+
+    combined = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=["Model", "Prompt"])
+
+    # Médias entre os modelos, por prompt e geral
+    numeric_cols = combined.select_dtypes(include=[np.number]).columns
+    means = combined.groupby("Prompt", sort=False)[numeric_cols].mean().reset_index()
+    means.insert(0, "Model", "Todos (Média)")
+    overall = combined[numeric_cols].mean().to_frame().T.assign(Model="Todos (Média)", Prompt="Todos (Média)")
+    combined = pd.concat([combined, means, overall], ignore_index=True)[combined.columns] if len(combined) else combined
+    combined.to_csv(os.path.join(root, COMBINED), index=False, encoding="utf-8-sig")
+    to_percent(combined).to_csv(os.path.join(root, COMBINED_PERCENT), index=False, encoding="utf-8-sig")
+    return combined
+
+def significance_report(result_paths: list[str], data_path: str, path: str, n_resamples: int = 10000, n_permutations: int = 10000,
+                        tie_break: str = "alphabetical", workers: int = None, results_filename: str = "full_responses.csv", models: list[str] = None) -> tuple:
+    """
+        Bootstrap confidence intervals of every model and prompt, and paired permutation tests
+        between the models (same prompt) and between the prompts (same model), written to
+        `<path>/bootstrap_ci.csv` and `<path>/permutation_tests.csv`. See Modules/significance.py.
+    Args:
+        result_paths (list[str]): Model directories.
+        data_path (str): Test cases CSV with ID and Classificacao_Correta.
+        path (str): Directory of the output files.
+        n_resamples (int): Bootstrap replicates (0 skips the intervals).
+        n_permutations (int): Permutations of each test (0 skips the tests).
+        tie_break (str): Tie-break policy of the majority answer.
+        workers (int, optional): Processes used to compute the replicates.
+        results_filename (str): Answers file inside each model directory.
+        models (list[str], optional): Model names. Default to the directory names.
+    Returns:
+        tuple: (intervals DataFrame, tests DataFrame); None for a skipped part.
+    """
+
+    from Modules.significance import bootstrap_ci, permutation_tests
+
+    models = models or [os.path.basename(os.path.normpath(p)) for p in result_paths]
+    tables = [pd.read_csv(os.path.join(p, results_filename)) for p in result_paths]
+
+    # Casos na ordem da primeira tabela; os demais modelos são alinhados pelo ID
+    ids = tables[0]["ID"]
+    layouts = [answer_layout(table.columns) for table in tables]
+    if len(set(layouts)) > 1:
+        raise ValueError(f"The models have different prompts/runs: {dict(zip(models, layouts))}.")
+    prompts_used, validation = layouts[0]
+    answers = [table_answers(table.set_index("ID").reindex(ids).reset_index(), prompts_used, validation) for table in tables]
+    predictions = np.stack([a for a, _ in answers])
+    prompts = answers[0][1]
+    y_true = ids.to_frame().merge(pd.read_csv(data_path)[["ID", "Classificacao_Correta"]], on="ID", how="left")["Classificacao_Correta"].values
+
+    intervals = tests = None
+    if n_resamples:
+        intervals = bootstrap_ci(predictions, y_true, models, prompts, n_resamples, tie_break=tie_break, workers=workers)
+        intervals.to_csv(os.path.join(path, "bootstrap_ci.csv"), index=False, encoding="utf-8-sig")
+    if n_permutations:
+        tests = permutation_tests(predictions, y_true, models, prompts, n_permutations, tie_break=tie_break, workers=workers)
+        tests.to_csv(os.path.join(path, "permutation_tests.csv"), index=False, encoding="utf-8-sig")
+    return intervals, tests
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the triage assessment tool.")
+    parser.add_argument("--validation", type=int, default=None, help="Validation level (inferred from the answer columns when omitted)")
+    parser.add_argument("--data", type=str, help="Path to the test cases CSV file.")
+    parser.add_argument("--results_path", type=str, help="Path to the results CSV file.")
+    parser.add_argument("--results_filename", type=str, default="full_responses.csv", help="Name of the results CSV file.")
+    parser.add_argument("--prompts-used", type=int, default=None, help="Number of prompts used (inferred from the answer columns when omitted)")
+    parser.add_argument("--model", type=str, help="Model name")
+    parser.add_argument("--tie-break", type=str, choices=TIE_BREAKS, default="alphabetical", help="How ties of the majority answer are broken.")
+    parser.add_argument("--results-root", type=str, default=None, help="Report every model directory under this root in parallel and write the combined summary tables there.")
+    parser.add_argument("--workers", type=int, default=None, help="Processes used with --results-root (defaults to the number of CPUs).")
+    parser.add_argument("--force", action="store_true", help="With --results-root, recompute models whose inputs did not change.")
+    parser.add_argument("--bootstrap", type=int, default=0, help="Bootstrap replicates for the confidence intervals of the metrics (0 disables), written to bootstrap_ci.csv.")
+    parser.add_argument("--permutations", type=int, default=0, help="Permutations of the paired tests between models and prompts (0 disables), written to permutation_tests.csv.")
+    args = parser.parse_args()
+
+    if args.results_root:
+        summary = batch_report(args.results_root, args.data, args.tie_break, args.workers, args.force)
+        result_paths, path, models = model_directories(args.results_root), args.results_root, None
+    else:
+        summary = report_model(args.results_path, args.data, args.model, args.results_filename, args.prompts_used, args.validation, args.tie_break)
+        result_paths, path, models = [args.results_path], args.results_path, [args.model] if args.model else None
+
+    print(summary)
+
+    if args.bootstrap or args.permutations:
+        intervals, tests = significance_report(result_paths, args.data, path, args.bootstrap, args.permutations, args.tie_break, args.workers,
+                                               "full_responses.csv" if args.results_root else args.results_filename, models)
+        for table in (intervals, tests):
+            if table is not None:
+                print(table)
+    print("Métricas calculadas e salvas com sucesso.")
+
+if __name__ == "__main__":
+    main()
+
+# uv run cal_statistics.py --data test_cases_new.csv --results_path ./ --results_filename full_responses.csv --model deepsseek --prompts-used 3 --validation 3
+# uv run cal_statistics.py --data test_cases_new.csv --results-root final_results --bootstrap 10000 --permutations 10000
@@ -3,64 +3,52 @@
 
 import pandas as pd
 from Modules.table_processing import process_csv_table, save_results_to_csv
-from Modules.querie_exec import query_models, get_ollama_models
+from Modules.response_cache import responseCache
 from Modules.prompt_creation import add_document_references, merge_information, add_answering_rules
 from Modules.statistics import calculate_metrics
+from Modules.aggregation import TIE_BREAKS
+from Modules.telemetry import telemetry_report, save_telemetry_report, telemetry_frame, records_telemetry_frame, generation_savings
+from Modules.result_store import read_records
+from Modules.progress import progressReporter
+from Modules import profiling
+from Modules.profiling import span
+from Modules.pipeline import iter_case_chunks, iter_prompt_chunks, run_streaming
+from Modules.pretriage import apply_rules, pretriage_report
 import argparse
 import os
-from tqdm import tqdm
-import time
-from Modules.rag import rag_agent
 
-def check_params(args):
+def check_params(args, endpoints=None):
     if args.validation < 1:
         raise ValueError("Validation level must be at least 1.")
+    if args.adaptive_threshold is not None and not 0 < args.adaptive_threshold <= 1:
+        raise ValueError("Adaptive threshold must be in (0, 1].")
+    if args.chunksize < 0:
+        raise ValueError("Chunk size must be positive (0 disables chunking).")
+    if args.concurrency is not None and args.concurrency < 1:
+        raise ValueError("Concurrency must be at least 1.")
+    if args.model_concurrency is not None and args.model_concurrency < 1:
+        raise ValueError("Model concurrency must be at least 1.")
+    if args.num_predict is not None and args.num_predict < 1:
+        raise ValueError("num_predict must be at least 1.")
+    if args.timeout is not None and args.timeout <= 0:
+        raise ValueError("Timeout must be positive.")
+    if args.hedge_after is not None and not 0 < args.hedge_after < 100:
+        raise ValueError("Hedging percentile must be in (0, 100).")
+    if args.pretriage == "route" and not args.pretriage_model:
+        raise ValueError("--pretriage route requires --pretriage-model.")
+    if args.json_retries < 0:
+        raise ValueError("JSON retries must be zero or more.")
+    if args.compare_with and not os.path.exists(os.path.join(args.compare_with, "responses.jsonl")):
+        raise ValueError(f"No responses.jsonl found in {args.compare_with}.")
     if args.verbose < 0 or args.verbose > 4:
         raise ValueError("Verbosity level must be between 0 and 4.")
-    available_models = get_ollama_models()
-    for model in args.models:
+    if endpoints is not None and not endpoints.capacity:
+        raise ValueError(f"None of the Ollama endpoints is reachable: {[e.host for e in endpoints.endpoints]}")
+    available_models = endpoints.models() if endpoints else get_ollama_models()
+    for model in (args.models or []) + ([args.pretriage_model] if args.pretriage == "route" else []):
         if model not in available_models and model != "Todos":
             raise ValueError(f"Model {model} is not available. Choose from {available_models} or 'Todos'.")
         
-def progress_check(current_case, total_cases, messages):
-    global _progress_bar, _progress_start_time
-    os.system("cls" if os.name == "nt" else "clear")
-
-    try:
-        _progress_bar
-    except NameError:
-        _progress_bar = None
-    try:
-        _progress_start_time
-    except NameError:
-        _progress_start_time = None
-
-    # Close and recreate if total changed (to avoid mismatched totals)
-    if _progress_bar is None or getattr(_progress_bar, "total", None) != total_cases:
-        if _progress_bar is not None:
-            try:
-                _progress_bar.close()
-            except Exception:
-                pass
-        _progress_bar = tqdm(
-            total=total_cases,
-            desc="Processing",
-            bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [elapsed: {elapsed}]",
-            position=0,
-            leave=True,
-            miniters=1,
-        )
-        _progress_start_time = time.time()
-
-    # Update elapsed time and render the progress bar first so it stays above subsequent prints
-    elapsed = time.time() - _progress_start_time if _progress_start_time is not None else 0
-    _progress_bar.n = current_case - 1
-    _progress_bar.refresh()
-
-    # Print messages using plain print so they appear below the bar
-    for message in messages:
-        print(str(message), flush=True)
-
 # Argument parsing
 parser = argparse.ArgumentParser(description="Run the triage assessment tool.")
 parser.add_argument("--data", type=str, default="test_cases.csv", help="Path to the test cases CSV file.")
@@ -69,14 +57,49 @@ parser.add_argument("--validation", type=int, default=1, help="Validation level.
 parser.add_argument("--verbose", type=int, default=3, help="Verbosity level.")
 parser.add_argument("--prompts", nargs= '+', type= int, default = 0, help="Prompt to be used (ID). 0 for all prompts")
 parser.add_argument("--path_to_save", type=str, default='./logs', help="Path to save the responses.")
-parser.add_argument("--check-progress", action="store_true", help="Enable progress checking.")
+parser.add_argument("--check-progress", action="store_true", help="Show a progress display (throughput, ETA and the latest messages) instead of the log.")
+parser.add_argument("--profile", nargs="*", choices=["cprofile", "memory"], default=None, help="Time the pipeline stages and write profile_trace.json (Chrome trace) and profile_summary.csv to --path_to_save. Add cprofile and/or memory for cProfile and tracemalloc reports.")
+parser.add_argument("--event-log", type=str, default=None, help="Append the run's structured events (one JSON per line) to this file.")
 parser.add_argument("--rag", action="store_true", help="Enable RAG functionality.")
+parser.add_argument("--rag-cache", type=str, default="./.cache/rag", help="Directory where the RAG index (chunk embeddings) is saved and reused.")
+parser.add_argument("--concurrency", type=int, default=None, help="Maximum number of parallel requests to Ollama (1 runs serially). Defaults to 1, or to the summed capacity of --endpoints.")
+parser.add_argument("--model-concurrency", type=int, default=None, help="Maximum number of parallel requests per model. Defaults to --concurrency.")
+parser.add_argument("--endpoints", nargs='+', type=str, default=None, help="Ollama hosts to balance the requests across, as URL[=max_concurrency] (e.g. http://box1:11434=4).")
+parser.add_argument("--endpoint-concurrency", type=int, default=1, help="Maximum number of parallel requests per endpoint when not given in --endpoints.")
+parser.add_argument("--timeout", type=float, default=None, help="Deadline of each request, in seconds. Requests past it are cancelled and recorded as Timeout.")
+parser.add_argument("--hedge-after", type=float, default=None, help="Send a duplicate of a request still running after this percentile (0-100) of its model's latencies; the first answer wins. Needs --concurrency > 1.")
+parser.add_argument("--resume", action="store_true", help="Resume an interrupted run from the answers stored in --path_to_save.")
+parser.add_argument("--schedule", action="store_true", help="Model-aware scheduling: one model at a time, pre-warming the next one while the current drains.")
+parser.add_argument("--keep-alive", type=str, default="10m", help="keep_alive sent with every request when --schedule is on (e.g. 10m, 1h, -1).")
+parser.add_argument("--unload-finished", action="store_true", help="With --schedule, unload each model as soon as its work is done.")
+parser.add_argument("--adaptive", action="store_true", help="Stop sampling a case once more validation runs can no longer change its majority answer.")
+parser.add_argument("--adaptive-threshold", type=float, default=None, help="With --adaptive, also stop once the leading answer has this fraction of the --validation runs.")
+parser.add_argument("--tie-break", type=str, choices=TIE_BREAKS, default="alphabetical", help="How ties of the majority answer are broken: alphabetical (legacy), most_urgent, least_urgent or first_run.")
+parser.add_argument("--pretriage", type=str, choices=["skip", "route"], default=None, help="Flag the cases whose MTS category is fixed by the vital-sign discriminators: skip answers them with the rule, route sends them once to --pretriage-model for all models. Writes pretriage_report.csv.")
+parser.add_argument("--pretriage-accept", nargs="+", choices=["Vermelho", "Laranja"], default=["Vermelho"], help="Rule categories taken as fixed by --pretriage. Laranja rules only see the vital signs and are a lower bound, so they are opt-in.")
+parser.add_argument("--pretriage-model", type=str, default=None, help="Cheap model that answers the flagged cases with --pretriage route.")
+parser.add_argument("--chunksize", type=int, default=0, help="Read, build and query the cases in chunks of this many rows (0 loads the whole file).")
+parser.add_argument("--structured", action="store_true", help="Constrain the answers to the JSON schema of the expected answer (Ollama structured outputs).")
+parser.add_argument("--no-think", action="store_true", help="Disable the reasoning trace of thinking models (think=False).")
+parser.add_argument("--num-predict", type=int, default=None, help="Maximum number of tokens generated per answer.")
+parser.add_argument("--stream", action="store_true", help="Stream the answers and stop each generation as soon as the answer JSON object is complete.")
+parser.add_argument("--json-retries", type=int, default=0, help="Retry an answer up to this many times when its JSON cannot be parsed.")
+parser.add_argument("--compare-with", type=str, default=None, help="Earlier run directory (with responses.jsonl) to compare generated tokens, time and JSON failures against.")
+parser.add_argument("--cache", type=str, default=None, help="Path of the on-disk response cache (SQLite). Disabled when omitted.")
+parser.add_argument("--cache-size-mb", type=float, default=512, help="Maximum size of the response cache before least recently used entries are evicted.")
 args = parser.parse_args()
 
-check_params(args)
+if args.profile is not None:
+    profiling.enable(cprofile="cprofile" in args.profile, memory="memory" in args.profile)
 
-data = pd.read_csv(args.data)
-info, correct_answers = process_csv_table(data)
+# Cliente do Ollama (ollama/httpx) só é carregado depois dos argumentos: --help e erros de parâmetro não pagam por ele
+from Modules.querie_exec import query_models, get_ollama_models
+from Modules.scheduler import modelScheduler
+from Modules.endpoints import endpointPool
+
+endpoints = endpointPool(args.endpoints, max_concurrency=args.endpoint_concurrency, timeout=args.timeout) if args.endpoints else None
+check_params(args, endpoints)
+concurrency = args.concurrency or (endpoints.capacity if endpoints else 1)
 
 print("Iniciando processamento...")
 prompts = pd.DataFrame([
@@ -104,36 +127,156 @@ if (args.prompts):
     prompts = prompts[prompts["id"].isin(args.prompts)]
 
 if args.rag:
+    from Modules.rag import rag_agent
     try:
-        rag_agent_instance = rag_agent(protocol_text=open("protocolo_splits.txt", "r", encoding="utf-8").read())
+        with span("rag_agent"):
+            rag_agent_instance = rag_agent(protocol_text=open("protocolo_splits.txt", "r", encoding="utf-8").read(), cache_dir=args.rag_cache)
     except Exception as e:
         raise RuntimeError(f"Failed to initialize RAG agent: {e}")
 
-test_cases_prompts, patient_info = merge_information(prompts, info)
+verbose= args.verbose
+progress = progressReporter(render=args.check_progress, event_log=args.event_log) if args.check_progress or args.event_log else None
+if args.check_progress:
+    verbose=0
 
-# Adicionar RAG
-if args.rag:
-    test_cases_prompts = add_document_references(test_cases_prompts, rag_agent_instance, patient_info)
+cache = responseCache(args.cache, max_size_mb=args.cache_size_mb) if args.cache else None
+scheduler = modelScheduler(keep_alive=args.keep_alive, unload_finished=args.unload_finished, endpoints=endpoints) if args.schedule else None
+options = {"num_predict": args.num_predict} if args.num_predict else None
+think = False if args.no_think else None
+
+pretriage = None
+if args.chunksize:
+    # Casos lidos, aumentados e enviados chunk a chunk; as respostas vão direto para o sink
+    models = (endpoints.models() if endpoints else get_ollama_models()) if args.models is None or args.models == ["Todos"] else args.models
+    if args.pretriage:
+        # Só ID, categoria e motivo de cada caso ficam em memória
+        with span("apply_rules"):
+            pretriage = pd.concat([apply_rules(info, accept=args.pretriage_accept) for info, _ in iter_case_chunks(args.data, args.chunksize)], ignore_index=True)
+    if progress:
+        # Total conhecido de antemão: casos x prompts x execuções x modelos
+        n_cases = len(pretriage) if pretriage is not None else sum(len(chunk) for chunk in pd.read_csv(args.data, usecols=[0], chunksize=args.chunksize))
+        progress.set_total(n_cases * len(prompts) * args.validation * len(models))
+    prompt_chunks = iter_prompt_chunks(iter_case_chunks(args.data, args.chunksize),
+                                       prompts,
+                                       rag_agent_instance if args.rag else None,
+                                       prompts_path="test_cases_prompts_final.csv")
+
+    model_results, correct_answers = run_streaming(prompt_chunks,
+                                                   models,
+                                                   args.path_to_save,
+                                                   validation=args.validation,
+                                                   resume=args.resume,
+                                                   verbose=verbose,
+                                                   concurrency=concurrency,
+                                                   model_concurrency=args.model_concurrency,
+                                                   cache=cache,
+                                                   adaptive=args.adaptive,
+                                                   adaptive_threshold=args.adaptive_threshold,
+                                                   scheduler=scheduler,
+                                                   options=options,
+                                                   structured=args.structured,
+                                                   think=think,
+                                                   json_retries=args.json_retries,
+                                                   stream=args.stream,
+                                                   endpoints=endpoints,
+                                                   timeout=args.timeout,
+                                                   hedge_after=args.hedge_after,
+                                                   progress=progress,
+                                                   pretriage=pretriage,
+                                                   route_model=args.pretriage_model if args.pretriage == "route" else None
+                                                   )
+else:
+    with span("read_csv"):
+        data = pd.read_csv(args.data)
+    with span("process_csv_table"):
+        info, correct_answers = process_csv_table(data)
+
+    if args.pretriage:
+        with span("apply_rules"):
+            pretriage = apply_rules(info, accept=args.pretriage_accept)
+
+    with span("merge_information"):
+        test_cases_prompts, patient_info = merge_information(prompts, info)
+
+    # Adicionar RAG
+    if args.rag:
+        with span("add_document_references"):
+            test_cases_prompts = add_document_references(test_cases_prompts, rag_agent_instance, patient_info)
+
+    with span("add_answering_rules"):
+        test_cases_prompts = add_answering_rules(test_cases_prompts)
+
+    with span("write_prompts_csv"):
+        test_cases_prompts.to_csv("test_cases_prompts_final.csv", index=False)
+
+    with span("query_models"):
+        model_results = query_models(test_cases_prompts,
+                             validation=args.validation, 
+                             model=args.models,
+                             verbose=verbose,
+                             path_to_save=args.path_to_save,
+                             concurrency=concurrency,
+                             model_concurrency=args.model_concurrency,
+                             resume=args.resume,
+                             cache=cache,
+                             adaptive=args.adaptive,
+                             adaptive_threshold=args.adaptive_threshold,
+                             scheduler=scheduler,
+                             options=options,
+                             structured=args.structured,
+                             think=think,
+                             json_retries=args.json_retries,
+                             stream=args.stream,
+                             endpoints=endpoints,
+                             timeout=args.timeout,
+                             hedge_after=args.hedge_after,
+                             progress=progress,
+                             pretriage=pretriage,
+                             route_model=args.pretriage_model if args.pretriage == "route" else None
+                             )
+
+if progress:
+    progress.close()
+
+if cache:
+    print("Response cache:", cache.stats())
+    cache.close()
 
-test_cases_prompts = add_answering_rules(test_cases_prompts)
+if endpoints:
+    print(pd.DataFrame(endpoints.stats()))
 
-test_cases_prompts.to_csv("test_cases_prompts_final.csv", index=False)
+if scheduler:
+    scheduler_report = scheduler.report()
+    print(scheduler_report)
+    os.makedirs(args.path_to_save, exist_ok=True)
+    scheduler_report.to_csv(f"{args.path_to_save}/scheduler_report.csv", index=False)
 
-# verbose= args.verbose
-# if args.check_progress:
-#     query_models.progress_callback = progress_check
-#     verbose=0
+with span("save_results_to_csv"):
+    save_results_to_csv(model_results, correct_answers=correct_answers, path=args.path_to_save, tie_break=args.tie_break)
 
-# model_results = query_models(test_cases_prompts, 
-#                        validation=args.validation, 
-#                        model=args.models,
-#                        verbose=verbose,
-#                        path_to_save=args.path_to_save
-#                        )
+with span("telemetry_report"):
+    inference_report = save_telemetry_report(telemetry_report(model_results, rag=args.rag), args.path_to_save)
+print(inference_report)
 
-# save_results_to_csv(model_results, correct_answers=correct_answers, path=args.path_to_save)
+if pretriage is not None:
+    rule_report = pretriage_report(pretriage, correct_answers, [m.model for m in model_results], len(prompts), args.validation,
+                                   route_model=args.pretriage_model if args.pretriage == "route" else None)
+    os.makedirs(args.path_to_save, exist_ok=True)
+    rule_report.to_csv(f"{args.path_to_save}/pretriage_report.csv", index=False)
+    print(rule_report)
 
-# summary= calculate_metrics(model_results, correct_answers)
-# print(summary)
+if args.compare_with:
+    savings = generation_savings(telemetry_frame(model_results),
+                                 records_telemetry_frame(read_records(os.path.join(args.compare_with, "responses.jsonl"))))
+    savings.to_csv(f"{args.path_to_save}/generation_savings.csv", index=False)
+    print(savings)
 
+with span("calculate_metrics"):
+    summary= calculate_metrics(model_results, correct_answers, tie_break=args.tie_break)
+print(summary)
 
+if args.profile is not None:
+    profiler = profiling.disable()
+    files = profiler.write(args.path_to_save)
+    print(profiler.summary().to_string(index=False))
+    print("Profile written to", ", ".join(files.values()))
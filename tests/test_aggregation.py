@@ -0,0 +1,77 @@
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Modules.aggregation import MTS_LABELS, TIE_BREAKS, aggregate_answers, encode_answers, majority_vote, normalize_label
+
+def reference_vote(answers: list, tie_break: str):
+    # Row-by-row majority vote, as the pandas version did before the vectorized one
+    votes = [normalize_label(a) for a in answers]
+    votes = [v for v in votes if v is not None]
+    if not votes:
+        return None, 0
+    counts = Counter(votes)
+    top = max(counts.values())
+    tied = [label for label in counts if counts[label] == top]
+    if tie_break == "alphabetical":
+        winner = min(tied)
+    elif tie_break == "most_urgent":
+        winner = min(tied, key=MTS_LABELS.index)
+    elif tie_break == "least_urgent":
+        winner = max(tied, key=MTS_LABELS.index)
+    else:
+        winner = next(v for v in votes if v in tied)
+    runner_up = sorted(counts.values())[-2] if len(counts) > 1 else 0
+    return winner, top - runner_up
+
+def test_normalize_label():
+    assert normalize_label(" vermelho ") == "Vermelho"
+    assert normalize_label("Red") == "Vermelho"
+    assert normalize_label("AZUL") == "Azul"
+    assert normalize_label("Failed JSON") is None
+    assert normalize_label(None) is None
+    assert normalize_label(float("nan")) is None
+
+def test_encode_answers():
+    codes = encode_answers(np.array([["Vermelho", "blue"], [None, "Timeout"]], dtype=object))
+    assert codes.tolist() == [[0, 4], [-1, -1]]
+
+@pytest.mark.parametrize("tie_break", TIE_BREAKS)
+def test_majority_vote_matches_reference(tie_break):
+    rng = np.random.default_rng(0)
+    pool = np.array(list(MTS_LABELS) + ["verde", "Red", "Failed JSON", "Timeout", None], dtype=object)
+    answers = pool[rng.integers(0, len(pool), size=(40, 3, 4))]
+
+    mode, vote = aggregate_answers(answers, tie_break)
+    for index in np.ndindex(answers.shape[:-1]):
+        winner, margin = reference_vote(list(answers[index]), tie_break)
+        assert mode[index] == winner
+        if winner is not None:
+            assert vote.margin[index] == margin
+
+def test_majority_vote_counts():
+    codes = np.array([[0, 0, 1, -1], [2, 3, 3, 2], [-1, -1, -1, -1]])
+    vote = majority_vote(codes, len(MTS_LABELS), "most_urgent")
+
+    assert vote.mode.tolist() == [0, 2, -1]
+    assert vote.votes.tolist() == [2, 2, 0]
+    assert vote.margin.tolist() == [1, 0, 0]
+    assert vote.n_votes.tolist() == [3, 4, 0]
+    assert vote.tied.tolist() == [False, True, False]
+
+def test_tie_breaks_differ_on_ties():
+    codes = np.array([[3, 1, 1, 3]])
+    assert majority_vote(codes, len(MTS_LABELS), "most_urgent").mode[0] == 1
+    assert majority_vote(codes, len(MTS_LABELS), "least_urgent").mode[0] == 3
+    assert majority_vote(codes, len(MTS_LABELS), "first_run").mode[0] == 3
+    # "Laranja" < "Verde"
+    assert majority_vote(codes, len(MTS_LABELS), "alphabetical").mode[0] == 1
+
+def test_unknown_tie_break():
+    with pytest.raises(ValueError):
+        majority_vote(np.zeros((1, 2), dtype=int), len(MTS_LABELS), "random")
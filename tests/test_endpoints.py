@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_ollama import start_server
+from Modules.endpoints import endpointPool, noHostAvailable
+from Modules.querie_exec import requestTimeout
+
+MESSAGES = [{"role": "user", "content": "Paciente com dor torácica."}]
+
+@pytest.fixture
+def servers(request):
+    # Two stand-in hosts; a test can pass the mockConfig arguments of each through indirect parametrization
+    configs = getattr(request, "param", ({}, {}))
+    started = [start_server(port=0, latency="const:0.01", **config) for config in configs]
+    yield started
+    for server, _, _ in started:
+        server.shutdown()
+        server.server_close()
+
+def chat(client):
+    return client.chat(model="mock-a", messages=MESSAGES, stream=False).message.content
+
+def chat_through(pool: endpointPool) -> str:
+    return pool.call("mock-a", chat)
+
+def test_requests_go_to_the_least_loaded_host(servers):
+    pool = endpointPool([f"{url}=2" for _, url, _ in servers])
+
+    acquired = [pool.acquire("mock-a") for _ in range(4)]
+    assert [pool.endpoints.index(e) for e in acquired] == [0, 1, 0, 1]
+    assert [e.outstanding for e in pool.endpoints] == [2, 2]
+
+    pool.release(acquired[1])
+    acquired[1] = pool.acquire("mock-a")
+    assert acquired[1] is pool.endpoints[1]
+    for endpoint in acquired:
+        pool.release(endpoint)
+    assert [e.requests for e in pool.endpoints] == [2, 3]
+
+def test_a_failed_host_is_checked_again_after_the_cooldown(servers):
+    pool = endpointPool([url for _, url, _ in servers], cooldown=0.05)
+
+    endpoint = pool.acquire("mock-a")
+    pool.release(endpoint, failed=True)
+    assert not endpoint.healthy and endpoint.failures == 1
+
+    # While it is down (and within the cooldown), requests go to the other host
+    other = pool.acquire("mock-a")
+    assert other is not endpoint
+    pool.release(other)
+
+    time.sleep(0.1)
+    pool.release(pool.acquire("mock-a"))  # starts the health check of the failed host
+    deadline = time.monotonic() + 5
+    while not endpoint.healthy and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert endpoint.healthy and not endpoint.checking
+
+@pytest.mark.parametrize("servers", [({"failure_rate": 1.0}, {})], indirect=True)
+def test_a_request_fails_over_to_another_host(servers):
+    pool = endpointPool([url for _, url, _ in servers])
+
+    assert chat_through(pool)
+    failed, other = pool.endpoints
+    assert not failed.healthy and failed.failures == 1
+    assert other.healthy and other.requests == 1
+    assert [e.outstanding for e in pool.endpoints] == [0, 0]
+
+def test_an_unreachable_host_fails_over(servers):
+    pool = endpointPool([url for _, url, _ in servers])
+    servers[0][0].shutdown()
+    servers[0][0].server_close()
+
+    assert chat_through(pool)
+    assert not pool.endpoints[0].healthy and pool.endpoints[1].requests == 1
+
+@pytest.mark.parametrize("servers", [({"failure_rate": 1.0}, {"failure_rate": 1.0})], indirect=True)
+def test_no_host_left_raises(servers):
+    pool = endpointPool([url for _, url, _ in servers])
+
+    with pytest.raises(noHostAvailable):
+        chat_through(pool)
+    assert all(not e.healthy and e.failures == 1 and e.outstanding == 0 for e in pool.endpoints)
+
+def test_a_timeout_does_not_mark_the_host_down(servers):
+    pool = endpointPool([url for _, url, _ in servers])
+
+    def slow(client):
+        chat(client)
+        raise requestTimeout("deadline missed")
+
+    with pytest.raises(requestTimeout):
+        pool.call("mock-a", slow)
+    assert all(e.healthy and e.failures == 0 and e.outstanding == 0 for e in pool.endpoints)
+    assert sum(e.requests for e in pool.endpoints) == 1
+
+def test_a_host_missing_the_model_stays_up(servers):
+    pool = endpointPool([url for _, url, _ in servers])
+    # The first host lists the model but no longer has it (e.g. removed after the health check)
+    servers[0][2].models.remove("mock-a")
+
+    assert chat_through(pool)
+    first = pool.endpoints[0]
+    assert first.healthy and first.failures == 0 and "mock-a" not in first.models
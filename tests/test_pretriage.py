@@ -0,0 +1,84 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Modules.pretriage import DEFAULT_RULES, apply_rules, pretriage_report
+
+def cases() -> pd.DataFrame:
+    return pd.DataFrame({
+        "ID": [1, 2, 3, 4, 5, 6, 7],
+        "Escala de Glasgow": [7, 15, 15, 15, 15, "n/a", 8],
+        "Frequência Respiratória (ipm)": [16, 16, 16, 16, 16, 16, 16],
+        "Pressão Sistólica (mmHg)": [120, 85, 85, 120, 120, 120, 120],
+        "Frequência Cardíaca (bpm)": [80, 110, 90, 80, 80, 80, 80],
+        "Oximetria (%)": [98, 98, 98, 85, 98, 98, 85],
+        "Temperatura (°C)": [36.5, 36.5, 36.5, 36.5, np.nan, 36.5, 36.5],
+    })
+
+def test_default_accepts_only_vermelho():
+    rules = apply_rules(cases())
+
+    assert rules["rule_answer"].tolist() == ["Vermelho", "Vermelho", None, None, None, None, "Vermelho"]
+    assert rules.loc[1, "rule_reason"].startswith("Choque")
+    # Glasgow 8 and SaO2 85%: only the Vermelho discriminator is reported
+    assert rules.loc[6, "rule_reason"] == "Não responsivo (Glasgow ≤ 8)"
+    assert rules.loc[2, "rule_reason"] is None
+
+def test_laranja_is_opt_in():
+    rules = apply_rules(cases(), accept=("Vermelho", "Laranja"))
+
+    assert rules["rule_answer"].tolist() == ["Vermelho", "Vermelho", None, "Laranja", None, None, "Vermelho"]
+    assert rules.loc[3, "rule_reason"] == "SaO2 muito baixa (< 90%)"
+
+def test_missing_columns_and_values():
+    # Missing, non-numeric values and rules on absent columns never fire
+    table = cases().drop(columns=["Frequência Cardíaca (bpm)"])
+    rules = apply_rules(table)
+
+    assert rules["rule_answer"].tolist() == ["Vermelho", None, None, None, None, None, "Vermelho"]
+    assert apply_rules(table.iloc[:0])["rule_answer"].tolist() == []
+    assert apply_rules(table, rules=())["rule_answer"].isna().all()
+
+def test_rules_are_conjunctions():
+    shock = next(rule for rule in DEFAULT_RULES if rule.name.startswith("Choque"))
+    table = pd.DataFrame({"ID": [1, 2], "Pressão Sistólica (mmHg)": [85, 85], "Frequência Cardíaca (bpm)": [110, 100]})
+
+    assert apply_rules(table, rules=(shock,))["rule_answer"].tolist() == ["Vermelho", None]
+
+def report(route_model=None, models=("model-a", "model-b")) -> pd.DataFrame:
+    rules = apply_rules(cases(), accept=("Vermelho", "Laranja"))
+    correct = pd.DataFrame({"ID": [1, 2, 3, 4, 5, 6, 7],
+                            "Classificacao_Correta": ["Vermelho", "Laranja", "Verde", "Laranja", "Azul", "Verde", "Vermelho"]})
+    return pretriage_report(rules, correct, list(models), n_prompts=2, validation=3, route_model=route_model).set_index("Categoria")
+
+def test_report_skip_mode():
+    total = report().loc["Total"]
+
+    assert total["Casos sinalizados"] == 4
+    assert total["Cobertura"] == pytest.approx(4 / 7)
+    assert total["Acurácia da regra"] == pytest.approx(3 / 4)
+    assert total["Under-triage da regra"] == 0
+    # 4 cases x 2 prompts x 3 runs x 2 models
+    assert total["Chamadas LLM evitadas"] == 48
+    assert total["Chamadas ao modelo de triagem"] == 0
+
+def test_report_route_mode():
+    # Route model among the evaluated ones: its own calls are still made
+    inside = report(route_model="model-a").loc["Total"]
+    assert inside["Chamadas evitadas (modelos avaliados)"] == 24
+    assert inside["Chamadas ao modelo de triagem"] == 0
+    assert inside["Chamadas LLM evitadas"] == 24
+
+    # Cheap model outside the evaluated ones: its calls are subtracted
+    outside = report(route_model="cheap").loc["Total"]
+    assert outside["Chamadas evitadas (modelos avaliados)"] == 48
+    assert outside["Chamadas ao modelo de triagem"] == 24
+    assert outside["Chamadas LLM evitadas"] == 24
+
+    single = report(route_model="cheap", models=("model-a",)).loc["Total"]
+    assert single["Chamadas LLM evitadas"] == 0
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from Modules.prompt_creation import merge_information, merge_information_chunks
+from bench_merge_information import merge_information_rowwise
+
+PROMPTS = pd.DataFrame([{"id": 1, "prompt_text": "Prompt 1"}, {"id": 2, "prompt_text": "Prompt 2"}])
+
+TABLES = {
+    "mixed": pd.DataFrame({"ID": [1, 2, 3], "Idade": [30, 45, 71], "Sexo": ["F", "M", None],
+                           "Temperatura (°C)": [36.5, np.nan, 38.2]}),
+    "float32": pd.DataFrame({"ID": [1, 2], "Oximetria": np.array([0.1, 0.2], dtype=np.float32)}),
+    "float32_missing": pd.DataFrame({"ID": [1, 2], "Oximetria": np.array([0.1, np.nan], dtype=np.float32),
+                                     "Glicemia": np.array([90.5, 55.25], dtype=np.float32)}),
+    "float32_and_text": pd.DataFrame({"ID": [1, 2], "Oximetria": np.array([0.1, np.nan], dtype=np.float32),
+                                      "Sexo": ["F", "M"]}),
+    "integers": pd.DataFrame({"ID": [1, 2], "Idade": [30, 45], "Escala de Glasgow": [15, 8]}),
+}
+
+@pytest.mark.parametrize("name", TABLES)
+def test_columnwise_matches_rowwise(name):
+    cases = TABLES[name]
+    expected, expected_info = merge_information_rowwise(PROMPTS, cases)
+    prompts, info = merge_information(PROMPTS, cases)
+
+    assert prompts.equals(expected)
+    assert info.tolist() == expected_info.tolist()
+
+def test_chunks_match_whole_table():
+    cases = TABLES["mixed"]
+    whole, _ = merge_information(PROMPTS, cases)
+    chunks = [chunk for chunk, _ in merge_information_chunks(PROMPTS, cases, chunksize=2)]
+
+    assert pd.concat(chunks, ignore_index=True).equals(whole)
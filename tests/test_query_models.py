@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import threading
+from collections import Counter
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_ollama import start_server, answer_tokens
+from Modules.endpoints import endpointPool
+from Modules.querie_exec import query_models, answerExtractor, read_stream, run_jobs, queryJob
+from Modules.result_store import resultSink, read_records
+
+PROMPTS = pd.DataFrame({"ID": [1, 2, 3, 4],
+                        "prompt_1": [f"Caso {i}: paciente com dor abdominal há {i} dias." for i in range(1, 5)]})
+
+@pytest.fixture
+def server(request):
+    # Stand-in Ollama host; a test can pass mockConfig arguments through indirect parametrization
+    server, url, config = start_server(port=0, **{"latency": "const:0.02", "tokens_per_sec": 2000, **getattr(request, "param", {})})
+    yield url, config
+    server.shutdown()
+    server.server_close()
+
+def expected_color(text: str) -> str:
+    return json.loads("".join(answer_tokens(text, 6, False)))["resposta"]
+
+def stored_records(path) -> dict:
+    # Last record of each (model, prompt, case, run), as --resume reads them
+    return {(r["model"], r["prompt"], r["case"], r["run"]): r for r in read_records(os.path.join(path, resultSink.filename))}
+
+def count_in_flight(pool: endpointPool) -> Counter:
+    """
+        Wraps pool.call to record the peak number of requests in flight, overall ("all") and per model.
+    """
+
+    peak, current, lock = Counter(), Counter(), threading.Lock()
+    call = pool.call
+
+    def counted(model, request):
+        with lock:
+            current[model] += 1
+            current["all"] += 1
+            peak[model] = max(peak[model], current[model])
+            peak["all"] = max(peak["all"], current["all"])
+        try:
+            return call(model, request)
+        finally:
+            with lock:
+                current[model] -= 1
+                current["all"] -= 1
+
+    pool.call = counted
+    return peak
+
+def test_concurrency_caps(server, tmp_path):
+    url, config = server
+    pool = endpointPool([f"{url}=8"])
+    peak = count_in_flight(pool)
+
+    responses = query_models(PROMPTS, validation=2, model=["mock-a", "mock-b"], path_to_save=str(tmp_path),
+                             concurrency=4, model_concurrency=2, endpoints=pool)
+
+    assert peak == Counter({"all": 4, "mock-a": 2, "mock-b": 2})
+    assert config.stats["requests"] == 2 * 4 * 2
+    # Answers land in their (prompt, case, run) slot whatever the completion order
+    records = stored_records(tmp_path)
+    for answ in responses:
+        for case_id, text in zip(PROMPTS["ID"], PROMPTS["prompt_1"]):
+            assert [records[(answ.model, "prompt_1", case_id, run)]["answer"] for run in range(2)] == [expected_color(text)] * 2
+
+def test_resume_queries_only_the_missing_runs(server, tmp_path):
+    url, config = server
+    with resultSink(str(tmp_path)) as sink:
+        sink.write("mock-a", "prompt_1", 1, 0, "Verde", "stored")
+        sink.write("mock-a", "prompt_1", 1, 1, "Timeout", "Timeout", status="timeout")
+        sink.write("mock-a", "prompt_1", 2, 0, "Failed JSON", "Failed json")
+        sink.write("mock-a", "prompt_1", 2, 1, "Unavailable", "no host", status="unavailable")
+        sink.write("mock-a", "prompt_1", 3, 0, "Azul", "stored")
+        sink.write("mock-a", "prompt_1", 3, 1, "Azul", "stored")
+
+    query_models(PROMPTS, validation=2, model=["mock-a"], path_to_save=str(tmp_path), resume=True,
+                 endpoints=endpointPool([url]))
+
+    # Timeout and Unavailable runs plus the two runs of case 4; stored answers (Failed JSON too) are kept
+    assert config.stats["requests"] == 4
+    records = stored_records(tmp_path)
+    answers = {(case, run): records[("mock-a", "prompt_1", case, run)]["answer"] for case in range(1, 5) for run in range(2)}
+    texts = dict(zip(PROMPTS["ID"], PROMPTS["prompt_1"]))
+    assert answers == {(1, 0): "Verde", (1, 1): expected_color(texts[1]),
+                       (2, 0): "Failed JSON", (2, 1): expected_color(texts[2]),
+                       (3, 0): "Azul", (3, 1): "Azul",
+                       (4, 0): expected_color(texts[4]), (4, 1): expected_color(texts[4])}
+
+def test_adaptive_stops_once_the_majority_is_decided(server, tmp_path):
+    url, config = server
+
+    query_models(PROMPTS, validation=5, model=["mock-a"], path_to_save=str(tmp_path), adaptive=True, concurrency=4,
+                 endpoints=endpointPool([f"{url}=4"]))
+
+    # The stand-in answers every run of a case alike: after 3 agreeing votes of 5 the other 2 cannot change the mode
+    assert config.stats["requests"] == 4 * 3
+    statuses = Counter(record.get("status") for record in stored_records(tmp_path).values())
+    assert statuses == Counter({None: 4 * 3, "skipped": 4 * 2})
+
+@pytest.mark.parametrize("server", [{"malformed_rate": 1.0}], indirect=True)
+def test_adaptive_keeps_sampling_without_votes(server, tmp_path):
+    url, config = server
+
+    query_models(PROMPTS, validation=5, model=["mock-a"], path_to_save=str(tmp_path), adaptive=True,
+                 endpoints=endpointPool([url]))
+
+    # Failed JSON answers are not a colour and do not vote, so every run is sent
+    assert config.stats["requests"] == 4 * 5
+    assert {record["answer"] for record in stored_records(tmp_path).values()} == {"Failed JSON"}
+
+def test_answer_extractor_completes_at_the_closing_brace():
+    extractor = answerExtractor()
+    chunks = ['Pensando {em hipóteses} primeiro.\n```json\n{"resposta": "Ama', 'relo", "explicacao": "dor {moderada}',
+              ' e febre"', '}\n```', " texto depois"]
+
+    assert [extractor.feed(chunk) for chunk in chunks] == [False, False, False, True, True]
+    assert json.loads(extractor.answer) == {"resposta": "Amarelo", "explicacao": "dor {moderada} e febre"}
+
+def test_read_stream_stops_once_the_answer_is_complete():
+    received = []
+
+    def chunks():
+        tokens = ['{"resposta": ', '"Verde"', ', "explicacao": ', '"ok"}', " e mais", " texto"]
+        try:
+            for token in tokens:
+                received.append(token)
+                yield {"message": {"role": "assistant", "content": token}, "done": False}
+            yield {"message": {"role": "assistant", "content": ""}, "done": True, "eval_count": len(tokens)}
+        finally:
+            received.append("closed")
+
+    reply = read_stream(chunks(), start=0.0)
+
+    assert received == ['{"resposta": ', '"Verde"', ', "explicacao": ', '"ok"}', "closed"]
+    assert reply["content"] == '{"resposta": "Verde", "explicacao": "ok"}'
+    assert reply["stopped_early"] and reply["eval_count"] == 4 and reply["total_duration"] is None
+
+@pytest.mark.parametrize("server, stopped", [({}, True), ({"malformed_rate": 1.0}, False)], indirect=["server"])
+def test_streamed_runs(server, stopped, tmp_path):
+    url, config = server
+
+    query_models(PROMPTS, validation=1, model=["mock-a"], path_to_save=str(tmp_path), stream=True,
+                 endpoints=endpointPool([url]))
+
+    texts = dict(zip(PROMPTS["ID"], PROMPTS["prompt_1"]))
+    for (_, _, case_id, _), record in stored_records(tmp_path).items():
+        assert record["answer"] == (expected_color(texts[case_id]) if stopped else "Failed JSON")
+        assert record["stopped_early"] is stopped
+        # Cancelled generations carry no Ollama timings; answers read to the end do
+        assert (record["total_duration"] is None) is stopped
+        assert 0 < record["ttft"] <= record["wall_time"]
+        if stopped:
+            assert record["ttft"] <= record["time_to_answer"] <= record["wall_time"]
+
+def test_a_hedged_request_cancels_the_slower_copy():
+    started = [start_server(port=0, latency=latency, tokens_per_sec=2000) for latency in ("const:0.01", "const:0.5")]
+    try:
+        pool = endpointPool([url for _, url, _ in started])
+        outcomes = []
+        call = pool.call
+
+        def recorded(model, request):
+            try:
+                result = call(model, request)
+            except Exception as e:
+                outcomes.append(type(e).__name__)
+                raise
+            outcomes.append("answered")
+            return result
+
+        pool.call = recorded
+        replies = {}
+
+        def on_done(job, reply):
+            replies[job.case_id] = reply
+        jobs = [queryJob("mock-a", "prompt_1", case_id, 0, text) for case_id, text in zip(PROMPTS["ID"][:2], PROMPTS["prompt_1"])]
+
+        # The first request goes to the fast host and gives the latency sample; the second one, still
+        # waiting on the slow host past that latency, is sent again to the fast host
+        run_jobs(jobs, on_done, concurrency=2, endpoints=pool,
+                 hedge_after=50, hedge_min_samples=1)
+
+        assert [bool(replies[case_id].get("hedged")) for case_id in (1, 2)] == [False, True]
+        assert [json.loads(replies[job.case_id]["content"])["resposta"] for job in jobs] == [expected_color(job.text) for job in jobs]
+        # The copy on the slow host is cancelled, without marking the host down
+        assert sorted(outcomes) == ["answered", "answered", "requestCancelled"]
+        fast, slow = pool.endpoints
+        assert (fast.requests, slow.requests) == (2, 1)
+        assert slow.healthy and slow.failures == 0
+    finally:
+        for server, _, _ in started:
+            server.shutdown()
+            server.server_close()
+
+@pytest.mark.parametrize("server", [{"latency": "const:0.5"}], indirect=True)
+def test_a_request_past_its_deadline_is_stored_as_a_timeout(server, tmp_path):
+    url, config = server
+    pool = endpointPool([f"{url}=4"])
+
+    query_models(PROMPTS, validation=1, model=["mock-a"], path_to_save=str(tmp_path), concurrency=4, timeout=0.1,
+                 endpoints=pool)
+
+    records = stored_records(tmp_path).values()
+    assert {(record["answer"], record["status"]) for record in records} == {("Timeout", "timeout")}
+    assert all(record["wall_time"] < 0.5 + 0.3 for record in records)
+    assert pool.endpoints[0].healthy and pool.endpoints[0].failures == 0
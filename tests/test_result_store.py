@@ -0,0 +1,61 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Modules.result_store import read_records, resultSink
+
+def test_read_skips_a_truncated_line(tmp_path):
+    with resultSink(str(tmp_path)) as sink:
+        sink.write("model", "prompt_1", np.int64(1), 0, "Verde", "explicação", wall_time=np.float64(1.5))
+        sink.write("model", "prompt_1", 2, 0, "Azul", None)
+
+    with open(sink.file_path, "rb+") as f:
+        f.truncate(os.path.getsize(sink.file_path) - 10)
+
+    records = read_records(sink.file_path)
+    assert records == [{"model": "model", "prompt": "prompt_1", "case": 1, "run": 0, "answer": "Verde",
+                        "explanation": "explicação", "wall_time": 1.5}]
+
+def test_stored_keeps_the_last_record(tmp_path):
+    with resultSink(str(tmp_path)) as sink:
+        sink.write("model", "prompt_1", 1, 0, "Timeout", None, status="timeout")
+        sink.write("model", "prompt_1", np.int64(2), 0, "Verde", "ok")
+        stored = sink.stored()
+        # Written after the index was built
+        sink.write("model", "prompt_1", 1, 0, "Azul", "retry")
+
+        assert stored[("model", "prompt_1", 1, 0)]["status"] == "timeout"
+        assert sink.stored()[("model", "prompt_1", 1, 0)]["answer"] == "Azul"
+        assert list(sink.stored(cases=[np.int64(2)])) == [("model", "prompt_1", 2, 0)]
+
+def test_resume_after_a_truncated_write(tmp_path):
+    with resultSink(str(tmp_path)) as sink:
+        for case in range(3):
+            sink.write("model", "prompt_1", case, 0, "Verde", "explicação")
+
+    with open(sink.file_path, "rb+") as f:
+        f.truncate(os.path.getsize(sink.file_path) - 10)
+
+    with resultSink(str(tmp_path), append=True) as sink:
+        assert sorted(key[2] for key in sink.stored()) == [0, 1]
+        sink.write("model", "prompt_1", 2, 0, "Azul", "de novo")
+        assert sink.stored()[("model", "prompt_1", 2, 0)]["answer"] == "Azul"
+
+    assert [r["case"] for r in read_records(sink.file_path)] == [0, 1, 2]
+
+def test_export_full_responses(tmp_path):
+    with resultSink(str(tmp_path)) as sink:
+        for case in (1, 2):
+            for run in range(2):
+                sink.write("model", "prompt_1", case, run, "Verde", f"{case}-{run}")
+        sink.write("other", "prompt_1", 1, 0, "Azul", None)
+        sink.export_full_responses("model")
+
+    table = pd.read_csv(tmp_path / "model" / "full_responses.csv")
+    assert list(table.columns) == ["ID", "prompt_1 (1x)", "prompt_1 (2x)", "prompt_1 (1x) Explanation", "prompt_1 (2x) Explanation"]
+    assert table["ID"].tolist() == [1, 2]
+    assert table["prompt_1 (2x) Explanation"].tolist() == ["1-1", "2-1"]
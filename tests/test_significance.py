@@ -0,0 +1,88 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Modules import significance
+from Modules.aggregation import MTS_LABELS
+from Modules.significance import CI_METRICS, _totals, _weighted_sums, bootstrap_ci, case_indicators, metrics_from_sums, permutation_tests
+from Modules.statistics import triage_metrics
+
+MODELS = ["model-a", "model-b"]
+PROMPTS = ["prompt_1", "prompt_2"]
+
+def random_run(seed: int, n_cases: int = 50, runs: int = 3):
+    rng = np.random.default_rng(seed)
+    pool = np.array(list(MTS_LABELS) + ["Failed JSON"], dtype=object)
+    predictions = rng.choice(pool, size=(len(MODELS), n_cases, len(PROMPTS), runs))
+    y_true = rng.choice(np.array(MTS_LABELS, dtype=object), size=n_cases)
+    predictions[1, :4, 1, :] = "Failed JSON"
+    return predictions, y_true
+
+def metric_table(predictions, y_true) -> dict:
+    metrics = triage_metrics(predictions, y_true, MODELS, PROMPTS)[0]
+    return {metric: metrics[metric].to_numpy().reshape(len(MODELS), len(PROMPTS)) for metric in CI_METRICS}
+
+def test_indicators_reproduce_triage_metrics():
+    predictions, y_true = random_run(0)
+    sums = metrics_from_sums(_totals(case_indicators(predictions, y_true)), len(y_true))
+    expected = metric_table(predictions, y_true)
+
+    for metric in CI_METRICS:
+        assert np.allclose(sums[metric][..., 0], expected[metric], equal_nan=True), metric
+
+def test_weighted_sums_match_a_resampled_run():
+    # A bootstrap replicate is the same as recomputing the metrics on the resampled cases
+    predictions, y_true = random_run(1)
+    index = np.random.default_rng(5).integers(0, len(y_true), size=len(y_true))
+    weights = np.bincount(index, minlength=len(y_true))[None, :]
+    replicate = metrics_from_sums(_weighted_sums(case_indicators(predictions, y_true), weights), len(y_true))
+    expected = metric_table(predictions[:, index], y_true[index])
+
+    for metric in CI_METRICS:
+        assert np.allclose(replicate[metric][..., 0], expected[metric], equal_nan=True), metric
+
+def test_bootstrap_ci():
+    predictions, y_true = random_run(2)
+    ci = bootstrap_ci(predictions, y_true, MODELS, PROMPTS, n_resamples=500, seed=3)
+    expected = metric_table(predictions, y_true)
+
+    assert len(ci) == len(MODELS) * len(PROMPTS) * len(CI_METRICS)
+    for row in ci.to_dict("records"):
+        estimate = expected[row["Métrica"]][MODELS.index(row["Model"]), PROMPTS.index(row["Prompt"])]
+        assert row["Estimativa"] == pytest.approx(estimate)
+        assert row["IC inferior"] <= row["Estimativa"] <= row["IC superior"]
+    assert ci.equals(bootstrap_ci(predictions, y_true, MODELS, PROMPTS, n_resamples=500, seed=3))
+
+def test_bootstrap_does_not_depend_on_workers(monkeypatch):
+    predictions, y_true = random_run(3)
+    # Several chunks of replicates, so the pool has work to split
+    monkeypatch.setattr(significance, "_CHUNK_CELLS", len(y_true) * 25)
+    in_process = bootstrap_ci(predictions, y_true, MODELS, PROMPTS, n_resamples=100, seed=1)
+    pooled = bootstrap_ci(predictions, y_true, MODELS, PROMPTS, n_resamples=100, seed=1, workers=2)
+
+    assert in_process.equals(pooled)
+
+def test_permutation_identical_configurations():
+    predictions, y_true = random_run(4)
+    predictions[1] = predictions[0]
+    tests = permutation_tests(predictions, y_true, MODELS, PROMPTS, n_permutations=200, pairs=[((0, 0), (1, 0))])
+
+    assert (tests["Diferença"] == 0).all()
+    assert (tests["p-valor"] == 1).all()
+
+def test_permutation_detects_a_real_difference():
+    predictions, y_true = random_run(5, n_cases=80)
+    predictions[0, :, 0, :] = y_true[:, None]
+    tests = permutation_tests(predictions, y_true, MODELS, PROMPTS, n_permutations=500, seed=2)
+    accuracy = tests[(tests["Métrica"] == "Acurácia (moda)") & (tests["Model A"] == "model-a") & (tests["Prompt A"] == "prompt_1")
+                     & (tests["Prompt B"] == "prompt_1")].iloc[0]
+
+    assert accuracy["A"] == 1
+    assert accuracy["Diferença"] > 0.5
+    assert accuracy["p-valor"] < 0.01
+    # p-values are never below the resolution of the test
+    assert (tests["p-valor"].dropna() >= 1 / 501).all()
@@ -0,0 +1,104 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from sklearn.metrics import accuracy_score, confusion_matrix, precision_recall_fscore_support
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Modules.aggregation import MTS_LABELS, aggregate_answers, normalize_answers
+from Modules.statistics import NO_ANSWER, triage_metrics
+
+MODELS = ["model-a", "model-b"]
+PROMPTS = ["prompt_1", "prompt_2"]
+
+def random_run(seed: int, n_cases: int = 60, runs: int = 3):
+    rng = np.random.default_rng(seed)
+    pool = np.array(list(MTS_LABELS) + ["Failed JSON", None], dtype=object)
+    # Mostly colours, so some cases have a mode and some do not
+    weights = np.array([0.16] * len(MTS_LABELS) + [0.12, 0.08])
+    predictions = rng.choice(pool, size=(len(MODELS), n_cases, len(PROMPTS), runs), p=weights)
+    y_true = rng.choice(np.array(MTS_LABELS, dtype=object), size=n_cases)
+    # Casos sem nenhuma resposta válida
+    predictions[0, :5, 0, :] = "Failed JSON"
+    return predictions, y_true
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_mode_metrics_match_sklearn(seed):
+    predictions, y_true = random_run(seed)
+    metrics, _, _ = triage_metrics(predictions, y_true, MODELS, PROMPTS)
+    mode, _ = aggregate_answers(predictions)
+
+    for m, model in enumerate(MODELS):
+        for p, prompt in enumerate(PROMPTS):
+            y_pred = np.where(mode[m, :, p] == None, NO_ANSWER, mode[m, :, p]).astype(str)
+            precision, recall, f1, _ = precision_recall_fscore_support(y_true.astype(str), y_pred, average="macro", zero_division=0)
+            row = metrics[(metrics["Model"] == model) & (metrics["Prompt"] == prompt)].iloc[0]
+
+            assert row["Acurácia (moda)"] == pytest.approx(accuracy_score(y_true.astype(str), y_pred))
+            assert row["Precisão (moda)"] == pytest.approx(precision)
+            assert row["Recall (moda)"] == pytest.approx(recall)
+            assert row["F1 (moda)"] == pytest.approx(f1)
+
+def test_confusion_matches_sklearn():
+    predictions, y_true = random_run(3)
+    _, confusion, labels = triage_metrics(predictions, y_true, MODELS, PROMPTS)
+    mode, _ = aggregate_answers(predictions)
+
+    assert labels[-1] == NO_ANSWER
+    for m in range(len(MODELS)):
+        for p in range(len(PROMPTS)):
+            y_pred = np.where(mode[m, :, p] == None, NO_ANSWER, mode[m, :, p]).astype(str)
+            expected = confusion_matrix(y_true.astype(str), y_pred, labels=labels.astype(str))
+            assert (confusion[m, p] == expected).all()
+
+def test_cases_without_mode_lower_recall():
+    y_true = np.array(["Vermelho", "Vermelho", "Verde"], dtype=object)
+    predictions = np.array([["Vermelho"], ["Failed JSON"], ["verde"]], dtype=object)[None, :, None, :]
+    metrics, _, _ = triage_metrics(predictions, y_true, ["model"], ["prompt"])
+    row = metrics.iloc[0]
+
+    assert row["Acurácia (moda)"] == pytest.approx(2 / 3)
+    # Vermelho: recall 1/2; Verde: 1; "sem resposta": 0 -> (0.5 + 1 + 0) / 3
+    assert row["Recall (moda)"] == pytest.approx(0.5)
+    assert row["Precisão (moda)"] == pytest.approx(2 / 3)
+
+def test_under_and_over_triage():
+    y_true = np.array(["Amarelo", "Amarelo", "Amarelo", "Amarelo"], dtype=object)
+    predictions = np.array([["Vermelho"], ["Verde"], ["Azul"], ["Amarelo"]], dtype=object)[None, :, None, :]
+    row = triage_metrics(predictions, y_true, ["model"], ["prompt"])[0].iloc[0]
+
+    # Menos urgente que o correto = under-triage
+    assert row["Under-triage (moda)"] == pytest.approx(2 / 3)
+    assert row["Over-triage (moda)"] == pytest.approx(1 / 3)
+
+def test_overall_statistics_count_every_run():
+    y_true = np.array(["Verde", "Azul"], dtype=object)
+    predictions = np.array([["Verde", "Verde", "Failed JSON"], ["Azul", "Verde", "Verde"]], dtype=object)[None, :, None, :]
+    row = triage_metrics(predictions, y_true, ["model"], ["prompt"])[0].iloc[0]
+
+    # Failed JSON counts as a wrong answer in the overall accuracy
+    assert row["Acurácia geral"] == pytest.approx(3 / 6)
+    assert row["Acurácia (moda)"] == pytest.approx(1 / 2)
+    # Pairs of runs agreeing: case 1 -> 1 of 1, case 2 -> 1 of 3
+    assert row["Concordância média"] == pytest.approx((1 + 1 / 3) / 2)
+
+def test_spellings_are_the_same_answer():
+    y_true = np.array(["Vermelho", "Azul"], dtype=object)
+    plain = np.array([["Vermelho", "Vermelho"], ["Azul", "Azul"]], dtype=object)[None, :, None, :]
+    spelled = np.array([["red", " vermelho"], ["Blue", "azul"]], dtype=object)[None, :, None, :]
+
+    assert (normalize_answers(spelled) == plain).all()
+    assert triage_metrics(plain, y_true, ["m"], ["p"])[0].equals(triage_metrics(spelled, y_true, ["m"], ["p"])[0])
+
+def test_margin_only_with_enough_runs():
+    y_true = np.array(["Verde", "Azul"], dtype=object)
+    three = np.array([["Verde", "Verde", "Azul"], ["Azul", "Azul", "Azul"]], dtype=object)[None, :, None, :]
+    five = np.array([["Verde", "Verde", "Verde", "Azul", "Amarelo"], ["Azul", "Azul", "Azul", "Verde", "Verde"]], dtype=object)[None, :, None, :]
+
+    # With 3 runs the margin would only repeat the agreement
+    assert "Margem média (moda)" not in triage_metrics(three, y_true, ["m"], ["p"])[0].columns
+    row = triage_metrics(five, y_true, ["m"], ["p"])[0].iloc[0]
+    assert row["Margem média (moda)"] == pytest.approx((2 / 5 + 1 / 5) / 2)
+    assert row["Margem média (moda)"] != pytest.approx(row["Concordância média"])